@@ -0,0 +1,242 @@
+# coding: utf-8
+"""
+asyncio client for the lantern electronics, as an alternative to the threaded BaseDriver.
+
+It uses the same PackerUnpacker and the same ZMQ ports (it binds the TC port, so it replaces the
+threaded driver in a process). Every command of LanternDriver is awaitable and returns its TC once
+acknowledged, and the telemetry can be read with async iterators:
+
+    async def main():
+        async with AsyncLanternDriver(config = config) as ald:
+            await asyncio.gather(ald.move_piezo(0, 0), ald.set_modulation_scale(1.0))
+            tc = await ald.get_version()
+            print(tc.reply[0]["data"]["tc_reply_data"])
+            async for hk in ald.hk():
+                print(hk["data"]["temperature"])
+"""
+import asyncio
+import collections
+import time
+from byt import Byt
+import zmq
+import zmq.asyncio
+from .packerUnpacker import PackerUnpacker
+from .baseDriver import BaseDriver
+from .lanternDriver import LanternDriver
+
+context = zmq.asyncio.Context()
+
+class AsyncTC(object):
+    """ a tc sent by the asyncio driver, with its acks/replies """
+    def __init__(self, tc_dict, *args, **kwargs):
+        self.packet = tc_dict
+        self.command_id = tc_dict["data"]["command_id"]
+        self.packet_id = tc_dict["header"]["packet_id"]
+        self.eack = None
+        self.reply = []
+        self.time_sent = None
+        self.time_eack = None
+        self.time_reply = None
+        self._eack_event = asyncio.Event()
+        self._reply_condition = asyncio.Condition()
+        return None
+
+    async def attach_packet(self, packet, is_ack = False, is_reply = False):
+        if is_ack:
+            self.eack = packet
+            self.time_eack = time.time()
+            self._eack_event.set()
+        if is_reply:
+            async with self._reply_condition:
+                self.reply.append(packet)
+                if self.time_reply is None:
+                    self.time_reply = time.time()
+                self._reply_condition.notify_all()
+        return None
+
+    async def result(self, timeout = 3, nreplies = 0):
+        """
+        wait for the EACK (and for nreplies replies) of this tc, and raise an exception if the
+        timeout (in s) expired or if an error occured. The timeout is for the EACK and the replies
+        together, None waits forever. Returns the tc.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(self._eack_event.wait(), timeout)
+            error = self.eack["data"]["error"]
+            if error != "OK":
+                raise Exception("Error {} occured".format(error))
+            if len(self.reply) < nreplies:
+                remaining = None if deadline is None else max(0, deadline - time.monotonic())
+                await asyncio.wait_for(self.wait_replies(nreplies), remaining)
+        except asyncio.TimeoutError:
+            raise Exception("Timeout!")
+        return self
+
+    async def wait_replies(self, nreplies = 1):
+        """ wait until this tc has at least nreplies replies """
+        async with self._reply_condition:
+            await self._reply_condition.wait_for(lambda: len(self.reply) >= nreplies)
+        return self
+
+    async def wait_reply_points(self, field, npoints):
+        """ wait until the replies of this tc contain at least npoints values of the given field of tc_reply_data """
+        def received():
+            return sum([len(r["data"]["tc_reply_data"][field]) for r in self.reply]) >= npoints
+        async with self._reply_condition:
+            await self._reply_condition.wait_for(received)
+        return self
+
+
+class AsyncBaseDriver(object):
+    def __init__(self, config = None, verbose_level = 0, timeout = 3, max_tcs = 1000, stream_size = 1000):
+        """
+        @param timeout: default time (in s) to wait for the EACK and replies of a command
+        @param max_tcs: number of tcs kept to attach their acks/replies
+        @param stream_size: number of telemetry packets buffered for each async iterator, the oldest
+        packets are dropped if the reader is too slow
+        """
+        if config is None:
+            raise Exception("please provide a valid configuration dictionnary")
+        self.config = config
+        self.verbose_level = verbose_level
+        self.timeout = timeout
+        self.max_tcs = max_tcs
+        self.stream_size = stream_size
+        self.connected = False
+        self.packetid = 0
+        self.sysid = self.config["general"]["system_id"]
+        self.punp = PackerUnpacker(config = config)
+        self.tcs = collections.OrderedDict()
+        self._streams = {}
+        self._receiver_task = None
+        return None
+
+    # same packing as the threaded driver
+    generate_tc_from_data = BaseDriver.generate_tc_from_data
+    encode_command = BaseDriver.encode_command
+
+    async def connect(self):
+        if self.connected:
+            print("Already connected!")
+            return None
+        self.sender = context.socket(zmq.PUB)
+        self.sender.bind(self.config["zmq_connection"]["tc_port"])
+        self.receiver = context.socket(zmq.SUB)
+        self.receiver.connect(self.config["zmq_connection"]["tm_port"])
+        self.receiver.subscribe("")
+        self._receiver_task = asyncio.ensure_future(self._receive())
+        self.connected = True
+        return None
+
+    async def disconnect(self):
+        if not(self.connected):
+            print("Not connected")
+            return None
+        self._receiver_task.cancel()
+        try:
+            await self._receiver_task
+        except asyncio.CancelledError:
+            pass
+        self.sender.close()
+        self.receiver.close()
+        self.connected = False
+        return None
+
+    async def _receive(self):
+        while True:
+            byte = await self.receiver.recv()
+            await self.process_tm(byte)
+
+    async def process_tm(self, byte):
+        """ unpack a TM received from the listener, attach it to its TC or forward it to the telemetry streams """
+        try:
+            packet = self.punp.unpack(Byt(byte))
+        except:
+            print("Got TM but unpack failed: "+Byt(byte).hex())
+            return None
+        packet_type = packet["header"]["packet_type"]
+        if self.verbose_level == 3:
+            print("Got TM - {}".format(packet))
+        is_eack = (packet_type == self.punp.eack_packet_type)
+        is_reply = (packet_type == self.punp.tc_reply_packet_type)
+        if (is_eack or is_reply):
+            tc = self.tcs.get(packet["data"]["packet_id"])
+            if not(tc is None):
+                await tc.attach_packet(packet, is_ack = is_eack, is_reply = is_reply)
+        for queue in self._streams.get(packet_type, []):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(packet)
+        return None
+
+    async def send_command(self, command_id, *values):
+        """ send a command given its id and its parameters (in the order of the YML description) """
+        tcPacket, command_dict = self.encode_command(command_id, values)
+        return await self.send_packet(tcPacket, command_dict)
+
+    async def simple_send_command(self, command_dict):
+        return await self.send_packet(self.punp.pack(command_dict), command_dict)
+
+    async def send_packet(self, tcPacket, command_dict):
+        """
+        send a tc and wait for its EACK, and for its first reply if the command has a reply.
+        Raise an exception on timeout or error, and return the tc.
+        """
+        if not(self.connected):
+            raise Exception("Driver not connected!")
+        tc = AsyncTC(command_dict)
+        self.tcs[tc.packet_id] = tc
+        if len(self.tcs) > self.max_tcs:
+            self.tcs.popitem(last = False)
+        tc.time_sent = time.time()
+        await self.sender.send(tcPacket)
+        reply_desc = self.punp.tc_reply_data_desc.get(tc.command_id)
+        nreplies = 0
+        if not(reply_desc is None) and (reply_desc["length"] != 0):
+            nreplies = 1
+        return await tc.result(timeout = self.timeout, nreplies = nreplies)
+
+    async def stream(self, name):
+        """ async iterator over the telemetry packets of the given type (name from the tm_packet_data descriptor) """
+        packet_type = self.punp.tm_packet_types[name]
+        queue = asyncio.Queue(self.stream_size)
+        self._streams.setdefault(packet_type, []).append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._streams[packet_type].remove(queue)
+
+
+class AsyncLanternDriver(LanternDriver):
+    """
+    asyncio version of LanternDriver: all the commands are coroutines, and several commands can be
+    sent concurrently with asyncio.gather.
+    """
+    def __init__(self, *args, **kwargs):
+        self._driver = AsyncBaseDriver(*args, **kwargs)
+        return None
+
+    async def __aenter__(self):
+        await self._driver.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._driver.disconnect()
+        return False
+
+    def transaction(self, *args, **kwargs):
+        raise Exception("Not available in the asyncio driver, use asyncio.gather to send commands concurrently")
+
+    def hk(self):
+        """ async iterator over the housekeeping packets """
+        return self._driver.stream("hk")
+
+    def control_data(self):
+        """ async iterator over the control_data packets """
+        return self._driver.stream("control_data")
+
+    def event_report(self):
+        """ async iterator over the event_report packets """
+        return self._driver.stream("event_report")
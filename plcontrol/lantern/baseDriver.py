@@ -3,6 +3,10 @@ from byt import Byt
 import zmq
 from .packerUnpacker import PackerUnpacker
 import time
+import threading
+import collections
+import pickle
+import numpy as np
 from .utils import StoppableThread
 
 context = zmq.Context()
@@ -15,54 +19,263 @@ class TC(object):
         self.packet_id = tc_dict["header"]["packet_id"]
         self.eack = None
         self.reply = []
+        # timestamps for latency measurements
+        self.time_sent = None
+        self.time_eack = None
+        self.time_reply = None
+        # notification of the waiting threads
+        self.eack_event = threading.Event()
+        self.reply_condition = threading.Condition()
         return None
     
     def attach_packet(self, packet, is_ack = False, is_reply = False):
         if is_ack:
             self.eack = packet            
+            self.time_eack = time.time()
+            self.eack_event.set()
         if is_reply:
-            self.reply.append(packet)         
+            with self.reply_condition:
+                self.reply.append(packet)         
+                if self.time_reply is None:
+                    self.time_reply = time.time()
+                self.reply_condition.notify_all()
+        return None
+
+    def wait_eack(self, timeout = None):
+        """ wait for the EACK of this tc, return False if the timeout (in s) expired """
+        return self.eack_event.wait(timeout)
+
+    def wait_replies(self, nreplies = 1, timeout = None):
+        """ wait until this tc has at least nreplies replies, return False if the timeout (in s) expired """
+        with self.reply_condition:
+            return self.reply_condition.wait_for(lambda: len(self.reply) >= nreplies, timeout)
+
+    def wait_reply_points(self, field, npoints, timeout = None):
+        """
+        wait until the replies of this tc contain at least npoints values of the given field of
+        tc_reply_data (for the commands which reply with several packets), return False if the
+        timeout (in s) expired
+        """
+        def received():
+            return sum([len(r["data"]["tc_reply_data"][field]) for r in self.reply]) >= npoints
+        with self.reply_condition:
+            return self.reply_condition.wait_for(received, timeout)
+
+    def done(self):
+        """ True if the EACK of this tc has been received """
+        return self.eack_event.is_set()
+
+    def result(self, timeout = 3, nreplies = 0):
+        """
+        wait for the EACK (and for nreplies replies) of this tc, and raise an exception if the
+        timeout (in s) expired or if an error occured. timeout = None waits forever.
+        Returns the tc, so that the replies can be read.
+        """
+        t0 = time.time()
+        if not(self.wait_eack(timeout)):
+            raise Exception("Timeout!")
+        error = self.eack["data"]["error"]
+        if error != "OK":
+            raise Exception("Error {} occured".format(error))
+        if nreplies > 0:
+            remaining = None if timeout is None else max(0, timeout - (time.time() - t0))
+            if not(self.wait_replies(nreplies, remaining)):
+                raise Exception("Timeout!")
+        return self
+
+    def __getstate__(self):
+        # events and conditions cannot be pickled (for spilling to file)
+        state = self.__dict__.copy()
+        del state["eack_event"], state["reply_condition"]
+        return state
+
+    def __setstate__(self, state):
+        # recreate them when reading back a spill file, in the state of the received packets
+        self.__dict__.update(state)
+        self.eack_event = threading.Event()
+        if not(self.eack is None):
+            self.eack_event.set()
+        self.reply_condition = threading.Condition()
         return None
 
 
 class Db(object):
-    """ a simple object to represent a tm/tc database which can associate acks/replies to tcs """
-    def __init__(self, *args, **kwargs):
-        self.tcs = []
-        self.tms = []
+    """
+    a simple object to represent a tm/tc database which can associate acks/replies to tcs
+
+    The tcs are indexed by packet_id, and only the last max_tcs tcs are kept in memory. The tms are
+    kept by packet type, with at most max_tms[packet_type] packets for each type (max_tms[None] being
+    the default limit). If spill_file is given, the records dropped from memory are appended to it
+    (see read_spill_file).
+    """
+    def __init__(self, max_tcs = 1000, max_tms = None, spill_file = None, *args, **kwargs):
+        self.max_tcs = max_tcs
+        self.max_tms = {None: 1000}
+        if not(max_tms is None):
+            self.max_tms.update(max_tms)
+        self.tcs = collections.deque()
+        self.tc_index = {}
+        self.tms = {}
+        self.spill_file = spill_file
+        self._spill_handle = None
+        self._lock = threading.Lock()
         return None
     
     def push_tm(self, packet, is_ack = False, is_reply = False):
-        self.tms.append(packet)
+        packet_type = packet["header"]["packet_type"]
+        with self._lock:
+            if not(packet_type in self.tms):
+                self.tms[packet_type] = collections.deque()
+            tms = self.tms[packet_type]
+            tms.append(packet)
+            if len(tms) > self.max_tms.get(packet_type, self.max_tms[None]):
+                self._spill("TM", tms.popleft())
         if (is_ack or is_reply):
             try:
-                ids = [tc.packet_id for tc in self.tcs]
-                packet_id = packet["data"]["packet_id"]
-                if packet_id in ids:
-                    index = ids.index(packet_id)
-                    self.tcs[index].attach_packet(packet, is_ack = is_ack, is_reply = is_reply)
+                tc = self.tc_index.get(packet["data"]["packet_id"])
+                if not(tc is None):
+                    tc.attach_packet(packet, is_ack = is_ack, is_reply = is_reply)
             except:
                 print("Failed to attach packet to TC")       
         return None
     
     def push_tc(self, packet):
-        self.tcs.append(packet)
+        with self._lock:
+            self.tcs.append(packet)
+            self.tc_index[packet.packet_id] = packet
+            if len(self.tcs) > self.max_tcs:
+                old = self.tcs.popleft()
+                # packet ids restart from 0 with a new driver, do not remove a more recent tc
+                if self.tc_index.get(old.packet_id) is old:
+                    del self.tc_index[old.packet_id]
+                self._spill("TC", old)
+        return None
+
+    def get_tc(self, packet_id):
+        """ return the tc with the given packet_id (None if unknown or no more in memory) """
+        return self.tc_index.get(packet_id)
+
+    def get_tms(self, packet_type):
+        """ return the list of tms of a given packet type still in memory """
+        return list(self.tms.get(packet_type, []))
+
+    def _spill(self, kind, record):
+        if self.spill_file is None:
+            return None
+        if self._spill_handle is None:
+            self._spill_handle = open(self.spill_file, "ab")
+        pickle.dump((kind, time.time(), record), self._spill_handle)
+        return None
+
+    def close(self):
+        """ close the spill file (it is re-opened in append mode if needed) """
+        with self._lock:
+            if not(self._spill_handle is None):
+                self._spill_handle.close()
+                self._spill_handle = None
+        return None
+
+    @staticmethod
+    def read_spill_file(filename):
+        """ iterate over the (kind, time, record) tuples saved in a spill file """
+        with open(filename, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
 
     def validate_last_tc(self, timeout = 3):
         """
         wait for ack for last tc sent and raise and exception if an error occured
         """
-        t0 = time.time()
-        while (self.tcs[-1].eack is None):
-            time.sleep(0.1)
-            if (time.time() - t0) > timeout:
-                raise Exception("Timeout!")
-        error = self.tcs[-1].eack["data"]["error"]
-        if error != "OK":
-            raise Exception("Error {} occured".format(error))
+        self.tcs[-1].result(timeout = timeout)
         return True        
 
 
+def wait_all(tcs, timeout = 3, nreplies = 0):
+    """
+    wait for the EACK (and nreplies replies) of all the given tcs, within a global timeout (in s).
+    Raise an exception on the first timeout or error. Returns the list of tcs.
+    """
+    t0 = time.time()
+    for tc in tcs:
+        tc.result(timeout = max(0, timeout - (time.time() - t0)), nreplies = nreplies)
+    return list(tcs)
+
+
+class Transaction(object):
+    """
+    a group of tcs sent back to back, without waiting for the EACK of a tc before sending the next.
+
+    All the tcs sent by the driver inside the with block are collected, their EACKs are matched by
+    packet_id, and the errors of all the commands are reported together in a single exception when
+    leaving the block. barrier() waits for all the tcs sent so far, for the commands which the firmware
+    can only execute once the previous ones are done. At most max_in_flight tcs are left unacknowledged,
+    to avoid overflowing the input buffer of the board.
+
+        with ld.transaction() as tr:
+            ld.set_modulation_scale(1.0)
+            ld.set_glitch_beacon_params(frame = 10, extra_delay = 15)
+            tr.barrier()
+            tc = ld.get_glitch_beacon_params()
+    """
+    def __init__(self, driver, timeout = 3, max_in_flight = 8):
+        self.driver = driver
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.tcs = []
+        self.errors = []
+        self._nchecked = 0 # the tcs before this index have been acknowledged (or failed)
+        return None
+
+    def __enter__(self):
+        if not(self.driver._transaction is None):
+            raise Exception("A transaction is already open on this driver")
+        self.driver._transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.driver._transaction = None
+        if exc_type is None:
+            self.wait()
+        return False
+
+    def before_send(self):
+        """ called by the driver before sending a tc: wait for the oldest tcs if too many are in flight """
+        if (len(self.tcs) - self._nchecked) >= self.max_in_flight:
+            self._check(self._nchecked + 1)
+        return None
+
+    def add(self, tc):
+        self.tcs.append(tc)
+        return None
+
+    def _check(self, upto):
+        """ wait for the EACKs of the tcs up to index upto (excluded) and record the errors """
+        t0 = time.time()
+        for tc in self.tcs[self._nchecked:upto]:
+            try:
+                tc.result(timeout = max(0, self.timeout - (time.time() - t0)))
+            except Exception as e:
+                name = self.driver.punp.tc_command_names.get(tc.command_id)
+                self.errors.append("{} (packet_id {}): {}".format(name, tc.packet_id, e))
+            self._nchecked = self._nchecked + 1
+        return None
+
+    def barrier(self):
+        """ wait for all the tcs sent so far, and raise an exception if any of them failed """
+        self._check(len(self.tcs))
+        if len(self.errors) > 0:
+            raise Exception("{} command(s) failed in transaction:\n{}".format(len(self.errors), "\n".join(self.errors)))
+        return None
+
+    def wait(self):
+        """ wait for all the tcs of the transaction and return them """
+        self.barrier()
+        return self.tcs
+
+
 class BaseDriver(StoppableThread):
     def __init__(self, config = None, verbose_level = 0, **kwargs):
         """ 
@@ -81,7 +294,10 @@ class BaseDriver(StoppableThread):
         self.packetid = 0
         self.sysid = self.config["general"]["system_id"]
         self.punp = PackerUnpacker(config = config)
-        self.db = Db()
+        self.db = Db(**self.config.get("db", {}))
+        self.poll_timeout = 0.1 # in s, maximum time for the receiver to notice it has been stopped
+        self.loop_stats = {"wakeups": 0, "messages": 0, "max_batch": 0}
+        self._transaction = None
         return None
 
     def connect(self):
@@ -111,7 +327,7 @@ class BaseDriver(StoppableThread):
         if not(cmd_data_dict["command_id"] in self.punp.tc_packet_data_desc):
             raise Exception("command_id {} not registered in PackerUnpacker. Check your YML descriptor!".format(cmd_data_dict["command_id"]))
         # generate data to calculate length
-        data = self.punp._pack_from_desc(cmd_data_dict, self.punp.tc_packet_data_desc[cmd_data_dict["command_id"]])
+        data = self.punp.pack_tc_data(cmd_data_dict)
         data_length = len(data)
         # construct packet
         header = {"system_id": self.sysid | 0b10000000,
@@ -128,59 +344,120 @@ class BaseDriver(StoppableThread):
         self.packetid = self.packetid + 1
         return tcPacket
 
+    def encode_command(self, command_id, values):
+        """ pack a command with its precompiled encoder, return the packet and the tc dictionnary """
+        if not(command_id in self.punp.tc_encoders):
+            raise Exception("command_id {} not registered in PackerUnpacker. Check your YML descriptor!".format(command_id))
+        tcPacket, command_dict = self.punp.tc_encoders[command_id].encode(self.sysid | 0b10000000, self.packetid, values)
+        # increment packet id for next time
+        self.packetid = self.packetid + 1
+        return tcPacket, command_dict
+
+    def send_command(self, command_id, *values):
+        """ send a command given its id and its parameters (in the order of the YML description) """
+        tcPacket, command_dict = self.encode_command(command_id, values)
+        return self.send_packet(tcPacket, command_dict)
+
     def simple_send_command(self, command_dict):
+        return self.send_packet(self.punp.pack(command_dict), command_dict)
+
+    def send_packet(self, tcPacket, command_dict):
+        """ send an already packed tc, and register it in the database """
         if not(self.connected):
             raise Exception("Driver not connected!")
-        tcPacket = self.punp.pack(command_dict)
-        self.sender.send(tcPacket, zmq.NOBLOCK)
+        tc = TC(command_dict)
+        if not(self._transaction is None):
+            self._transaction.before_send()
+        # register the TC before sending it, the EACK can now come back before send returns
         if not(self.db is None):
-            self.db.push_tc(TC(command_dict))
-        return None
+            self.db.push_tc(tc)
+        tc.time_sent = time.time()
+        self.sender.send(tcPacket, zmq.NOBLOCK)
+        if not(self._transaction is None):
+            self._transaction.add(tc)
+        return tc
+
+    def transaction(self, timeout = 3, max_in_flight = 8):
+        """ open a transaction, to send several tcs back to back (see Transaction) """
+        return Transaction(self, timeout = timeout, max_in_flight = max_in_flight)
 
     def validate_last_tc(self, timeout = 3):
         return self.db.validate_last_tc(timeout = timeout)
 
+    def process_tm(self, byte):
+        """ unpack a TM received from the listener, attach it to its TC and print it depending on the verbose level """
+        try:
+            packet = self.punp.unpack(Byt(byte))
+            is_rack, is_eack, is_reply = False, False, False
+            if (packet["header"]["packet_type"] == self.punp.rack_packet_type):
+                is_rack = True
+            if (packet["header"]["packet_type"] == self.punp.eack_packet_type):
+                is_eack = True
+            if (packet["header"]["packet_type"] == self.punp.tc_reply_packet_type):
+                is_reply = True     
+            if not(self.db is None):
+                self.db.push_tm(packet, is_ack=is_eack, is_reply=is_reply)                                     
+            #try:
+            crc_status = self.punp.check_crc_raw(byte)
+            #except:
+            #    crc_status = False
+            #    print("Got TM - failed to calc CRC - {}".format(packet))                          
+            if self.verbose_level == 3:
+                print("Got TM - CRC status {} - {}".format(crc_status, packet))
+            elif self.verbose_level == 2:
+                if packet["header"]["packet_type"] in [self.punp.rack_packet_type,
+                                                       self.punp.eack_packet_type,
+                                                       self.punp.tc_reply_packet_type]:
+                    print("Got TM - CRC status {} - {}".format(crc_status, packet))
+            elif self.verbose_level == 1:
+                if packet["header"]["packet_type"] in [self.punp.rack_packet_type]:
+                    print("Got RACK - CRC status {} - {}".format(crc_status, packet))
+            else:
+                pass
+             
+        except:
+           print("Got TM but unpack failed: "+Byt(byte).hex())           
+        return None
+
     def run(self):
+        # wait on the socket instead of polling it every 10ms. The poll timeout only bounds
+        # the time needed to notice a call to stop_receiver
+        poller = zmq.Poller()
+        poller.register(self.receiver, zmq.POLLIN)
         while not(self.stopped()):
-            time.sleep(0.01) # breathing room
-            try:
-                byte = self.receiver.recv(zmq.NOBLOCK)
+            events = dict(poller.poll(self.poll_timeout*1000))
+            if not(self.receiver in events):
+                continue
+            # drain everything which is ready, so that bursts do not back up
+            nmessages = 0
+            while True:
                 try:
-                    packet = self.punp.unpack(Byt(byte))
-                    is_rack, is_eack, is_reply = False, False, False
-                    if (packet["header"]["packet_type"] == self.punp.rack_packet_type):
-                        is_rack = True
-                    if (packet["header"]["packet_type"] == self.punp.eack_packet_type):
-                        is_eack = True
-                    if (packet["header"]["packet_type"] == self.punp.tc_reply_packet_type):
-                        is_reply = True     
-                    if not(self.db is None):
-                        self.db.push_tm(packet, is_ack=is_eack, is_reply=is_reply)                                     
-                    #try:
-                    crc_status = self.punp.check_crc(packet)
-                    #except:
-                    #    crc_status = False
-                    #    print("Got TM - failed to calc CRC - {}".format(packet))                          
-                    if self.verbose_level == 3:
-                        print("Got TM - CRC status {} - {}".format(crc_status, packet))
-                    elif self.verbose_level == 2:
-                        if packet["header"]["packet_type"] in [self.punp.rack_packet_type,
-                                                               self.punp.eack_packet_type,
-                                                               self.punp.tc_reply_packet_type]:
-                            print("Got TM - CRC status {} - {}".format(crc_status, packet))
-                    elif self.verbose_level == 1:
-                        if packet["header"]["packet_type"] in [self.punp.rack_packet_type]:
-                            print("Got RACK - CRC status {} - {}".format(crc_status, packet))
-                    else:
-                        pass
-                     
-                except:
-                   print("Got TM but unpack failed: "+Byt(byte).hex())           
-            except zmq.ZMQError as e:
-                if e.errno == zmq.EAGAIN:
-                    pass # no message was ready (yet!)
+                    byte = self.receiver.recv(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                self.process_tm(byte)
+                nmessages += 1
+            self.loop_stats["wakeups"] += 1
+            self.loop_stats["messages"] += nmessages
+            self.loop_stats["max_batch"] = max(self.loop_stats["max_batch"], nmessages)
+        poller.unregister(self.receiver)
         print("Driver/receiver has stopped")
 
+    def latency_stats(self, last = 100):
+        """
+        return statistics of the TC round trips (in s) over the last TCs sent:
+        time between sending the TC and receiving its EACK, and its first reply
+        """
+        tcs = [tc for tc in list(self.db.tcs)[-last:] if not(tc.time_sent is None)]
+        stats = {"ntc": len(tcs)}
+        for name in ["eack", "reply"]:
+            delays = np.array([getattr(tc, "time_"+name) - tc.time_sent for tc in tcs if not(getattr(tc, "time_"+name) is None)])
+            if len(delays) == 0:
+                continue
+            stats[name] = {"n": len(delays), "median": np.median(delays), "p95": np.percentile(delays, 95), "max": delays.max()}
+        stats.update(self.loop_stats)
+        return stats
+
     def stop_receiver(self):
         super(BaseDriver, self).stop()          
         return None
@@ -1,4 +1,5 @@
 # coding: utf-8
+# generated by make_lanternDriver.py from descriptors/tc_packet_data.yml, do not edit by hand
 from .baseDriver import BaseDriver
 
 class LanternDriver(object):
@@ -6,205 +7,144 @@ class LanternDriver(object):
         self._driver = BaseDriver(*args, **kwargs)
         return None
 
+    def transaction(self, timeout = 3, max_in_flight = 8):
+        """
+        send the commands called inside a with block back to back, and check all their EACKs
+        when leaving the block (see baseDriver.Transaction)
+        @param (float) timeout: time (in s) to wait for the EACKs
+        @param (int) max_in_flight: maximum number of commands not acknowledged yet
+        """
+        return self._driver.transaction(timeout = timeout, max_in_flight = max_in_flight)
+
     def echo(self, message=None):
         """
         reply with the given message
         @param (array or list of int 0-255) message: message
         """
-        params = {}
-        params["message"] = message
-        cmd_data_dict = {"command_id": 1, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(1, message)
 
     def reset_modulation_loop(self):
         """
         reset the modulation to its initial position
         """
-        params = {}
-        cmd_data_dict = {"command_id": 4, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(4)
 
     def switch_modulation_loop(self, state=None):
         """
         turn on/off the modulation loop
         @param (boolean) state: true/false for on/off
         """
-        params = {}
-        params["state"] = state
-        cmd_data_dict = {"command_id": 3, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(3, state)
 
     def switch_flashing_mode(self, state=None):
         """
         turn on/off the flashing mode for updating modulation sequences
         @param (boolean) state: true/false for on/off
         """
-        params = {}
-        params["state"] = state
-        cmd_data_dict = {"command_id": 2, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(2, state)
 
     def switch_control_loop(self, state=None):
         """
         turn on/off the control loop
         @param (boolean) state: true/false for on/off
         """
-        params = {}
-        params["state"] = state
-        cmd_data_dict = {"command_id": 21, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(21, state)
 
     def switch_closed_loop(self, state=None):
         """
         open or close the loop
         @param (boolean) state: true/false for closed_open
         """
-        params = {}
-        params["state"] = state
-        cmd_data_dict = {"command_id": 26, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(26, state)
 
     def switch_hk_data(self, state=None):
         """
         turn on/off the automatic HK reporting
         @param (boolean) state: true/false for on/off
         """
-        params = {}
-        params["state"] = state
-        cmd_data_dict = {"command_id": 22, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(22, state)
 
     def switch_control_data(self, state=None):
         """
         turn on/off the automatic data reporting
         @param (boolean) state: true/false for on/off
         """
-        params = {}
-        params["state"] = state
-        cmd_data_dict = {"command_id": 28, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(28, state)
 
     def get_temperature(self):
         """
         return the temperature value
         """
-        params = {}
-        cmd_data_dict = {"command_id": 6, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(6)
 
     def get_voltage_hv(self):
         """
         return the value of the piezo HV voltage
         """
-        params = {}
-        cmd_data_dict = {"command_id": 7, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(7)
 
     def get_voltage_5v(self):
         """
         return the value of the 5V line
         """
-        params = {}
-        cmd_data_dict = {"command_id": 8, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(8)
 
     def get_modulation_scale(self):
         """
         return the value of the modulation scale
         """
-        params = {}
-        cmd_data_dict = {"command_id": 29, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(29)
 
     def set_modulation_scale(self, scale=None):
         """
         set the value of the modulation scale
         @param (float) scale: the modulation scale (multiplicative factor applied)
         """
-        params = {}
-        params["scale"] = scale
-        cmd_data_dict = {"command_id": 30, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(30, scale)
 
     def get_modulation_prescaler(self):
         """
         return the value of the modulation prescaler
         """
-        params = {}
-        cmd_data_dict = {"command_id": 31, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(31)
 
     def get_tracking_offset(self):
         """
         return true/false depening on whether the electronics is tracking the modulation offset
         """
-        params = {}
-        cmd_data_dict = {"command_id": 39, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(39)
 
     def switch_tracking_offset(self, state=None):
         """
         turn on/off the tracking of the modulation offset
         @param (boolean) state: true/false for on/off
         """
-        params = {}
-        params["state"] = state
-        cmd_data_dict = {"command_id": 40, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(40, state)
 
     def set_modulation_prescaler(self, prescaler=None):
         """
         set the value of the modulation prescaler to get multiple DITs per position
         @param (int 0-65535) prescaler: the modulation prescaler (number of DITs at each position)
         """
-        params = {}
-        params["prescaler"] = prescaler
-        cmd_data_dict = {"command_id": 32, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(32, prescaler)
 
     def get_piezo_command(self):
         """
         return the activate command on the piezo 
         """
-        params = {}
-        cmd_data_dict = {"command_id": 33, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(33)
 
     def get_piezo_position(self):
         """
         return the position of the piezo from SG (x, y)
         """
-        params = {}
-        cmd_data_dict = {"command_id": 10, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(10)
 
     def get_piezo_setpoint(self):
         """
         return the position of the piezo from SG (x, y)
         """
-        params = {}
-        cmd_data_dict = {"command_id": 46, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(46)
 
     def move_piezo(self, x=None, y=None):
         """
@@ -212,12 +152,7 @@ class LanternDriver(object):
         @param (float) x: piezo setpoint on x axis (in mas)
         @param (float) y: piezo setpoint on y axis (in mas)
         """
-        params = {}
-        params["x"] = x
-        params["y"] = y
-        cmd_data_dict = {"command_id": 9, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(9, x, y)
 
     def delta_move_piezo(self, dx=None, dy=None):
         """
@@ -225,12 +160,7 @@ class LanternDriver(object):
         @param (float) dx: delta piezo setpoint on x axis (in mas)
         @param (float) dy: delta piezo setpoint on y axis (in mas)
         """
-        params = {}
-        params["dx"] = dx
-        params["dy"] = dy
-        cmd_data_dict = {"command_id": 44, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(44, dx, dy)
 
     def set_modulation_sequence(self, startpoint=None, npoints=None, xmod=None, ymod=None):
         """
@@ -239,14 +169,7 @@ class LanternDriver(object):
         @param (int 0-65535) npoints: the number of points to write in the sequence
         @param (float,float*) xmod,ymod: the coordinates of the modulation points
         """
-        params = {}
-        params["startpoint"] = startpoint
-        params["npoints"] = npoints
-        params["xmod"] = xmod
-        params["ymod"] = ymod
-        cmd_data_dict = {"command_id": 12, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(12, startpoint, npoints, xmod, ymod)
 
     def flash_sequence(self, sequence=None, npoints=None, xcrc=None, ycrc=None):
         """
@@ -256,85 +179,53 @@ class LanternDriver(object):
         @param (int 0-2**32) xcrc: the CRC calculated on the X sequence
         @param (int 0-2**32) ycrc: the CRC calculated on the Y sequence 
         """
-        params = {}
-        params["sequence"] = sequence
-        params["npoints"] = npoints
-        params["xcrc"] = xcrc
-        params["ycrc"] = ycrc
-        cmd_data_dict = {"command_id": 17, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(17, sequence, npoints, xcrc, ycrc)
 
     def get_modulation_sequence(self, sequence=None):
         """
         retrieve the sequence of values for the modulation
         @param (int 0-255) sequence: the sequence id to be read (1 to 5)
         """
-        params = {}
-        params["sequence"] = sequence
-        cmd_data_dict = {"command_id": 11, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(11, sequence)
 
     def get_modulation_sequence_id(self):
         """
         returns the id number of the modulation sequence currently in use
         """
-        params = {}
-        cmd_data_dict = {"command_id": 36, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(36)
 
     def load_sequence_from_flash(self, sequence=None):
         """
         load a modulation sequence from the FLASH, and start to use it
         @param (int 0-255) sequence: the sequence id to be read (1 to 5)
         """
-        params = {}
-        params["sequence"] = sequence
-        cmd_data_dict = {"command_id": 13, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(13, sequence)
 
     def download_data(self):
         """
         offload tha control data buffer in a TC reply packet
         """
-        params = {}
-        cmd_data_dict = {"command_id": 14, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(14)
 
     def reset_control_data_counter(self):
         """
         reset the data counter to 0
         """
-        params = {}
-        cmd_data_dict = {"command_id": 15, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(15)
 
     def set_max_counter_to_save(self, counter=None):
         """
         set the value of the counter which indicates last counter to be saved in data buffer
         @param (int 0-2**32) counter: the value to set for the counter (0xFFFFFFFF for saving indefinitely)
         """
-        params = {}
-        params["counter"] = counter
-        cmd_data_dict = {"command_id": 16, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(16, counter)
 
     def use_config_on_next_boot(self, config_id=None):
         """
         decide which configuration should be use staring on next boot
         @param (int 0-255) config_id: the value (1 to 3, or 255 for default) of the config to use
         """
-        params = {}
-        params["config_id"] = config_id
-        cmd_data_dict = {"command_id": 19, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(19, config_id)
 
     def upload_config(self, config_id=None, name=None, system_id=None, control_loop_period=None, modulation_period=None, hk_period=None, data_period=None, sg_adc_period=None, tx_timeout=None, i2c_timeout=None, conversion_factor_hv=None, conversion_factor_5v=None, internal_trigger=None, output_trigger_delay=None, glitch_beacon_step=None, glitch_beacon_delay=None, glitch_beacon_active_on_boot=None, close_loop_on_boot=None, location_lat=None, location_lon=None, sky_in_sg_origin_x=None, sky_in_sg_origin_y=None, sky_to_sg_conversion_matrix_11=None, sky_to_sg_conversion_matrix_12=None, sky_to_sg_conversion_matrix_21=None, sky_to_sg_conversion_matrix_22=None, sg_in_com_origin_x=None, sg_in_com_origin_y=None, sg_to_com_conversion_matrix_11=None, sg_to_com_conversion_matrix_12=None, sg_to_com_conversion_matrix_21=None, sg_to_com_conversion_matrix_22=None, piezo_command_lower_limit=None, piezo_command_upper_limit=None, sg_adc_filter_omega_knot=None, max_piezo_step=None, xdac_address=None, ydac_address=None, xsg_ind=None, ysg_ind=None, max_counter_to_save=None, decimation=None, hk_active_on_boot=None, data_active_on_boot=None, control_active_on_boot=None, modulation_active_on_boot=None, piezo_x_setpoint_on_boot=None, piezo_y_setpoint_on_boot=None, use_shaping=None, shaping_slope=None, theta_offset=None, tracking_update_delay=None, pid_coeff_p=None, pid_coeff_i=None, pid_coeff_d=None):
         """
@@ -395,74 +286,13 @@ class LanternDriver(object):
         @param (float) pid_coeff_i: 
         @param (float) pid_coeff_d: 
         """
-        params = {}
-        params["config_id"] = config_id
-        params["name"] = name
-        params["system_id"] = system_id
-        params["control_loop_period"] = control_loop_period
-        params["modulation_period"] = modulation_period
-        params["hk_period"] = hk_period
-        params["data_period"] = data_period
-        params["sg_adc_period"] = sg_adc_period
-        params["tx_timeout"] = tx_timeout
-        params["i2c_timeout"] = i2c_timeout
-        params["conversion_factor_hv"] = conversion_factor_hv
-        params["conversion_factor_5v"] = conversion_factor_5v
-        params["internal_trigger"] = internal_trigger
-        params["output_trigger_delay"] = output_trigger_delay
-        params["glitch_beacon_step"] = glitch_beacon_step
-        params["glitch_beacon_delay"] = glitch_beacon_delay
-        params["glitch_beacon_active_on_boot"] = glitch_beacon_active_on_boot
-        params["close_loop_on_boot"] = close_loop_on_boot
-        params["location_lat"] = location_lat
-        params["location_lon"] = location_lon
-        params["sky_in_sg_origin_x"] = sky_in_sg_origin_x
-        params["sky_in_sg_origin_y"] = sky_in_sg_origin_y
-        params["sky_to_sg_conversion_matrix_11"] = sky_to_sg_conversion_matrix_11
-        params["sky_to_sg_conversion_matrix_12"] = sky_to_sg_conversion_matrix_12
-        params["sky_to_sg_conversion_matrix_21"] = sky_to_sg_conversion_matrix_21
-        params["sky_to_sg_conversion_matrix_22"] = sky_to_sg_conversion_matrix_22
-        params["sg_in_com_origin_x"] = sg_in_com_origin_x
-        params["sg_in_com_origin_y"] = sg_in_com_origin_y
-        params["sg_to_com_conversion_matrix_11"] = sg_to_com_conversion_matrix_11
-        params["sg_to_com_conversion_matrix_12"] = sg_to_com_conversion_matrix_12
-        params["sg_to_com_conversion_matrix_21"] = sg_to_com_conversion_matrix_21
-        params["sg_to_com_conversion_matrix_22"] = sg_to_com_conversion_matrix_22
-        params["piezo_command_lower_limit"] = piezo_command_lower_limit
-        params["piezo_command_upper_limit"] = piezo_command_upper_limit
-        params["sg_adc_filter_omega_knot"] = sg_adc_filter_omega_knot
-        params["max_piezo_step"] = max_piezo_step
-        params["xdac_address"] = xdac_address
-        params["ydac_address"] = ydac_address
-        params["xsg_ind"] = xsg_ind
-        params["ysg_ind"] = ysg_ind
-        params["max_counter_to_save"] = max_counter_to_save
-        params["decimation"] = decimation
-        params["hk_active_on_boot"] = hk_active_on_boot
-        params["data_active_on_boot"] = data_active_on_boot
-        params["control_active_on_boot"] = control_active_on_boot
-        params["modulation_active_on_boot"] = modulation_active_on_boot
-        params["piezo_x_setpoint_on_boot"] = piezo_x_setpoint_on_boot
-        params["piezo_y_setpoint_on_boot"] = piezo_y_setpoint_on_boot
-        params["use_shaping"] = use_shaping
-        params["shaping_slope"] = shaping_slope
-        params["theta_offset"] = theta_offset
-        params["tracking_update_delay"] = tracking_update_delay
-        params["pid_coeff_p"] = pid_coeff_p
-        params["pid_coeff_i"] = pid_coeff_i
-        params["pid_coeff_d"] = pid_coeff_d
-        cmd_data_dict = {"command_id": 18, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(18, config_id, name, system_id, control_loop_period, modulation_period, hk_period, data_period, sg_adc_period, tx_timeout, i2c_timeout, conversion_factor_hv, conversion_factor_5v, internal_trigger, output_trigger_delay, glitch_beacon_step, glitch_beacon_delay, glitch_beacon_active_on_boot, close_loop_on_boot, location_lat, location_lon, sky_in_sg_origin_x, sky_in_sg_origin_y, sky_to_sg_conversion_matrix_11, sky_to_sg_conversion_matrix_12, sky_to_sg_conversion_matrix_21, sky_to_sg_conversion_matrix_22, sg_in_com_origin_x, sg_in_com_origin_y, sg_to_com_conversion_matrix_11, sg_to_com_conversion_matrix_12, sg_to_com_conversion_matrix_21, sg_to_com_conversion_matrix_22, piezo_command_lower_limit, piezo_command_upper_limit, sg_adc_filter_omega_knot, max_piezo_step, xdac_address, ydac_address, xsg_ind, ysg_ind, max_counter_to_save, decimation, hk_active_on_boot, data_active_on_boot, control_active_on_boot, modulation_active_on_boot, piezo_x_setpoint_on_boot, piezo_y_setpoint_on_boot, use_shaping, shaping_slope, theta_offset, tracking_update_delay, pid_coeff_p, pid_coeff_i, pid_coeff_d)
 
     def software_reboot(self):
         """
         restart the software (in particular, this will reload the configuration)
         """
-        params = {}
-        cmd_data_dict = {"command_id": 20, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(20)
 
     def set_datetime(self, year=None, month=None, day=None, hour=None, minute=None, second=None):
         """
@@ -474,43 +304,25 @@ class LanternDriver(object):
         @param (int 0-255) minute: minute number (ex 55)
         @param (int 0-255) second: second number (ex 47)
         """
-        params = {}
-        params["year"] = year
-        params["month"] = month
-        params["day"] = day
-        params["hour"] = hour
-        params["minute"] = minute
-        params["second"] = second
-        cmd_data_dict = {"command_id": 23, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(23, year, month, day, hour, minute, second)
 
     def get_datetime(self):
         """
         return the date and time from the RTC clock
         """
-        params = {}
-        cmd_data_dict = {"command_id": 24, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(24)
 
     def get_version(self):
         """
         return the version number of the code and the config name currently in use
         """
-        params = {}
-        cmd_data_dict = {"command_id": 5, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(5)
 
     def get_modulation_offset(self):
         """
         get the center point of the modulation pattern
         """
-        params = {}
-        cmd_data_dict = {"command_id": 45, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(45)
 
     def set_modulation_offset(self, npoints=None, x_offset=None, y_offset=None):
         """
@@ -519,24 +331,14 @@ class LanternDriver(object):
         @param (list of float) x_offset: offset on x axis (in um)
         @param (list of float) y_offset: offset on y axis (in um)
         """
-        params = {}
-        params["npoints"] = npoints
-        params["x_offset"] = x_offset
-        params["y_offset"] = y_offset
-        cmd_data_dict = {"command_id": 25, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(25, npoints, x_offset, y_offset)
 
     def set_decimation(self, decimation=None):
         """
         set the decimation factor to save one point every n points
         @param (int 0-65535) decimation: decimation factor
         """
-        params = {}
-        params["decimation"] = decimation
-        cmd_data_dict = {"command_id": 27, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(27, decimation)
 
     def start_output_trigger(self, ntrigs=None, delay=None):
         """
@@ -544,21 +346,13 @@ class LanternDriver(object):
         @param (int 0-2**32) ntrigs: number of triggerings before stopping (set to 0 for indefinite)
         @param (int 0-65535) delay: the delay between the modulation move and the trigger (in ms)
         """
-        params = {}
-        params["ntrigs"] = ntrigs
-        params["delay"] = delay
-        cmd_data_dict = {"command_id": 34, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(34, ntrigs, delay)
 
     def stop_output_trigger(self):
         """
         deactivate the output trigger for the camera (will stop exposures after the current one). 
         """
-        params = {}
-        cmd_data_dict = {"command_id": 35, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(35)
 
     def set_glitch_beacon_params(self, frame=None, extra_delay=None):
         """
@@ -566,61 +360,39 @@ class LanternDriver(object):
         @param (int 0-65535) frame: the frame number for the glitch beacon
         @param (int 0-65535) extra_delay: the extra delay in milliseconds for the glitch beacon
         """
-        params = {}
-        params["frame"] = frame
-        params["extra_delay"] = extra_delay
-        cmd_data_dict = {"command_id": 47, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(47, frame, extra_delay)
 
     def get_glitch_beacon_params(self):
         """
         retrieve the current frame and extra delay parameters for the glitch beacon
         """
-        params = {}
-        cmd_data_dict = {"command_id": 48, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(48)
 
     def switch_glitch_beacon(self, state=None):
         """
         enable or disable the glitch beacon
         @param (int 0-255) state: the state to set (0 for off, 1 for on)
         """
-        params = {}
-        params["state"] = state
-        cmd_data_dict = {"command_id": 49, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(49, state)
 
     def get_glitch_beacon_state(self):
         """
         retrieve the current state of the glitch beacon
         """
-        params = {}
-        cmd_data_dict = {"command_id": 50, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(50)
 
     def get_lst_seconds(self):
         """
         get the number of seconds (0 to 86400) elapsed since the beginning of day
         """
-        params = {}
-        cmd_data_dict = {"command_id": 37, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(37)
 
     def set_lst_seconds(self, seconds=None):
         """
         set the number of seconds (0 to 86400) elapsed since the beginning of day
         @param (float) seconds: number of seconds (0 to 86400)
         """
-        params = {}
-        params["seconds"] = seconds
-        cmd_data_dict = {"command_id": 38, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(38, seconds)
 
     def set_target_coords(self, ra=None, dec=None):
         """
@@ -628,28 +400,16 @@ class LanternDriver(object):
         @param (float) ra: Right Ascension (hourangle)
         @param (float) dec: Declination (degrees)
         """
-        params = {}
-        params["ra"] = ra
-        params["dec"] = dec
-        cmd_data_dict = {"command_id": 42, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(42, ra, dec)
 
     def get_target_coords(self):
         """
         retrieve the current pointing coordinates used to calculate parallactic angle
         """
-        params = {}
-        cmd_data_dict = {"command_id": 41, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
+        return self._driver.send_command(41)
 
     def get_parangle(self):
         """
         retrieve the current parangle as calculated by the electronics
         """
-        params = {}
-        cmd_data_dict = {"command_id": 43, "params": params}
-        command_dict = self._driver.generate_tc_from_data(cmd_data_dict)
-        return self._driver.simple_send_command(command_dict)
-
+        return self._driver.send_command(43)
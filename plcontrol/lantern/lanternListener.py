@@ -2,12 +2,53 @@
 import serial
 import zmq
 import time
+import io
 from byt import Byt
 from lantern.utils import StoppableThread
 
 # Create a ZMQ context
 context = zmq.Context()
 
+class FrameDecoder:
+    """
+    Incremental framing of the serial stream.
+    Frames are terminated by the end sequence written twice, and any end sequence inside a frame
+    is escaped by appending the escape character after it.
+    The received bytes are accumulated in a bytearray, and only the new bytes are scanned for
+    the terminator: the buffer is compacted once per call to feed, not once per frame.
+    """
+    def __init__(self, end_sequence, esc_character):
+        self.end_sequence = bytes(end_sequence)
+        self.esc_character = bytes(esc_character)
+        self.terminator = self.end_sequence + self.end_sequence
+        self.escaped = self.end_sequence + self.esc_character
+        self.buffer = bytearray()
+        self.scan_from = 0 # position from which the terminator has not been looked for yet
+        return None
+
+    def escape(self, packet):
+        return bytes(packet).replace(self.end_sequence, self.escaped)
+
+    def unescape(self, packet):
+        return bytes(packet).replace(self.escaped, self.end_sequence)
+
+    def feed(self, data):
+        """ add data to the buffer and return the list of complete frames (unescaped) """
+        buffer = self.buffer
+        buffer += data
+        packets = []
+        start = 0
+        ind = buffer.find(self.terminator, self.scan_from)
+        while (ind >= 0):
+            if ind > start: # empty frames are dropped
+                packets.append(self.unescape(buffer[start:ind]))
+            start = ind + len(self.terminator)
+            ind = buffer.find(self.terminator, start)
+        del buffer[:start]
+        # a terminator can still start in the last len(terminator)-1 bytes
+        self.scan_from = max(0, len(buffer) - len(self.terminator) + 1)
+        return packets
+
 class Listener(StoppableThread):
     """ 
     Listener object which binds to the serial port and forward packets.
@@ -25,7 +66,8 @@ class Listener(StoppableThread):
         self.serial_baud = self.config["serial_connection"]["baud"]
         self.zmq_tc_address = self.config["zmq_connection"]["tc_port"]
         self.zmq_tm_address = self.config["zmq_connection"]["tm_port"]
-        self.rx_buffer = Byt() # put the data coming from serial port
+        # framing of the data coming from serial port
+        self.decoder = FrameDecoder(self.end_sequence, self.esc_character)
         # open serial port
         self.ser = serial.Serial(self.serial_port, self.serial_baud)        
         # Create a ZMQ socket to send data
@@ -33,6 +75,8 @@ class Listener(StoppableThread):
         # create a ZMQ socket to receive data
         self.receiver = None 
         self.connected = False       
+        self.poll_timeout = 0.1 # in s, maximum time to notice that the listener has been stopped
+        self.loop_stats = {"wakeups": 0, "tc": 0, "tm": 0, "max_forward_time": 0}
         return None
     
     def connect(self):
@@ -52,45 +96,72 @@ class Listener(StoppableThread):
     
     # escape and de-escape function
     def _escape(self, packet):
-        packet = Byt.fromHex(packet.hex()) # make sure it has the correct Byt type and spacing in hex notation
-        return Byt.fromHex(packet.hex().replace(self.end_sequence.hex(), self.end_sequence.hex()+" "+self.esc_character.hex()))
+        return self.decoder.escape(packet)
 
     def _unescape(self, packet):
-        return Byt.fromHex(packet.hex().replace(self.end_sequence.hex()+" "+self.esc_character.hex(), self.end_sequence.hex()))
+        return self.decoder.unescape(packet)
 
-    def _get_packets(self, data_byt):
+    def _get_packets(self, data):
         """
-        look for the end sequence in the data_byt (of Byt.byt type) and
-        return a list of packets (escaped and with no end sequence)
+        add the data read from the serial port to the decoder and
+        return the list of complete packets (unescaped and with no end sequence)
         """
-        packets = []
-        ind = data_byt.find(self.end_sequence+self.end_sequence)
-        while (ind > 0):
-            packets.append(self._unescape(data_byt[:ind]))
-            data_byt= data_byt[ind+2*len(self.end_sequence):]
-            ind = data_byt.find(self.end_sequence+self.end_sequence)
-        return packets, data_byt
+        return self.decoder.feed(data)
         
-    def run(self):
-        while not(self.stopped()):
-            time.sleep(0.01) # breathing room
-            # check outgoing
+    def forward_tc(self):
+        """ send all the TCs waiting on the ZMQ socket to the serial line """
+        ntc = 0
+        while True:
             try:
                 packet = self.receiver.recv(zmq.NOBLOCK)   
-                send_bytes = self._escape(packet) + self.end_sequence + self.end_sequence
-                print("To TC port: {}".format(send_bytes.hex()))
-                self.ser.write(send_bytes)      
-            except zmq.ZMQError as e:
-                if e.errno == zmq.EAGAIN:
-                    pass # no message was ready (yet!)         
-            # check incoming
-            bytesToRead = self.ser.inWaiting()
-            self.rx_buffer += Byt(self.ser.read(bytesToRead))            
-            packets, remaining_byt = self._get_packets(self.rx_buffer)
-            for p in packets:
-                print("To TM port: "+Byt(p).hex())   
-                self.sender.send(p, zmq.NOBLOCK)
-            self.rx_buffer = remaining_byt
+            except zmq.Again:
+                break
+            send_bytes = self._escape(packet) + self.decoder.terminator
+            print("To TC port: {}".format(Byt(send_bytes).hex()))
+            self.ser.write(send_bytes)      
+            ntc += 1
+        return ntc
+
+    def forward_tm(self):
+        """ read everything waiting on the serial line and publish the complete TMs """
+        bytesToRead = self.ser.inWaiting()
+        if bytesToRead == 0:
+            return 0
+        packets = self._get_packets(self.ser.read(bytesToRead))
+        for p in packets:
+            print("To TM port: "+Byt(p).hex())   
+            self.sender.send(p, zmq.NOBLOCK)
+        return len(packets)
+
+    def run(self):
+        # wait on both the ZMQ socket and the serial port file descriptor, instead of polling them
+        # every 10ms. If the serial port has no file descriptor (not POSIX), it is checked at
+        # each wake up, and the poll timeout is reduced.
+        poller = zmq.Poller()
+        poller.register(self.receiver, zmq.POLLIN)
+        try:
+            serial_fd = self.ser.fileno()
+            poller.register(serial_fd, zmq.POLLIN)
+            timeout = self.poll_timeout
+        except (AttributeError, io.UnsupportedOperation, serial.SerialException):
+            serial_fd = None
+            timeout = min(self.poll_timeout, 0.001)
+        while not(self.stopped()):
+            events = dict(poller.poll(timeout*1000))
+            t0 = time.time()
+            ntc, ntm = 0, 0
+            if self.receiver in events:
+                ntc = self.forward_tc()
+            if (serial_fd is None) or (serial_fd in events):
+                ntm = self.forward_tm()
+            if (ntc + ntm) > 0:
+                self.loop_stats["wakeups"] += 1
+                self.loop_stats["tc"] += ntc
+                self.loop_stats["tm"] += ntm
+                self.loop_stats["max_forward_time"] = max(self.loop_stats["max_forward_time"], time.time() - t0)
+        poller.unregister(self.receiver)
+        if not(serial_fd is None):
+            poller.unregister(serial_fd)
         print("Listener has stopped")
         return None
 
@@ -3,14 +3,12 @@ from byt import Byt
 import zmq
 from lantern.packerUnpacker import PackerUnpacker
 import time
+import threading
 from lantern.utils import StoppableThread
 import numpy as np
 from mpl_toolkits.axes_grid1.inset_locator import zoomed_inset_axes
 from mpl_toolkits.axes_grid1.inset_locator import mark_inset
-import matplotlib
-matplotlib.use("QtAgg")
 import matplotlib.pyplot as plt
-plt.ion()
 
 context = zmq.Context()
 
@@ -18,17 +16,88 @@ SG_TO_AS = 1
 MIDPOINT = [2478, 2575]
 RANGE = [500, 500]
 
-class FigureResponse():
-    def __init__(self, nmax = 1000):
+def decimate_minmax(x, y, nbins):
+    """
+    reduce a time series to the min and max of y in nbins bins (in time order), which draws the
+    same as the full series when there are one or two bins per pixel. Series shorter than 2*nbins are
+    returned as is. The oldest points which do not fill a bin are kept without decimation.
+    """
+    n = len(y)
+    if (nbins < 1) or (n <= 2*nbins):
+        return x, y
+    binsize = n // nbins
+    rest = n - binsize*nbins
+    blocks = y[rest:].reshape(nbins, binsize)
+    offsets = rest + binsize*np.arange(nbins)
+    indices = np.sort(np.stack([offsets + np.argmin(blocks, axis=1), offsets + np.argmax(blocks, axis=1)], axis=1), axis=1).ravel()
+    indices = np.concatenate([np.arange(rest), indices])
+    return x[indices], y[indices]
+
+
+class LiveFigure():
+    """
+    base class of the live figures. With blit, the static part of the figure (axes, ticks, labels)
+    is cached after each full draw, and each update only restores it and draws the artists returned
+    by dynamic_artists. A full draw is only done when update_limits reports that the limits changed.
+    """
+    def setup_blit(self, blit):
+        self.blit = blit
+        self.background = None
+        self.nfull_draws = 0
+        if self.blit:
+            for artist in self.dynamic_artists():
+                artist.set_animated(True)
+            self.fig.canvas.mpl_connect("draw_event", self.on_draw)
+        return None
+
+    def dynamic_artists(self):
+        return []
+
+    def on_draw(self, event):
+        # called after each full draw: cache the static background, then draw the animated artists on it
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+        return None
+
+    def draw_artists(self):
+        for artist in self.dynamic_artists():
+            self.fig.draw_artist(artist)
+        return None
+
+    def refresh(self, limits_changed = False):
+        canvas = self.fig.canvas
+        if not(self.blit) or limits_changed or (self.background is None):
+            self.nfull_draws = self.nfull_draws + 1
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            self.draw_artists()
+        if self.blit:
+            canvas.blit(self.fig.bbox)
+            canvas.flush_events()
+        return None
+
+
+class FigureResponse(LiveFigure):
+    def __init__(self, nmax = 1000, blit = True, decimate = True):
+        """
+        @param nmax: number of points shown
+        @param blit: only redraw the lines between two full draws (see LiveFigure)
+        @param decimate: plot the min/max of the time series per pixel instead of all the points
+        """
         self.fig = plt.figure(figsize = (8, 4))
         self.ax1 = self.fig.add_subplot(211)
         self.ax2 = self.fig.add_subplot(212)        
         self.timer = self.fig.canvas.new_timer(interval=500)
         mng = self.fig.canvas.manager        
-        mng.window.show()
+        if hasattr(mng, "window"): # not with the non-interactive backends (benchmarks)
+            mng.window.show()
         self.nmax = nmax
+        self.decimate = decimate
+        self.last_tmax = 0
         self.stop=False
         self.init_plot()
+        self.setup_blit(blit)
         return None
 
     def init_plot(self):
@@ -47,40 +116,67 @@ class FigureResponse():
         self.fig.tight_layout()
         return None
 
+    def dynamic_artists(self):
+        return self.ax1.lines[0:2] + self.ax2.lines[0:2]
+
+    def update_limits(self, t):
+        """
+        set the time axis, return True if it changed. Without blit the axis follows the data. With
+        blit it only jumps forward when the data reach its right end (with 20% margin), so that
+        most updates do not need a full draw.
+        """
+        if len(t) == 0:
+            return False
+        tmin, tmax = np.min(t), np.max(t)
+        if not(self.blit):
+            self.ax1.set_xlim(tmin, tmax)
+            self.ax2.set_xlim(tmin, tmax)
+            return True
+        xmin, xmax = self.ax1.get_xlim()
+        span = max(tmax - tmin, 1e-6)
+        # margin of at least 3 updates, so that a full draw is needed at most every 3 updates
+        margin = min(max(0.2*span, 3*(tmax - self.last_tmax)), span)
+        self.last_tmax = tmax
+        if (tmax <= xmax) and (tmax >= xmin) and (xmax - xmin <= 2*(span + margin)):
+            return False
+        self.ax1.set_xlim(tmax - span, tmax + margin)
+        self.ax2.set_xlim(tmax - span, tmax + margin)
+        return True
+
     def run(self, controlData):
         if self.stop==True:
-            data.stop=True
+            controlData.stop=True
             self.timer.stop()
-        if len(controlData.counter > self.nmax):
-            controlData.counter = controlData.counter[-self.nmax:]
-            controlData.microseconds = controlData.microseconds[-self.nmax:]
-            controlData.xpos = controlData.xpos[-self.nmax:]
-            controlData.ypos = controlData.ypos[-self.nmax:]
-            controlData.xcom = controlData.xcom[-self.nmax:]
-            controlData.ycom = controlData.ycom[-self.nmax:]
-            controlData.xset = controlData.xset[-self.nmax:]
-            controlData.yset = controlData.yset[-self.nmax:]
-        self.ax1.lines[0].set_data(controlData.microseconds/1e6, controlData.xpos*SG_TO_AS)
-        self.ax1.lines[1].set_data(controlData.microseconds/1e6, controlData.xset*SG_TO_AS)        
-        self.ax2.lines[0].set_data(controlData.microseconds/1e6, controlData.ypos*SG_TO_AS)
-        self.ax2.lines[1].set_data(controlData.microseconds/1e6, controlData.yset*SG_TO_AS)
-        if len(controlData.microseconds) > 0:
-            self.ax1.set_xlim(np.min(controlData.microseconds)/1e6, np.max(controlData.microseconds)/1e6)
-            self.ax2.set_xlim(np.min(controlData.microseconds)/1e6, np.max(controlData.microseconds)/1e6)        
-        self.fig.canvas.draw()
-        return None
-
-class FigureXY():
-    def __init__(self, nmax = 1000):
+        # consistent copy of the last nmax points, the receiver thread keeps appending
+        data = controlData.snapshot(self.nmax)
+        t = data["microseconds"]/1e6
+        # two bins per pixel of the axes
+        nbins = 2*int(self.ax1.bbox.width) if self.decimate else 0
+        for line, key in zip(self.dynamic_artists(), ["xpos", "xset", "ypos", "yset"]):
+            line.set_data(*decimate_minmax(t, data[key]*SG_TO_AS, nbins))
+        self.refresh(self.update_limits(t))
+        return None
+
+class FigureXY(LiveFigure):
+    def __init__(self, nmax = 1000, blit = True, max_points = 2000):
+        """
+        @param nmax: number of points shown
+        @param blit: only redraw the points (and the inset) between two full draws (see LiveFigure)
+        @param max_points: if more points are to be shown, only plot one every nmax/max_points points
+        (the plotted cloud keeps the same shape)
+        """
         self.fig = plt.figure(figsize = (5, 5))
         self.ax = self.fig.add_subplot(111)
         self.timer = self.fig.canvas.new_timer(interval=500)
         mng = self.fig.canvas.manager        
-        mng.window.show()
+        if hasattr(mng, "window"): # not with the non-interactive backends (benchmarks)
+            mng.window.show()
         self.nmax = nmax
+        self.max_points = max_points
         self.stop=False
         self.init_plot()
         self.fig.tight_layout()
+        self.setup_blit(blit)
         return None
 
     def init_plot(self):
@@ -96,58 +192,88 @@ class FigureXY():
         mark_inset(self.ax, self.axins, loc1=2, loc2=4, fc="none", ec="0.5")
         return None
 
+    def dynamic_artists(self):
+        return [self.ax.lines[0], self.axins.lines[0]]
+
+    def on_draw(self, event):
+        # the static inset (with its ticks) is also cached, to be put back over the points of the main axes
+        bbox = self.axins.get_tightbbox(self.fig.canvas.get_renderer())
+        self.inset_background = self.fig.canvas.copy_from_bbox(bbox)
+        return LiveFigure.on_draw(self, event)
+
+    def draw_artists(self):
+        self.fig.draw_artist(self.ax.lines[0])
+        self.fig.canvas.restore_region(self.inset_background)
+        self.fig.draw_artist(self.axins.lines[0])
+        return None
+
     def run(self, controlData):
         if self.stop==True:
-            data.stop=True
+            controlData.stop=True
             self.timer.stop()
-        if len(controlData.counter > self.nmax):
-            controlData.counter = controlData.counter[-self.nmax:]
-            controlData.microseconds = controlData.microseconds[-self.nmax:]
-            controlData.xpos = controlData.xpos[-self.nmax:]
-            controlData.ypos = controlData.ypos[-self.nmax:]
-            controlData.xcom = controlData.xcom[-self.nmax:]
-            controlData.ycom = controlData.ycom[-self.nmax:]
-            controlData.xset = controlData.xset[-self.nmax:]
-            controlData.yset = controlData.yset[-self.nmax:]
-        self.ax.lines[0].set_data(controlData.xpos*SG_TO_AS, controlData.ypos*SG_TO_AS)
-        self.axins.lines[0].set_data(controlData.xpos*SG_TO_AS, controlData.ypos*SG_TO_AS)        
-        self.fig.canvas.draw()
+        data = controlData.snapshot(self.nmax)
+        x, y = data["xpos"]*SG_TO_AS, data["ypos"]*SG_TO_AS
+        if len(x) > self.max_points:
+            # keep the last point
+            step = int(np.ceil(len(x)/self.max_points))
+            x, y = x[(len(x)-1)%step::step], y[(len(y)-1)%step::step]
+        self.ax.lines[0].set_data(x, y)
+        self.axins.lines[0].set_data(x, y)        
+        self.refresh()
         return None
 
 
 class ControlData():
-    def __init__(self):
-        self.counter = np.array([])
-        self.microseconds = np.array([])
-        self.xpos = np.array([])
-        self.ypos = np.array([])
-        self.xcom = np.array([])
-        self.ycom = np.array([])
-        self.xset = np.array([])
-        self.yset = np.array([])                
+    """
+    ring buffer of the control data: the last capacity points of each column are kept in
+    preallocated arrays. The receiver thread appends whole packets with add_packet, and the
+    figures read a consistent copy of the last points with snapshot.
+    """
+    FIELDS = ["counter", "microseconds", "xpos", "ypos", "xcom", "ycom", "xset", "yset"]
+
+    def __init__(self, capacity = 100000):
+        self.capacity = capacity
+        self.columns = {key: np.zeros(capacity) for key in self.FIELDS}
+        self.npoints = 0 # total number of points received
+        self.lock = threading.Lock()
         self.stop=False
         return None
     
     def add_packet(self, packet):
-        self.counter = np.concatenate([self.counter, packet["counter"]])
-        self.microseconds = np.concatenate([self.microseconds, packet["microseconds"]])
-        self.xpos = np.concatenate([self.xpos, packet["xpos"]])
-        self.ypos = np.concatenate([self.ypos, packet["ypos"]])
-        self.xco = np.concatenate([self.xcom, packet["xcom"]])
-        self.ycom = np.concatenate([self.ycom, packet["ycom"]])
-        self.xset = np.concatenate([self.xset, packet["xset"]])
-        self.yset = np.concatenate([self.yset, packet["yset"]])                        
+        n = len(packet["counter"])
+        # only the last capacity points of a packet can be kept
+        m = min(n, self.capacity)
+        with self.lock:
+            start = (self.npoints + n - m) % self.capacity
+            first = min(m, self.capacity - start)
+            for key in self.FIELDS:
+                values = np.asarray(packet[key])[n-m:]
+                self.columns[key][start:start+first] = values[:first]
+                self.columns[key][:m-first] = values[first:]
+            self.npoints = self.npoints + n
         return None        
 
+    def snapshot(self, nmax = None):
+        """ return a dictionnary with a copy of the last nmax points of each column, in time order """
+        with self.lock:
+            n = min(self.npoints, self.capacity)
+            if not(nmax is None):
+                n = min(n, nmax)
+            end = self.npoints % self.capacity
+            if end >= n:
+                return {key: self.columns[key][end-n:end].copy() for key in self.FIELDS}
+            return {key: np.concatenate([self.columns[key][self.capacity-(n-end):], self.columns[key][:end]]) for key in self.FIELDS}
+
 class DataReceiver(StoppableThread):
-    def __init__(self, config = None, verbose_level = 0, **kwargs):
+    def __init__(self, config = None, verbose_level = 0, capacity = 100000, **kwargs):
         super(DataReceiver, self).__init__(**kwargs)
         if config is None:
             raise Exception("please provide a valid configuration dictionnary")
         self.config = config        
         self.connected = False
-        self.controlData = ControlData()
+        self.controlData = ControlData(capacity = capacity)
         self.punp = PackerUnpacker(config = config)        
+        self.poll_timeout = 0.1 # in s, maximum time for the receiver to notice it has been stopped
         return None
 
     def connect(self):
@@ -171,7 +297,7 @@ class DataReceiver(StoppableThread):
     def process_tm(self, tm):
         try:
             packet = self.punp.unpack(Byt(tm))
-            crc_status = self.punp.check_crc(packet)
+            crc_status = self.punp.check_crc_raw(tm)
             print("Got packet of type {} and CRC {}".format(packet["header"]["packet_type"], crc_status))
             if packet["header"]["packet_type"] == 1:
                 self.controlData.add_packet(packet["data"])
@@ -183,14 +309,21 @@ class DataReceiver(StoppableThread):
         return None        
         
     def run(self):
+        # wait on the socket and drain all the packets which are ready, reading one packet every
+        # 100ms could not keep up with the control loop data rate
+        poller = zmq.Poller()
+        poller.register(self.tm_receiver, zmq.POLLIN)
         while not(self.stopped()):
-            time.sleep(0.1) # breathing room
-            try:
-                tm = self.tm_receiver.recv(zmq.NOBLOCK)
-                self.process_tm(tm)                
-            except zmq.ZMQError as e:
-                if e.errno == zmq.EAGAIN:
-                    pass # no message was ready (yet!)
+            events = dict(poller.poll(self.poll_timeout*1000))
+            if not(self.tm_receiver in events):
+                continue
+            while True:
+                try:
+                    tm = self.tm_receiver.recv(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                self.process_tm(tm)
+        poller.unregister(self.tm_receiver)
         print("DataReceiver has stopped")
         return None
 
@@ -202,6 +335,11 @@ def stop():
 if __name__ == "__main__":
     from ruamel import yaml
     import os
+    import matplotlib
+    # the backend is only chosen when running the live plots, so that the figures can be imported
+    # and benchmarked with a non-interactive backend
+    matplotlib.use("QtAgg")
+    plt.ion()
 
     # get path to this file
     this_dir = os.path.dirname(os.path.abspath(__file__))
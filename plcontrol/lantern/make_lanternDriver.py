@@ -0,0 +1,89 @@
+#coding: utf8
+"""
+Generate lanternDriver.py from the tc_packet_data.yml descriptor: one method per command, which
+sends the command with the precompiled encoder of the PackerUnpacker (BaseDriver.send_command).
+
+The docstrings of the commands are taken from the current lanternDriver.py, so that only the
+commands added to the YML file need to be documented by hand after generation.
+
+usage:
+    python make_lanternDriver.py           # regenerate lanternDriver.py
+    python make_lanternDriver.py --check   # check that lanternDriver.py is up to date with the YML file
+"""
+import ast
+import sys
+import os
+import ruamel.yaml as yaml
+from packerUnpacker import command_parameters
+
+HEADER = '''# coding: utf-8
+# generated by make_lanternDriver.py from descriptors/tc_packet_data.yml, do not edit by hand
+from .baseDriver import BaseDriver
+
+class LanternDriver(object):
+    def __init__(self, *args, **kwargs):
+        self._driver = BaseDriver(*args, **kwargs)
+        return None
+
+    def transaction(self, timeout = 3, max_in_flight = 8):
+        """
+        send the commands called inside a with block back to back, and check all their EACKs
+        when leaving the block (see baseDriver.Transaction)
+        @param (float) timeout: time (in s) to wait for the EACKs
+        @param (int) max_in_flight: maximum number of commands not acknowledged yet
+        """
+        return self._driver.transaction(timeout = timeout, max_in_flight = max_in_flight)
+'''
+
+METHOD = '''
+    def {name}(self{signature}):
+        """
+{docstring}
+        """
+        return self._driver.send_command({command_id}{arguments})
+'''
+
+def read_docstrings(filename):
+    """ docstrings of the methods of LanternDriver in an existing lanternDriver.py """
+    docstrings = {}
+    if not(os.path.isfile(filename)):
+        return docstrings
+    tree = ast.parse(open(filename).read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef):
+            docstring = ast.get_docstring(node)
+            if not(docstring is None):
+                docstrings[node.name] = docstring
+    return docstrings
+
+def generate(tc_packet_data, docstrings):
+    code = HEADER
+    for name in tc_packet_data:
+        command_id = tc_packet_data[name]["command_id"]
+        params = command_parameters(tc_packet_data[name]["format"])
+        docstring = docstrings.get(name)
+        if docstring is None:
+            docstring = "\n".join(["{} (command {})".format(name, command_id)] + ["@param {}:".format(p) for p in params])
+        code += METHOD.format(name = name,
+                              signature = "".join([", {}=None".format(p) for p in params]),
+                              docstring = "\n".join(["        " + line for line in docstring.split("\n")]),
+                              command_id = command_id,
+                              arguments = "".join([", {}".format(p) for p in params]))
+    return code
+
+if __name__ == "__main__":
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    driver_filename = this_dir + "/lanternDriver.py"
+    LOADER = yaml.YAML()
+    tc_packet_data = LOADER.load(open(this_dir + "/descriptors/tc_packet_data.yml").read())
+    code = generate(tc_packet_data, read_docstrings(driver_filename))
+    if "--check" in sys.argv:
+        current = open(driver_filename).read()
+        if current != code:
+            print("lanternDriver.py is not up to date with tc_packet_data.yml, run make_lanternDriver.py")
+            sys.exit(1)
+        print("lanternDriver.py is up to date ({} commands)".format(len(tc_packet_data)))
+    else:
+        with open(driver_filename, "w") as f:
+            f.write(code)
+        print("lanternDriver.py generated ({} commands)".format(len(tc_packet_data)))
@@ -1,11 +1,15 @@
 #coding: utf8
 from byt import Byt
 import struct
+import numpy as np
 import os.path
 import copy
+import zlib
 import ruamel.yaml as yaml
 
 LOADER = yaml.YAML()
+# bytes with their bit order reversed, for computing the MSB first CRC with zlib
+REVERSED_BITS = bytes([int("{:08b}".format(i)[::-1], 2) for i in range(256)])
 
 class PackerUnpacker:
     """A class to pack and unpack TM/TC packets following the description given in a YML file"""
@@ -13,15 +17,6 @@ class PackerUnpacker:
         if config is None:
             raise Exception("please provide a valid configuration dictionnary")
         self.config = config
-        # lookup table for cimputing payload crc
-        payload_crc_table = {}
-        poly = 0x04C11DB7
-        for byte in range(256):
-            c = byte << 24
-            for i in range(8):
-                c = (c << 1) ^ poly if (c & 0x80000000) else c << 1
-            payload_crc_table[byte] = c & 0xffffffff
-        self.payload_crc_table = payload_crc_table
         self.tc_reply_packet_type = None
         self.rack_packet_type = None
         self.eack_packet_type = None        
@@ -29,10 +24,15 @@ class PackerUnpacker:
         return None
     
     def _compute_crc32(self, message):
-        crc = 0xffffffff
-        for i in Byt(message).iterInts():
-            crc = ((crc << 8) & 0xffffffff) ^ self.payload_crc_table[(crc >> 24) ^ i]
-        return crc
+        """ CRC32 of the payloads: MSB first, polynomial 0x04C11DB7, initial value 0xffffffff, no final xor.
+
+        This is the bit-reversed image of the reflected CRC32 of zlib, so the work is done by
+        zlib.crc32 on the bit-reversed bytes, and the result is reversed back.
+        """
+        if not(isinstance(message, (bytes, bytearray))):
+            message = Byt(message)
+        crc = zlib.crc32(message.translate(REVERSED_BITS)) ^ 0xffffffff
+        return int("{:032b}".format(crc)[::-1], 2)
     
     def check_crc(self, packet):
         packet_copy = copy.deepcopy(packet)
@@ -40,6 +40,17 @@ class PackerUnpacker:
         crc_calc = self._compute_crc32(self.pack(packet_copy))
         return crc_calc==packet["header"]["crc"]
 
+    def check_crc_raw(self, packet):
+        """ check the CRC of a packet directly on the received bytes (no unpacking, copy or re-packing) """
+        if ((ord(packet[:1]) >> 7) == 0):
+            crc_desc = self.tmtc_desc["telemetry"]["header"]["crc"]
+        else:
+            crc_desc = self.tmtc_desc["telecommand"]["header"]["crc"]
+        start, end = crc_desc["start"], crc_desc["start"] + crc_desc["length"]
+        packet = bytes(packet)
+        crc = struct.unpack(crc_desc["format"], packet[start:end])[0]
+        return self._compute_crc32(packet[:start] + bytes(end - start) + packet[end:]) == crc
+
     def load_descriptors(self):
         """ load packet descriptors from a given directory."""
 
@@ -71,7 +82,9 @@ class PackerUnpacker:
 
         # process the list of tm data types
         tm_packet_data_desc = {}
+        self.tm_packet_types = {}
         for type in self.tm_packet_data_desc:
+            self.tm_packet_types[type] = self.tm_packet_data_desc[type]["packet_type"]
             if type == "tc_reply":
                 self.tc_reply_packet_type = self.tm_packet_data_desc[type]["packet_type"]
             if type == "rack":
@@ -82,125 +95,367 @@ class PackerUnpacker:
         self.tm_packet_data_desc = tm_packet_data_desc
         # process the list of tm data types
         tc_packet_data_desc = {}
+        self.tc_command_names = {}
         for cmd in self.tc_packet_data_desc:
             tc_packet_data_desc[self.tc_packet_data_desc[cmd]["command_id"]] = self.tc_packet_data_desc[cmd]["format"]
+            self.tc_command_names[self.tc_packet_data_desc[cmd]["command_id"]] = cmd
         self.tc_packet_data_desc = tc_packet_data_desc
         # process list of tc_reply data
         tc_reply_data_desc = {}
         for cmd in self.tc_reply_data_desc:
             tc_reply_data_desc[self.tc_reply_data_desc[cmd]["command_id"]] = self.tc_reply_data_desc[cmd]["format"]
         self.tc_reply_data_desc = tc_reply_data_desc
+        # compile all the descriptions once, so that packing/unpacking does not walk the YML trees
+        self.tm_header_codec = compile_descriptor(self.tmtc_desc["telemetry"]["header"], self.error_desc)
+        self.tc_header_codec = compile_descriptor(self.tmtc_desc["telecommand"]["header"], self.error_desc)
+        self.tm_data_start = self.tmtc_desc["telemetry"]["data"]["start"]
+        self.tc_data_start = self.tmtc_desc["telecommand"]["data"]["start"]
+        self.tm_packet_data_codec = {key: compile_descriptor(desc, self.error_desc) for key, desc in self.tm_packet_data_desc.items()}
+        self.tc_packet_data_codec = {key: compile_descriptor(desc, self.error_desc) for key, desc in self.tc_packet_data_desc.items()}
+        self.tc_reply_data_codec = {key: compile_descriptor(desc, self.error_desc) for key, desc in self.tc_reply_data_desc.items()}
+        self.tc_encoders = {key: TCEncoder(self, key) for key in self.tc_packet_data_desc}
         return None
     
-    def _unpack_from_desc(self, packet, desc, fieldname):
-        """ Recursively unpack the different fields given in the packet description """
-        start = desc["start"]
-        length = desc["length"]
-        if length in ["none", "null", "None", "Null"]:
-            subpacket = packet[start:]
-        else:
-            subpacket = packet[start:start+length]
-        if "format" in desc.keys():
-            fields = fieldname.split(",")         
-            if desc["format"] in ["none", "null", "None", "Null"]:
-                return subpacket
-            else:
-                unpacked = []
-                it = struct.iter_unpack(desc["format"], subpacket)
-            if len(fields) == 1:
-                if fields[0] == "error":
-                    unpacked = [self.error_desc["code_to_msg"][r[0]] for r in it]                   
-                else:
-                    unpacked = [r[0] for r in it]
-                    if desc["format"] == "s":
-                        unpacked = b''.join(unpacked)
-            else:
-                values = [r for r in it]
-                unpacked = {fields[k].strip(): [v[k] for v in values] for k in range(len(fields))}
-            if len(unpacked) == 1:
-                unpacked = unpacked[0]             
-            return unpacked
-        else:
-            unpacked = {}
-            for k in desc.keys():
-                if k in ["start", "length"]:
-                    pass
-                else:
-                    if len(k.split(",")) > 1:
-                        unpacked = {**unpacked, **self._unpack_from_desc(subpacket, desc[k], k)}
-                    else:
-                        unpacked[k] = self._unpack_from_desc(subpacket, desc[k], k)
-            return unpacked 
-
-    def _pack_from_desc(self, packet, packet_desc):
-        """ Recursively pack a packet following the different fields in the description """
-        start = packet_desc["start"]
-        length = packet_desc["length"]
-        if "format" in packet_desc.keys():
-            if isinstance(packet, list):
-                packed = Byt("")
-                for b in packet:
-                    packed += Byt(struct.pack(packet_desc["format"], b))
-            else:
-                if packet_desc["format"] in ["none", "null", "None", "Null"]:
-                    packed = Byt(packet)
-                else:
-                    if packet_desc["format"] == "s":     
-                        packed = Byt()
-                        for b in packet: 
-                            packed = packed + Byt(struct.pack(packet_desc["format"], Byt(b)))        
-                    else:                                          
-                        packed = Byt(struct.pack(packet_desc["format"], packet))
-            return packed
-        else:
-            packed = Byt()
-            for key in packet_desc.keys():
-                if key in ["start", "length"]:
-                    pass
-                else:
-                    if len(key.split(",")) == 1:
-                        if key == "error":
-                            packet[key] = self.error_desc["msg_to_code"][packet[key]]                               
-                        packed += Byt(self._pack_from_desc(packet[key], packet_desc[key]))
-                    else:
-                        keys = [k.strip() for k in key.split(",")]
-                        for j in range(len(packet[keys[0]])):
-                            data = [packet[k][j] for k in keys]
-                            packed += Byt(struct.pack(packet_desc[key]["format"], *data))
-            return packed 
+    def pack_tc_data(self, cmd_data_dict):
+        """ pack the data part of a TC (command_id and parameters) """
+        return Byt(self.tc_packet_data_codec[cmd_data_dict["command_id"]].pack(cmd_data_dict))
         
     def unpack(self, packet):
         """ Unpack a TM/TC packet by using the first bit to identify it """
-        if ((packet.ints()[0] >> 7) == 0):
-            unpacked = self._unpack_from_desc(packet, self.tmtc_desc["telemetry"], "telemetry")
-            type = unpacked["header"]["packet_type"]
-            unpacked["data"] = self._unpack_from_desc(unpacked["data"], self.tm_packet_data_desc[type], type)
+        end = len(packet)
+        if ((ord(packet[:1]) >> 7) == 0):
+            header = self.tm_header_codec.unpack(packet, 0, end)
+            type = header["packet_type"]
+            unpacked = {"header": header, "data": self.tm_packet_data_codec[type].unpack(packet, self.tm_data_start, end)}
             if not(self.tc_reply_packet_type is None):
                 if type == self.tc_reply_packet_type:
                     cmd_id = unpacked["data"]["command_id"]
-                    unpacked["data"]["tc_reply_data"] = self._unpack_from_desc(unpacked["data"]["tc_reply_data"], 
-                                                                               self.tc_reply_data_desc[cmd_id], cmd_id)
+                    reply = unpacked["data"]["tc_reply_data"]
+                    unpacked["data"]["tc_reply_data"] = self.tc_reply_data_codec[cmd_id].unpack(reply, 0, len(reply))
         else:
-            unpacked = self._unpack_from_desc(packet, self.tmtc_desc["telecommand"], "telecommand")
-            command_id = struct.unpack("B", unpacked["data"][0])[0]
-            unpacked["data"] = self._unpack_from_desc(unpacked["data"], self.tc_packet_data_desc[command_id], command_id)
+            header = self.tc_header_codec.unpack(packet, 0, end)
+            command_id = ord(packet[self.tc_data_start:self.tc_data_start+1])
+            unpacked = {"header": header, "data": self.tc_packet_data_codec[command_id].unpack(packet, self.tc_data_start, end)}
         return unpacked
             
     def pack(self, packet):
         """ pack a TM/TC packet by first looking at which type it is using system_id """
         if ((packet["header"]["system_id"]>>7) == 0):
-            header = self._pack_from_desc(packet["header"], self.tmtc_desc["telemetry"]["header"])
-            if ( (self.tc_reply_packet_type is None) or (packet["header"]["packet_type"] != self.tc_reply_packet_type) ):
-                data = self._pack_from_desc(packet["data"], self.tm_packet_data_desc[packet["header"]["packet_type"]])
+            header = self.tm_header_codec.pack(packet["header"])
+            packet_type = packet["header"]["packet_type"]
+            if ( (self.tc_reply_packet_type is None) or (packet_type != self.tc_reply_packet_type) ):
+                data = self.tm_packet_data_codec[packet_type].pack(packet["data"])
             else:
                 cmd_id = packet["data"]["command_id"]
-                packet["data"]["tc_reply_data"] = self._pack_from_desc(packet["data"]["tc_reply_data"], self.tc_reply_data_desc[cmd_id])
-                data = self._pack_from_desc(packet["data"], self.tm_packet_data_desc[packet["header"]["packet_type"]])
+                reply = self.tc_reply_data_codec[cmd_id].pack(packet["data"]["tc_reply_data"])
+                data = self.tm_packet_data_codec[packet_type].pack({**packet["data"], "tc_reply_data": reply})
         else:
-            header = self._pack_from_desc(packet["header"], self.tmtc_desc["telecommand"]["header"])
-            data = self._pack_from_desc(packet["data"], self.tc_packet_data_desc[packet["data"]["command_id"]])
-        return header+data
-    
+            header = self.tc_header_codec.pack(packet["header"])
+            data = self.tc_packet_data_codec[packet["data"]["command_id"]].pack(packet["data"])
+        return Byt(header+data)
+
+
+NONE_VALUES = ["none", "null", "None", "Null"]
+
+# numpy equivalent of the struct format characters (native byte order, as in struct)
+NUMPY_FORMATS = {"b": "i1", "B": "u1", "h": "i2", "H": "u2", "i": "i4", "I": "u4",
+                 "q": "i8", "Q": "u8", "f": "f4", "d": "f8"}
+
+def record_dtype(format, names):
+    """ numpy structured dtype with the same layout as a struct format (including its alignment),
+    or None if the format has no numpy equivalent """
+    format = format.strip()
+    if len(format) != len(names) or any([c not in NUMPY_FORMATS for c in format]):
+        return None
+    offsets = [struct.calcsize(format[:i+1]) - struct.calcsize(format[i]) for i in range(len(format))]
+    return np.dtype({"names": names,
+                     "formats": ["=" + NUMPY_FORMATS[c] for c in format],
+                     "offsets": offsets,
+                     "itemsize": struct.calcsize(format)})
+
+def compile_descriptor(desc, error_desc, name=""):
+    """ Compile a (sub)packet description of the YML files into a FieldCodec, FlatCodec or NodeCodec """
+    if "format" in desc.keys():
+        return FieldCodec(desc, name, error_desc)
+    node = NodeCodec(desc, error_desc)
+    flat = FlatCodec.from_node(node)
+    if flat is None:
+        return node
+    return flat
+
+
+class FieldCodec:
+    """ Precompiled leaf of a packet description: one field (or a comma separated list of fields) with a struct format.
+
+    The decoded values are the same as the ones of the original recursive unpacker: lists are
+    returned as a single value if they have one element, "s" fields are joined into bytes and
+    "error" fields are translated with the error descriptor.
+    Comma separated fields (e.g. the control_data records) are decoded with np.frombuffer and a
+    structured dtype, and returned as a dictionnary of column arrays which are views on the packet.
+    """
+    def __init__(self, desc, name, error_desc):
+        self.start = desc["start"]
+        self.length = None if desc["length"] in NONE_VALUES else desc["length"]
+        self.format = desc["format"]
+        self.fields = str(name).split(",")
+        self.keys = [f.strip() for f in self.fields]
+        self.error_desc = error_desc
+        self.raw = self.format in NONE_VALUES
+        self.struct = None if self.raw else struct.Struct(self.format)
+        self.is_error = (len(self.fields) == 1) and (self.fields[0] == "error")
+        self.is_string = (self.format == "s")
+        self.dtype = None if (self.raw or len(self.fields) == 1) else record_dtype(self.format, self.keys)
+
+    def unpack(self, packet, start, end):
+        """ unpack the field found between start and end in packet """
+        if self.raw:
+            return packet[start:end]
+        if not(self.dtype is None):
+            return self.unpack_records(packet, start, end)
+        values = self.struct.iter_unpack(packet[start:end])
+        if len(self.fields) == 1:
+            if self.is_error:
+                unpacked = [self.error_desc["code_to_msg"][r[0]] for r in values]
+            else:
+                unpacked = [r[0] for r in values]
+                if self.is_string:
+                    unpacked = b''.join(unpacked)
+        else:
+            columns = list(zip(*values))
+            if len(columns) == 0:
+                columns = [[] for f in self.fields]
+            unpacked = {self.keys[k]: list(columns[k]) for k in range(len(self.fields))}
+        if len(unpacked) == 1:
+            unpacked = unpacked[0]
+        return unpacked
+
+    def unpack_records(self, packet, start, end):
+        """ zero-copy decoding of comma separated fields, returns a dictionnary of column arrays """
+        if ((end - start) % self.dtype.itemsize) != 0:
+            raise struct.error("unpacking requires a buffer of a multiple of {} bytes".format(self.dtype.itemsize))
+        if end <= start:
+            records = np.zeros(0, dtype=self.dtype)
+        else:
+            records = np.frombuffer(packet, dtype=self.dtype, count=(end - start)//self.dtype.itemsize, offset=start)
+        return {key: records[key] for key in self.keys}
+
+    def pack(self, value):
+        """ pack the value of the field (single value, list, or bytes for the "s" and raw fields) """
+        if isinstance(value, list):
+            pack = self.struct.pack
+            return b''.join([pack(v) for v in value])
+        if self.raw or self.is_string:
+            return bytes(Byt(value))
+        if self.is_error:
+            value = self.error_desc["msg_to_code"][value]
+        return self.struct.pack(value)
+
+    def pack_columns(self, packet):
+        """ pack the interleaved values of a comma separated list of fields """
+        if not(self.dtype is None):
+            records = np.zeros(len(packet[self.keys[0]]), dtype=self.dtype)
+            for k in self.keys:
+                records[k] = packet[k]
+            return records.tobytes()
+        columns = [packet[k] for k in self.keys]
+        pack = self.struct.pack
+        return b''.join([pack(*data) for data in zip(*columns)])
+
+
+class NodeCodec:
+    """ Precompiled node of a packet description, with the codecs of its sub-fields in the YML order """
+    def __init__(self, desc, error_desc):
+        self.start = desc["start"]
+        self.length = None if desc["length"] in NONE_VALUES else desc["length"]
+        self.error_desc = error_desc
+        self.children = []
+        for key in desc.keys():
+            if key in ["start", "length"]:
+                continue
+            merged = len(str(key).split(",")) > 1
+            self.children.append((key, compile_descriptor(desc[key], error_desc, key), merged))
+
+    def unpack(self, packet, start, end):
+        unpacked = {}
+        for key, codec, merged in self.children:
+            child_start = start + codec.start
+            child_end = end if codec.length is None else min(end, child_start + codec.length)
+            if merged:
+                unpacked.update(codec.unpack(packet, child_start, max(child_start, child_end)))
+            else:
+                unpacked[key] = codec.unpack(packet, child_start, max(child_start, child_end))
+        return unpacked
+
+    def pack(self, packet):
+        packed = []
+        for key, codec, merged in self.children:
+            if merged:
+                packed.append(codec.pack_columns(packet))
+            else:
+                packed.append(codec.pack(packet[key]))
+        return b''.join(packed)
+
+
+class FlatCodec:
+    """ Precompiled node whose fields all have a fixed size and position: packed and unpacked with a single struct.
+
+    The node codec is kept as fall back for packets shorter than the description or values that
+    are not scalars.
+    """
+    def __init__(self, node, layout, items, span):
+        self.node = node
+        self.start = node.start
+        self.length = node.length
+        self.layout = layout
+        self.span = span
+        # unpacking follows the positions of the fields (with padding), packing just concatenates
+        # them in the YML order like the original packer
+        offset, unpack_format = 0, "="
+        for position, format, path, is_error in items:
+            if position > offset:
+                unpack_format += "{}x".format(position - offset)
+            unpack_format += format
+            offset = position + struct.calcsize(format)
+        self.unpack_struct = struct.Struct(unpack_format)
+        self.pack_struct = struct.Struct("=" + "".join([item[1] for item in items]))
+        self.paths = [item[2] for item in items]
+        self.errors = [i for i, item in enumerate(items) if item[3]]
+        self.error_desc = node.error_desc
+
+    @classmethod
+    def from_node(cls, node):
+        """ return the flat codec of a node, or None if some of its fields do not have a fixed size and position """
+        items = []
+        layout = cls._flatten(node, 0, items, [])
+        if layout is None:
+            return None
+        positions = [item[0] for item in items]
+        ends = [item[0] + struct.calcsize(item[1]) for item in items]
+        if any(ends[i] > positions[i+1] for i in range(len(items)-1)):
+            return None
+        return cls(node, layout, items, max(ends, default=0))
+
+    @classmethod
+    def _flatten(cls, node, offset, items, path):
+        layout = []
+        for key, codec, merged in node.children:
+            if merged:
+                return None
+            position = offset + codec.start
+            if isinstance(codec, FieldCodec):
+                format = codec.format.strip() if not(codec.raw) else ""
+                if (codec.raw or codec.is_string or len(format) != 1 or codec.length != struct.calcsize(format)
+                        or struct.calcsize(format) != struct.calcsize("=" + format)):
+                    return None
+                items.append((position, format, path + [key], codec.is_error))
+                layout.append((key, len(items)-1))
+            else:
+                node_codec = codec.node if isinstance(codec, FlatCodec) else codec
+                first = len(items)
+                sublayout = cls._flatten(node_codec, position, items, path + [key])
+                if sublayout is None:
+                    return None
+                # the fields must fit in the length of the sub-node, otherwise they would be truncated
+                if node_codec.length is not None:
+                    if any(item[0] + struct.calcsize(item[1]) > position + node_codec.length for item in items[first:]):
+                        return None
+                layout.append((key, sublayout))
+        return layout
+
+    def _build(self, layout, values):
+        return {key: (values[item] if isinstance(item, int) else self._build(item, values)) for key, item in layout}
+
+    def unpack(self, packet, start, end):
+        if end - start < self.span:
+            return self.node.unpack(packet, start, end)
+        values = self.unpack_struct.unpack_from(packet, start)
+        if len(self.errors) > 0:
+            values = list(values)
+            for i in self.errors:
+                values[i] = self.error_desc["code_to_msg"][values[i]]
+        return self._build(self.layout, values)
+
+    def pack(self, packet):
+        values = []
+        for path in self.paths:
+            value = packet
+            for key in path:
+                value = value[key]
+            values.append(value)
+        for i in self.errors:
+            values[i] = self.error_desc["msg_to_code"][values[i]]
+        try:
+            return self.pack_struct.pack(*values)
+        except struct.error:
+            # e.g. lists given for scalar fields
+            return self.node.pack(packet)
+
+
+def command_parameters(desc):
+    """ names of the parameters of a command, in the YML order, from the "format" description of tc_packet_data """
+    params = desc.get("params")
+    names = []
+    def walk(node):
+        for key in node.keys():
+            if key in ["start", "length"]:
+                continue
+            if "format" in node[key].keys():
+                names.extend([k.strip() for k in str(key).split(",")])
+            else:
+                walk(node[key])
+    if isinstance(params, dict):
+        walk(params)
+    return names
+
+
+class TCEncoder:
+    """ Precompiled encoder of a complete TC (header and data) for one command.
+
+    The parameters are given in the order of the YML description. The packet is packed once in a
+    buffer allocated to its final size: the data with the single struct of the command when its
+    parameters have a fixed size (FlatCodec), the header fields in place, then the CRC (computed with
+    a zero CRC field, as in PackerUnpacker.pack).
+    """
+    def __init__(self, punp, command_id):
+        self.punp = punp
+        self.command_id = command_id
+        self.name = punp.tc_command_names[command_id]
+        self.params = command_parameters(punp.tc_packet_data_desc[command_id])
+        self.data_codec = punp.tc_packet_data_codec[command_id]
+        self.data_start = punp.tc_data_start
+        header_desc = punp.tmtc_desc["telecommand"]["header"]
+        self.header_fields = {key: (header_desc[key]["start"], struct.Struct("=" + header_desc[key]["format"]))
+                              for key in ["system_id", "packet_id", "data_length", "crc"]}
+        self.data_struct = None
+        if isinstance(self.data_codec, FlatCodec) and (len(self.data_codec.errors) == 0):
+            if [path[-1] for path in self.data_codec.paths] == ["command_id"] + self.params:
+                self.data_struct = self.data_codec.pack_struct
+
+    def encode(self, system_id, packet_id, values):
+        """ return the packed packet (bytearray) and the corresponding tc dictionnary """
+        params = dict(zip(self.params, values))
+        buffer = None
+        if not(self.data_struct is None):
+            try:
+                buffer = bytearray(self.data_start + self.data_struct.size)
+                self.data_struct.pack_into(buffer, self.data_start, self.command_id, *values)
+            except struct.error:
+                # e.g. lists given for scalar fields
+                buffer = None
+        if buffer is None:
+            data = self.data_codec.pack({"command_id": self.command_id, "params": params})
+            buffer = bytearray(self.data_start + len(data))
+            buffer[self.data_start:] = data
+        data_length = len(buffer) - self.data_start
+        header = {"system_id": system_id, "packet_id": packet_id, "data_length": data_length, "crc": 0}
+        for key in ["system_id", "packet_id", "data_length"]:
+            start, field = self.header_fields[key]
+            field.pack_into(buffer, start, header[key])
+        header["crc"] = self.punp._compute_crc32(buffer)
+        start, field = self.header_fields["crc"]
+        field.pack_into(buffer, start, header["crc"])
+        return buffer, {"header": header, "data": {"command_id": self.command_id, "params": params}}
+
 
 # debug
 if __name__ == "__main__":
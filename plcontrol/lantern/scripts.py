@@ -20,14 +20,7 @@ class LanternScripts(object):
         """
         wait for ack for last tc sent and raise and exception if an error occured
         """
-        t0 = time.time()
-        while (self._db.tcs[-1].eack is None):
-            time.sleep(0.1)
-            if (time.time() - t0) > timeout:
-                raise Exception("Timeout!")
-        error = self._db.tcs[-1].eack["data"]["error"]
-        if error != "OK":
-            raise Exception("Error {} occured".format(error))
+        self._db.tcs[-1].result(timeout = timeout)
         return None
         
     def retrieve_modulation_sequence(self, sequence = None, timeout = 10):
@@ -38,20 +31,14 @@ class LanternScripts(object):
         if not(sequence in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]):
             raise Exception("Please provide a sequence id between 1 and 10")
         t0 = time.time()
-        self._ld.get_modulation_sequence(sequence = sequence)
-        while (self._db.tcs[-1].eack is None):
-            time.sleep(0.1)
-            if (time.time() - t0) > timeout:
-                raise Exception("Timeout!")
-        if len(self._db.tcs[-1].reply) == 0:
+        tc = self._ld.get_modulation_sequence(sequence = sequence)
+        tc.result(timeout = timeout)
+        if not(tc.wait_replies(1, timeout = max(0, timeout - (time.time() - t0)))):
             raise Exception("Did not get a reply")
-        tc = self._db.tcs[-1]
         npoints = tc.reply[0]["data"]["tc_reply_data"]["npoints"]
-        npoints_received = 0
-        while(npoints_received != npoints):
-            if (time.time() - t0) > timeout:
-                raise Exception("Timeout!")        
-            npoints_received = np.array([len(r["data"]["tc_reply_data"]["xmod"]) for r in tc.reply]).sum()
+        # the receiver thread notifies the tc for each reply packet
+        if not(tc.wait_reply_points("xmod", npoints, timeout = max(0, timeout - (time.time() - t0)))):
+            raise Exception("Timeout!")        
         # gather data in proper order
         xmod = np.zeros(npoints)
         ymod = np.zeros(npoints)
@@ -74,33 +61,32 @@ class LanternScripts(object):
             raise Exception("xmod and ymod should be of same length")
         if len(xmod) > 625:
             raise Exception("Modulation sequence is too long! The limit is 625 points")
-        # first we need to set the flash mode
-        self._ld.switch_modulation_loop(state = False)
-        self._db.validate_last_tc()
-        self._ld.switch_flashing_mode(state = True)
-        self._db.validate_last_tc()
-        # now we need to upload the sequence bit by bit as we are limited in packet size
-        nmod = len(xmod)
-        n_points_per_packet = 200 # will put 200 points per packet
-        npackets = 1 + nmod//n_points_per_packet
-        for k in range(npackets):
-            startpoint = k*n_points_per_packet
-            npoints = min(n_points_per_packet, nmod - k*n_points_per_packet)
-            x = xmod[k*n_points_per_packet:(k+1)*n_points_per_packet]
-            y = ymod[k*n_points_per_packet:(k+1)*n_points_per_packet]
-            self._ld.set_modulation_sequence(startpoint = startpoint, npoints = npoints, xmod = x, ymod = y)
-            self._db.validate_last_tc()
-        # now we can request flashing. For this we need the crs
-        xmod_bytes, ymod_bytes = Byt(), Byt()
-        for k in range(nmod):
-            xmod_bytes+=Byt(struct.pack("f", xmod[k]))
-            ymod_bytes+=Byt(struct.pack("f", ymod[k]))
+        # the crcs of the sequence are needed for flashing
+        xmod_bytes = np.asarray(xmod, dtype="=f4").tobytes()
+        ymod_bytes = np.asarray(ymod, dtype="=f4").tobytes()
         xcrc = self._ld._driver.punp._compute_crc32(xmod_bytes)
         ycrc = self._ld._driver.punp._compute_crc32(ymod_bytes)
-        self._ld.flash_sequence(sequence = sequence, npoints = nmod, xcrc = xcrc, ycrc = ycrc)
-        self._db.validate_last_tc()
-        self._ld.switch_flashing_mode(state = False)   
-        self._db.validate_last_tc()             
+        with self._ld.transaction(timeout = timeout) as tr:
+            # first we need to set the flash mode
+            self._ld.switch_modulation_loop(state = False)
+            self._ld.switch_flashing_mode(state = True)
+            tr.barrier()
+            # now we need to upload the sequence bit by bit as we are limited in packet size
+            nmod = len(xmod)
+            n_points_per_packet = 200 # will put 200 points per packet
+            npackets = 1 + nmod//n_points_per_packet
+            for k in range(npackets):
+                startpoint = k*n_points_per_packet
+                npoints = min(n_points_per_packet, nmod - k*n_points_per_packet)
+                x = xmod[k*n_points_per_packet:(k+1)*n_points_per_packet]
+                y = ymod[k*n_points_per_packet:(k+1)*n_points_per_packet]
+                self._ld.set_modulation_sequence(startpoint = startpoint, npoints = npoints, xmod = x, ymod = y)
+            # only flash if all the points were accepted
+            tr.barrier()
+            self._ld.flash_sequence(sequence = sequence, npoints = nmod, xcrc = xcrc, ycrc = ycrc)
+            # leave the flashing mode only once the sequence is written
+            tr.barrier()
+            self._ld.switch_flashing_mode(state = False)   
         return None
     
     def upload_configuration_file(self, config_id = None, filename = None, reboot = False):
@@ -133,16 +119,12 @@ class LanternScripts(object):
         self._db.validate_last_tc()
         time.sleep(wait)
         t0 = time.time()
-        self._ld.download_data()
-        self._db.validate_last_tc()
-        if len(self._db.tcs[-1].reply) == 0:
+        tc = self._ld.download_data()
+        tc.result()
+        if not(tc.wait_replies(1, timeout = max(0, timeout - (time.time() - t0)))):
             raise Exception("Did not get a reply")
-        tc = self._db.tcs[-1]
-        npoints_received = len(tc.reply[0]["data"]["tc_reply_data"]["counter"])
-        while(npoints_received < npoints):
-            if (time.time() - t0) > timeout:
-                raise Exception("Timeout!")        
-            npoints_received = np.array([len(r["data"]["tc_reply_data"]["counter"]) for r in tc.reply]).sum()
+        if not(tc.wait_reply_points("counter", npoints, timeout = max(0, timeout - (time.time() - t0)))):
+            raise Exception("Timeout!")        
         # gather data
         counter = np.concatenate([reply["data"]["tc_reply_data"]["counter"] for reply in tc.reply])        
         microseconds = np.concatenate([reply["data"]["tc_reply_data"]["microseconds"] for reply in tc.reply])
@@ -172,9 +154,7 @@ class LanternScripts(object):
         xpos, ypos = np.zeros(nreadouts), np.zeros(nreadouts)
         for k in range(nreadouts):
             time.sleep(0.2)
-            self._ld.get_piezo_position()
-            self._db.validate_last_tc()
-            tc = self._db.tcs[-1]
+            tc = self._ld.get_piezo_position().result(nreplies = 1)
             x, y = tc.reply[0]["data"]["tc_reply_data"]["x_pos"], tc.reply[0]["data"]["tc_reply_data"]["y_pos"]
             xpos[k], ypos[k] = x, y
         return xpos, ypos
@@ -211,16 +191,12 @@ class LanternScripts(object):
         time.sleep(waittime)
         # download and return data
         t0 = time.time()
-        self._ld.download_data()
-        self._db.validate_last_tc()
-        if len(self._db.tcs[-1].reply) == 0:
+        tc = self._ld.download_data()
+        tc.result()
+        if not(tc.wait_replies(1, timeout = max(0, timeout - (time.time() - t0)))):
             raise Exception("Did not get a reply")
-        tc = self._db.tcs[-1]
-        npoints_received = len(tc.reply[0]["data"]["tc_reply_data"]["counter"])
-        while(npoints_received < npoints):
-            if (time.time() - t0) > timeout:
-                raise Exception("Timeout!")        
-            npoints_received = np.array([len(r["data"]["tc_reply_data"]["counter"]) for r in tc.reply]).sum()
+        if not(tc.wait_reply_points("counter", npoints, timeout = max(0, timeout - (time.time() - t0)))):
+            raise Exception("Timeout!")        
         # gather data
         counter = np.concatenate([reply["data"]["tc_reply_data"]["counter"] for reply in tc.reply])        
         microseconds = np.concatenate([reply["data"]["tc_reply_data"]["microseconds"] for reply in tc.reply])
@@ -254,9 +230,7 @@ class LanternScripts(object):
             self._ld.move_piezo(xcom[k], ycom[k])
             self._db.validate_last_tc()
             time.sleep(0.2) # for piezo to stabilize
-            self._ld.get_piezo_position()
-            self._db.validate_last_tc()
-            tc = self._db.tcs[-1]
+            tc = self._ld.get_piezo_position().result(nreplies = 1)
             x, y = tc.reply[0]["data"]["tc_reply_data"]["x_pos"], tc.reply[0]["data"]["tc_reply_data"]["y_pos"]
             xpos[k], ypos[k] = x, y
         return (xcom, ycom, xpos, ypos)
@@ -289,12 +263,11 @@ class LanternScripts(object):
         """
         Return the difference between the LST from the electronics and the LST calculated from astroplan
         """
-        self._ld.get_lst_seconds()        
+        tc = self._ld.get_lst_seconds()        
         tnow = Time.now()
         lst_now = tnow.sidereal_time("apparent", EarthLocation.of_site(location))
         lst_seconds = lst_now.hourangle * 3600
-        self._db.validate_last_tc()
-        seconds = self._db.tcs[-1].reply[0]["data"]["tc_reply_data"]["seconds"]
+        seconds = tc.result(nreplies = 1).reply[0]["data"]["tc_reply_data"]["seconds"]
         return seconds - lst_seconds
     
     def set_target(self, targetname):
@@ -315,9 +288,7 @@ class LanternScripts(object):
         mu = np.zeros([npoints, npoints])
         self._ld.move_piezo(0, 0)
         time.sleep(1)
-        self._ld.get_piezo_position()
-        self._db.validate_last_tc()
-        tc = self._db.tcs[-1]        
+        tc = self._ld.get_piezo_position().result(nreplies = 1)
         x, _ = tc.reply[0]["data"]["tc_reply_data"]["x_pos"]                 
         X = np.zeros([npoints+1, npoints+1]) + x
         for k in range(npoints):
@@ -328,9 +299,7 @@ class LanternScripts(object):
                 self._ld.move_piezo(betas[j], 0)
                 self._db.validate_last_tc()
                 time.sleep(0.1)
-                self._ld.get_piezo_position()
-                self._db.validate_last_tc()
-                tc = self._db.tcs[-1]
+                tc = self._ld.get_piezo_position().result(nreplies = 1)
                 x, _ = tc.reply[0]["data"]["tc_reply_data"]["x_pos"]             
                 X[k+1, j+1] = x
         X = -(X - X[0, 0])
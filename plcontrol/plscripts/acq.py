@@ -5,6 +5,7 @@ import time
 from astropy.io import fits
 import numpy as np
 from plscripts.geometry import Geometry
+from lantern.baseDriver import wait_all
 from astropy.coordinates import SkyCoord
 from astropy import units
 
@@ -268,20 +269,21 @@ class Acquisition(Base):
 
         # stop the electronics trigger
         print("Stop tip/tilt")
-        self._ld.stop_output_trigger()
-        self._db.validate_last_tc()
-        # select the proper modulation if different from current modulation
-        self._ld.get_modulation_sequence_id()
-        self._db.validate_last_tc()
-        sequence_id = self._db.tcs[-1].reply[0]["data"]["tc_reply_data"]["sequence"]
-        if sequence_id != mod_sequence:
-            print("Switching to modulation id={}".format(mod_sequence))
-            self._ld.switch_modulation_loop(False)
-            self._db.validate_last_tc()
-            self._ld.load_sequence_from_flash(mod_sequence)
-            self._db.validate_last_tc()
-        self._ld.set_modulation_scale(mod_scale)
-        self._db.validate_last_tc()
+        with self._ld.transaction():
+            self._ld.stop_output_trigger()
+            # select the proper modulation if different from current modulation
+            tc = self._ld.get_modulation_sequence_id()
+        sequence_id = tc.result(nreplies = 1).reply[0]["data"]["tc_reply_data"]["sequence"]
+        with self._ld.transaction() as tr:
+            if sequence_id != mod_sequence:
+                print("Switching to modulation id={}".format(mod_sequence))
+                self._ld.switch_modulation_loop(False)
+                # only load the sequence once the modulation is stopped
+                tr.barrier()
+                self._ld.load_sequence_from_flash(mod_sequence)
+                # only scale the sequence once it is loaded
+                tr.barrier()
+            self._ld.set_modulation_scale(mod_scale)
 
 
         # retrieve_modulation_sequence returns the normalized pattern, so we only
@@ -316,16 +318,17 @@ class Acquisition(Base):
         if extra_delay < 15 : 
             extra_delay = 15
             
-        self._ld.switch_glitch_beacon(add_time_glitch)
-        self._ld.set_glitch_beacon_params(frame=len(xmod)//2, extra_delay = extra_delay)
-        self._ld.get_glitch_beacon_params()
-        self._db.validate_last_tc()
+        # send the glitch commands back to back and check all of them at once
+        with self._ld.transaction() as tr:
+            self._ld.switch_glitch_beacon(add_time_glitch)
+            self._ld.set_glitch_beacon_params(frame=len(xmod)//2, extra_delay = extra_delay)
+            self._ld.get_glitch_beacon_params()
+            self._ld.get_glitch_beacon_state()
+        wait_all(tr.tcs[2:], nreplies = 1)
         # check state of electronics about temporal glitch
-        glitch_frame = self._db.tcs[-1].reply[0]["data"]["tc_reply_data"]["frame"]
-        glitch_extra_delay = self._db.tcs[-1].reply[0]["data"]["tc_reply_data"]["extra_delay"]
-        self._ld.get_glitch_beacon_state()
-        self._db.validate_last_tc()
-        state_glitch = self._db.tcs[-1].reply[0]["data"]["tc_reply_data"]["state"]
+        glitch_frame = tr.tcs[2].reply[0]["data"]["tc_reply_data"]["frame"]
+        glitch_extra_delay = tr.tcs[2].reply[0]["data"]["tc_reply_data"]["extra_delay"]
+        state_glitch = tr.tcs[3].reply[0]["data"]["tc_reply_data"]["state"]
 
         # now we can set up the camera 
         print("Setting up camera")
@@ -63,23 +63,23 @@ class Startup(Base):
         print("Software reboot")
         self._ld.software_reboot()
         time.sleep(1)
-        self._ld.get_version()
-        self._db.validate_last_tc()
-        version_reply = self._db.tcs[-1].reply[0]["data"]["tc_reply_data"]
+        tc = self._ld.get_version().result(nreplies = 1)
+        version_reply = tc.reply[0]["data"]["tc_reply_data"]
         print("Setting the clock.")
         self._scripts.set_lstnow(location = "subaru")
         self._scripts.set_utcnow()
-        print("Moving piezo to (0, 0)")
-        self._ld.move_piezo(0, 0)
-        self._db.validate_last_tc()
-        print("Closing the loop")
-        self._ld.switch_control_loop(True)
-        self._db.validate_last_tc()        
-        self._ld.switch_closed_loop(True)
-        self._db.validate_last_tc()
-        print("Setting offset tracking to 'true'")
-        self._ld.switch_tracking_offset(True)
-        self._db.validate_last_tc()
+        # each step needs the previous one to have succeeded
+        with self._ld.transaction() as tr:
+            print("Moving piezo to (0, 0)")
+            self._ld.move_piezo(0, 0)
+            tr.barrier()
+            print("Closing the loop")
+            self._ld.switch_control_loop(True)
+            tr.barrier()
+            self._ld.switch_closed_loop(True)
+            tr.barrier()
+            print("Setting offset tracking to 'true'")
+            self._ld.switch_tracking_offset(True)
         keywords = {"X_FIRVER": "{};{}".format(version_reply["version"], version_reply["config"].decode()),
                     "X_FIRTRG": "UNDEFINED"}
         self.update_keywords(keywords=keywords)
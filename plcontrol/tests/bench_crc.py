@@ -0,0 +1,47 @@
+#coding: utf8
+"""
+Time of the CRC32 of the PackerUnpacker (zlib) against the previous table-driven loop, for the
+float payloads of a modulation sequence upload and for the check of a received control_data TM
+(check_crc_raw on the raw bytes against check_crc on the unpacked packet).
+
+usage:
+    python tests/bench_crc.py
+"""
+import struct
+import timeit
+import numpy as np
+from byt import Byt
+from packet_generator import CONFIG, PacketGenerator
+from lantern.packerUnpacker import PackerUnpacker
+from crc_reference import TableCrc
+from bench_packerUnpacker import control_data_packet
+
+NMOD = 625
+
+def best_time(function, number):
+    return min(timeit.repeat(function, number = number, repeat = 5))/number
+
+if __name__ == "__main__":
+    punp = PackerUnpacker(config = CONFIG)
+    reference = TableCrc(punp)
+    rng = np.random.default_rng(0)
+
+    # upload of a 625 points sequence: the payload bytes and their crc
+    xmod = rng.uniform(-100, 100, NMOD)
+    def old_upload():
+        xmod_bytes = Byt()
+        for k in range(NMOD):
+            xmod_bytes += Byt(struct.pack("f", xmod[k]))
+        return reference._compute_crc32(xmod_bytes)
+    def new_upload():
+        return punp._compute_crc32(np.asarray(xmod, dtype="=f4").tobytes())
+    assert old_upload() == new_upload()
+    t_old, t_new = best_time(old_upload, 20), best_time(new_upload, 2000)
+    print("{} points float upload ({} bytes): {:8.1f} us -> {:6.1f} us ({:.0f}x)".format(NMOD, 4*NMOD, 1e6*t_old, 1e6*t_new, t_old/t_new))
+
+    # check of a received control_data TM (10 records), with a valid crc
+    packet = PacketGenerator(punp).with_crc(control_data_packet(punp, 10), 8)
+    unpacked = punp.unpack(Byt(packet))
+    assert reference.check_crc(unpacked) and punp.check_crc_raw(packet)
+    t_old, t_new = best_time(lambda: reference.check_crc(unpacked), 200), best_time(lambda: punp.check_crc_raw(packet), 20000)
+    print("CRC check of a {} bytes TM: {:8.1f} us -> {:6.1f} us ({:.0f}x)".format(len(packet), 1e6*t_old, 1e6*t_new, t_old/t_new))
@@ -0,0 +1,51 @@
+#coding: utf8
+"""
+Throughput of the serial framing of the Listener, FrameDecoder against the previous hex-string
+framing, on a stream of 372 bytes frames (control_data packets of 10 records) read in chunks
+of 10 ms at full baud, and as a backlog read in one go.
+
+usage:
+    python tests/bench_framing.py
+"""
+import os
+import time
+from byt import Byt
+from packet_generator import CONFIG
+from lantern.lanternListener import FrameDecoder
+from framing_reference import HexFraming
+
+NFRAMES = 2000
+FRAME_SIZE = 372
+
+def run_old(stream, chunk_size, end_sequence, esc_character):
+    old = HexFraming(end_sequence, esc_character)
+    rx_buffer = Byt()
+    nframes = 0
+    t0 = time.perf_counter()
+    for i in range(0, len(stream), chunk_size):
+        rx_buffer += Byt(stream[i:i+chunk_size])
+        packets, rx_buffer = old._get_packets(rx_buffer)
+        nframes += len(packets)
+    return nframes, time.perf_counter() - t0
+
+def run_new(stream, chunk_size, end_sequence, esc_character):
+    decoder = FrameDecoder(end_sequence, esc_character)
+    nframes = 0
+    t0 = time.perf_counter()
+    for i in range(0, len(stream), chunk_size):
+        nframes += len(decoder.feed(stream[i:i+chunk_size]))
+    return nframes, time.perf_counter() - t0
+
+if __name__ == "__main__":
+    end_sequence = bytes.fromhex(CONFIG["serial_connection"]["end_sequence"])
+    esc_character = bytes.fromhex(CONFIG["serial_connection"]["escape_character"])
+    baud = CONFIG["serial_connection"]["baud"]
+    decoder = FrameDecoder(end_sequence, esc_character)
+    stream = b"".join(decoder.escape(os.urandom(FRAME_SIZE)) + end_sequence + end_sequence for i in range(NFRAMES))
+    # 10 bits per byte on the serial line
+    line_rate = baud/10
+    print("stream of {} frames, {:.2f} MB, serial line at {} baud: {:.3f} MB/s".format(NFRAMES, len(stream)/1e6, baud, line_rate/1e6))
+    for chunk_size, label in [(int(line_rate/100), "10 ms reads at full baud"), (len(stream), "whole backlog in one read")]:
+        nold, told = run_old(stream, chunk_size, end_sequence, esc_character)
+        nnew, tnew = run_new(stream, chunk_size, end_sequence, esc_character)
+        print("{}: hex framing {:.2f} MB/s, FrameDecoder {:.1f} MB/s ({}/{} frames)".format(label, len(stream)/told/1e6, len(stream)/tnew/1e6, nold, nnew))
@@ -0,0 +1,60 @@
+#coding: utf8
+"""
+Frame time of the live plots of lanternPlotter with the Agg backend (headless), with and without
+blitting and decimation, for an increasing number of points shown.
+
+usage:
+    python tests/bench_lanternPlotter.py
+"""
+import time
+import warnings
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import packet_generator # puts the plcontrol folder in the path
+import lantern.lanternPlotter as lanternPlotter
+
+NUPDATES = 20
+NEW_POINTS = 200 # points received between two timer ticks
+
+# tight_layout warns about the inset axes of FigureXY
+warnings.simplefilter("ignore", UserWarning)
+rng = np.random.default_rng(0)
+
+def burst(c0, n):
+    """ n control_data records, starting at counter c0 """
+    c = np.arange(c0, c0+n)
+    xset = lanternPlotter.MIDPOINT[0] + 50*np.sin(c/300)
+    return {"counter": c, "microseconds": c*100., "xpos": xset + rng.normal(0, 5, n), "ypos": lanternPlotter.MIDPOINT[1] + rng.normal(0, 5, n),
+            "xcom": c*0., "ycom": c*0., "xset": xset, "yset": lanternPlotter.MIDPOINT[1] + c*0.}
+
+def frame_times(nmax, fast):
+    controlData = lanternPlotter.ControlData(capacity = max(nmax, 1000))
+    controlData.add_packet(burst(0, nmax))
+    c0 = nmax
+    if fast:
+        figures = [lanternPlotter.FigureResponse(nmax = nmax), lanternPlotter.FigureXY(nmax = nmax)]
+    else:
+        figures = [lanternPlotter.FigureResponse(nmax = nmax, blit = False, decimate = False),
+                   lanternPlotter.FigureXY(nmax = nmax, blit = False, max_points = nmax)]
+    for figure in figures:
+        figure.run(controlData) # first full draw
+    times = [[] for figure in figures]
+    for k in range(NUPDATES):
+        controlData.add_packet(burst(c0, NEW_POINTS))
+        c0 += NEW_POINTS
+        for figure, t in zip(figures, times):
+            t0 = time.perf_counter()
+            figure.run(controlData)
+            t.append(time.perf_counter() - t0)
+    plt.close("all")
+    return [1e3*np.median(t) for t in times]
+
+if __name__ == "__main__":
+    print("median frame time over {} updates of {} points (Agg backend)".format(NUPDATES, NEW_POINTS))
+    for nmax in [1000, 10000, 100000]:
+        response_full, xy_full = frame_times(nmax, False)
+        response_fast, xy_fast = frame_times(nmax, True)
+        print("nmax {:6d}: FigureResponse {:7.1f} ms -> {:5.1f} ms, FigureXY {:7.1f} ms -> {:5.1f} ms (full redraw -> blit + decimation)".format(
+              nmax, response_full, response_fast, xy_full, xy_fast))
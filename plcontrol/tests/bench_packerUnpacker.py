@@ -0,0 +1,45 @@
+#coding: utf8
+"""
+Throughput of the PackerUnpacker, in packets/s, for the main TM types and a TC.
+
+usage:
+    python tests/bench_packerUnpacker.py
+"""
+import copy
+import struct
+import timeit
+from byt import Byt
+from packet_generator import CONFIG, PacketGenerator
+from lantern.packerUnpacker import PackerUnpacker
+
+NLOOPS = 5000
+
+def control_data_packet(punp, nrecords):
+    """ a control_data TM with nrecords records """
+    records = b"".join(struct.pack("IfffHHffff", i, 1., 2., 3., 4, 5, 6., 7., 8., 9.) for i in range(nrecords))
+    packet = struct.pack("<BIBHI", 1, 0, punp.tm_packet_types["control_data"], len(records), 0) + records
+    return packet
+
+def rate(function):
+    return NLOOPS/timeit.timeit(function, number = NLOOPS)
+
+if __name__ == "__main__":
+    punp = PackerUnpacker(config = CONFIG)
+    generator = PacketGenerator(punp)
+    command_id = [k for k, v in punp.tc_command_names.items() if v == "move_piezo"][0]
+    packets = [("control_data (10 records)", control_data_packet(punp, 10)),
+               ("control_data (100 records)", control_data_packet(punp, 100)),
+               ("hk", generator.tm(punp.tm_packet_types["hk"])),
+               ("eack", generator.tm(punp.eack_packet_type)),
+               ("tc move_piezo", generator.tc(command_id))]
+    for name, packet in packets:
+        packet = Byt(packet)
+        unpacked = punp.unpack(packet)
+        unpack_rate = rate(lambda: punp.unpack(packet))
+        # pack works on a copy, as the driver does
+        copy_time = 1/rate(lambda: copy.deepcopy(unpacked))
+        pack_rate = 1/(1/rate(lambda: punp.pack(copy.deepcopy(unpacked))) - copy_time)
+        crc_rate = rate(lambda: punp.check_crc_raw(packet))
+        print("{:28s} unpack {:9.0f} packets/s   pack {:9.0f} packets/s   check_crc_raw {:9.0f} packets/s".format(name, unpack_rate, pack_rate, crc_rate))
+    encoder = punp.tc_encoders[command_id]
+    print("{:28s} encode {:9.0f} packets/s".format("tc move_piezo (TCEncoder)", rate(lambda: encoder.encode(1, 0, (1.0, 2.0)))))
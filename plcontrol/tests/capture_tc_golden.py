@@ -0,0 +1,75 @@
+#coding: utf8
+"""
+Captures the golden TC bytes of tc_golden.json with the hand-written LanternDriver of the baseline
+(before the encoders were compiled and the driver generated), for test_lanternDriver.
+
+usage:
+    git archive <baseline> plcontrol | tar -x -C /tmp/baseline
+    python tests/capture_tc_golden.py /tmp/baseline/plcontrol
+"""
+import os
+import sys
+import copy
+import json
+import random
+
+NCAPTURES = 5
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tc_golden.json")
+
+def to_json(value):
+    if isinstance(value, bytes):
+        return {"bytes": value.hex()}
+    if isinstance(value, list):
+        return [to_json(v) for v in value]
+    return value
+
+def from_json(value):
+    if isinstance(value, dict):
+        return bytes.fromhex(value["bytes"])
+    if isinstance(value, list):
+        return [from_json(v) for v in value]
+    return value
+
+class Sender(object):
+    """ records the packets instead of sending them on the zmq socket """
+    def __init__(self):
+        self.sent = []
+
+    def send(self, packet, flags = 0):
+        self.sent.append(bytes(packet))
+
+if __name__ == "__main__":
+    baseline_dir = os.path.abspath(sys.argv[1])
+    # the parameters are drawn with the generator of the tests, the driver is the baseline one
+    from packet_generator import CONFIG # puts the plcontrol folder in the path
+    from test_lanternDriver import load_tc_packet_data, random_parameters
+    sys.path.remove(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.modules.pop("lantern", None)
+    for name in list(sys.modules):
+        if name.startswith("lantern."):
+            sys.modules.pop(name)
+    sys.path.insert(0, baseline_dir)
+    from lantern.lanternDriver import LanternDriver
+    assert os.path.dirname(sys.modules["lantern"].__file__).startswith(baseline_dir)
+
+    ld = LanternDriver(config = CONFIG)
+    driver = ld._driver
+    driver.connected = True
+    driver.db = None
+    driver.sender = Sender()
+    tc_packet_data = load_tc_packet_data(CONFIG)
+    rnd = random.Random(0)
+    golden = []
+    for name in tc_packet_data:
+        for k in range(NCAPTURES):
+            params = random_parameters(rnd, tc_packet_data[name]["format"])
+            packet_id = rnd.randrange(1 << 32)
+            driver.packetid = packet_id
+            getattr(ld, name)(**copy.deepcopy(params))
+            golden.append({"command": name, "packet_id": packet_id,
+                           "params": {key: to_json(value) for key, value in params.items()},
+                           "packet": driver.sender.sent.pop().hex()})
+    with open(GOLDEN_FILE, "w") as f:
+        # one packet per line
+        f.write("[\n" + ",\n".join([json.dumps(entry) for entry in golden]) + "\n]\n")
+    print("{} packets of {} commands written to {}".format(len(golden), len(tc_packet_data), GOLDEN_FILE))
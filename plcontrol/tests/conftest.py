@@ -0,0 +1,15 @@
+#coding: utf8
+import os
+import sys
+import pytest
+
+# the lantern package is imported from the plcontrol folder, as in the control scripts
+PLCONTROL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not(PLCONTROL_DIR in sys.path):
+    sys.path.insert(0, PLCONTROL_DIR)
+
+from packet_generator import CONFIG
+
+@pytest.fixture
+def config():
+    return CONFIG
@@ -0,0 +1,33 @@
+#coding: utf8
+"""
+The table-driven CRC32 of the PackerUnpacker before it used zlib, and the CRC check on the
+unpacked packet, kept as a reference for the tests and the benchmark of the CRC.
+"""
+import copy
+from byt import Byt
+
+class TableCrc(object):
+    def __init__(self, punp):
+        self.punp = punp
+        # lookup table for cimputing payload crc
+        payload_crc_table = {}
+        poly = 0x04C11DB7
+        for byte in range(256):
+            c = byte << 24
+            for i in range(8):
+                c = (c << 1) ^ poly if (c & 0x80000000) else c << 1
+            payload_crc_table[byte] = c & 0xffffffff
+        self.payload_crc_table = payload_crc_table
+        return None
+
+    def _compute_crc32(self, message):
+        crc = 0xffffffff
+        for i in Byt(message).iterInts():
+            crc = ((crc << 8) & 0xffffffff) ^ self.payload_crc_table[(crc >> 24) ^ i]
+        return crc
+
+    def check_crc(self, packet):
+        packet_copy = copy.deepcopy(packet)
+        packet_copy["header"]["crc"] = 0
+        crc_calc = self._compute_crc32(self.punp.pack(packet_copy))
+        return crc_calc==packet["header"]["crc"]
@@ -0,0 +1,33 @@
+#coding: utf8
+"""
+The hex-string framing of the serial Listener before FrameDecoder, kept as a reference for the
+fuzz test and the benchmark of the framing.
+"""
+from byt import Byt
+
+class HexFraming(object):
+    def __init__(self, end_sequence, esc_character):
+        self.end_sequence = Byt(end_sequence)
+        self.esc_character = Byt(esc_character)
+        return None
+
+    # escape and de-escape function
+    def _escape(self, packet):
+        packet = Byt.fromHex(packet.hex()) # make sure it has the correct Byt type and spacing in hex notation
+        return Byt.fromHex(packet.hex().replace(self.end_sequence.hex(), self.end_sequence.hex()+" "+self.esc_character.hex()))
+
+    def _unescape(self, packet):
+        return Byt.fromHex(packet.hex().replace(self.end_sequence.hex()+" "+self.esc_character.hex(), self.end_sequence.hex()))
+
+    def _get_packets(self, data_byt):
+        """
+        look for the end sequence in the data_byt (of Byt.byt type) and
+        return a list of packets (escaped and with no end sequence)
+        """
+        packets = []
+        ind = data_byt.find(self.end_sequence+self.end_sequence)
+        while (ind > 0):
+            packets.append(self._unescape(data_byt[:ind]))
+            data_byt= data_byt[ind+2*len(self.end_sequence):]
+            ind = data_byt.find(self.end_sequence+self.end_sequence)
+        return packets, data_byt
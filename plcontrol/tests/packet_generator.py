@@ -0,0 +1,141 @@
+#coding: utf8
+"""
+Random TM/TC packets following the YML descriptors, for the tests and benchmarks of the lantern
+package. The packets are built with struct directly from the descriptors, independently of the
+PackerUnpacker.
+"""
+import os
+import sys
+import struct
+import random
+import numpy as np
+
+PLCONTROL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not(PLCONTROL_DIR in sys.path):
+    sys.path.insert(0, PLCONTROL_DIR)
+
+DESCRIPTORS_DIR = os.path.join(PLCONTROL_DIR, "lantern", "descriptors")
+
+CONFIG = {"descriptors": {"folder": DESCRIPTORS_DIR,
+                          "tmtc": "tmtc.yml",
+                          "tc_packet_data": "tc_packet_data.yml",
+                          "tm_packet_data": "tm_packet_data.yml",
+                          "tc_reply_data": "tc_reply_data.yml",
+                          "errors": "errors.yml"},
+          "serial_connection": {"end_sequence": "7e", "escape_character": "7d", "port": None, "baud": 921600},
+          "zmq_connection": {"tc_port": "tcp://127.0.0.1:5555", "tm_port": "tcp://127.0.0.1:5556"},
+          "general": {"system_id": 1}}
+
+NONE_VALUES = ["none", "null", "None", "Null"]
+
+TM_HEADER = "<BIBHI"
+TC_HEADER = "<BIHI"
+
+class PacketGenerator(object):
+    """ random packets of all the types described in the descriptors of a PackerUnpacker """
+    def __init__(self, punp, seed = 0):
+        self.punp = punp
+        self.rnd = random.Random(seed)
+        self.error_codes = list(punp.error_desc["code_to_msg"].keys())
+        return None
+
+    def value(self, char):
+        """ random value of a struct format character """
+        if char in "fd":
+            # representable in float32, so that the values survive the round trip
+            return float(np.float32(self.rnd.uniform(-1e4, 1e4)))
+        if char == "?":
+            return self.rnd.random() < 0.5
+        if char == "s":
+            return bytes([self.rnd.randrange(32, 127)])
+        size = struct.calcsize(char)
+        if char.islower():
+            return self.rnd.randint(-(1 << (8*size-1)), (1 << (8*size-1))-1)
+        return self.rnd.randrange(1 << (8*size))
+
+    def field(self, desc, name):
+        """ random bytes of a field (leaf of the descriptor) """
+        format = desc["format"]
+        length = desc["length"]
+        if format in NONE_VALUES:
+            return bytes(self.rnd.randrange(256) for i in range(self.rnd.randrange(6) if length in NONE_VALUES else length))
+        if name == "error":
+            return struct.pack(format, self.rnd.choice(self.error_codes))
+        if format == "s":
+            n = self.rnd.randrange(1, 20) if length in NONE_VALUES else length
+            return b"".join(self.value("s") for i in range(n))
+        size = struct.calcsize(format)
+        n = self.rnd.randrange(0, 5) if length in NONE_VALUES else length//size
+        return b"".join(struct.pack(format, *[self.value(c) for c in format]) for i in range(n))
+
+    def node(self, desc, name = ""):
+        """ random bytes of a descriptor node """
+        if "format" in desc:
+            return self.field(desc, name)
+        parts = [(desc[key]["start"], self.node(desc[key], key)) for key in desc if not(key in ["start", "length"])]
+        size = max([start + len(data) for start, data in parts] + [0])
+        if not(desc["length"] in NONE_VALUES):
+            size = max(size, desc["length"])
+        data = bytearray(size)
+        for start, part in parts:
+            data[start:start+len(part)] = part
+        return bytes(data)
+
+    def overlapping(self, desc, offset = 0):
+        """
+        True if two fields of the descriptor overlap (a variable length field followed by other
+        fields), such packets cannot be packed back to the same bytes
+        """
+        leaves = []
+        def walk(node, offset):
+            for key in node:
+                if key in ["start", "length"]:
+                    continue
+                if "format" in node[key]:
+                    length = node[key]["length"]
+                    end = float("inf") if length in NONE_VALUES else offset + node[key]["start"] + length
+                    leaves.append((offset + node[key]["start"], end))
+                else:
+                    walk(node[key], offset + node[key]["start"])
+        walk(desc, offset)
+        leaves.sort()
+        return any([leaves[i][1] > leaves[i+1][0] for i in range(len(leaves)-1)])
+
+    def with_crc(self, packet, crc_offset):
+        crc = self.punp._compute_crc32(packet)
+        return packet[:crc_offset] + struct.pack("<I", crc) + packet[crc_offset+4:]
+
+    def tm(self, packet_type, command_id = None):
+        """ a random TM of the given type (and of the given command for the tc replies), with a valid CRC """
+        if packet_type == self.punp.tc_reply_packet_type:
+            data = struct.pack("<IB", self.rnd.randrange(1 << 32), command_id) + self.node(self.punp.tc_reply_data_desc[command_id])
+        else:
+            data = self.node(self.punp.tm_packet_data_desc[packet_type])
+        packet = struct.pack(TM_HEADER, 1, self.rnd.randrange(1 << 32), packet_type, len(data), 0) + data
+        return self.with_crc(packet, 8)
+
+    def tc(self, command_id):
+        """ a random TC of the given command, with a valid CRC """
+        data = self.node(self.punp.tc_packet_data_desc[command_id])
+        data = bytes([command_id]) + data[1:]
+        packet = struct.pack(TC_HEADER, 0x81, self.rnd.randrange(1 << 32), len(data), 0) + data
+        return self.with_crc(packet, 7)
+
+    def all_packets(self):
+        """
+        one random packet of every TM type, tc reply and TC command, with a label and whether
+        its descriptor has overlapping fields
+        """
+        packets = []
+        for packet_type in self.punp.tm_packet_data_desc:
+            if packet_type == self.punp.tc_reply_packet_type:
+                for command_id in self.punp.tc_reply_data_desc:
+                    packets.append(("tc_reply {}".format(command_id), self.tm(packet_type, command_id),
+                                    self.overlapping(self.punp.tc_reply_data_desc[command_id])))
+            else:
+                packets.append(("tm {}".format(packet_type), self.tm(packet_type),
+                                self.overlapping(self.punp.tm_packet_data_desc[packet_type])))
+        for command_id in self.punp.tc_packet_data_desc:
+            packets.append(("tc {}".format(command_id), self.tc(command_id),
+                            self.overlapping(self.punp.tc_packet_data_desc[command_id])))
+        return packets
@@ -0,0 +1,50 @@
+#coding: utf8
+"""
+Timeouts of the tcs of the asyncio driver.
+"""
+import time
+import asyncio
+import pytest
+from lantern.asyncDriver import AsyncTC
+
+def make_tc():
+    return AsyncTC({"header": {"packet_id": 1}, "data": {"command_id": 5}})
+
+def eack(error = "OK"):
+    return {"data": {"packet_id": 1, "error": error}}
+
+def test_result_timeout_covers_eack_and_replies():
+    async def main():
+        tc = make_tc()
+        async def late_eack():
+            await asyncio.sleep(0.3)
+            await tc.attach_packet(eack(), is_ack = True)
+        asyncio.ensure_future(late_eack())
+        t0 = time.monotonic()
+        with pytest.raises(Exception, match = "Timeout"):
+            await tc.result(timeout = 0.5, nreplies = 1)
+        return time.monotonic() - t0
+    # the reply wait only gets the time left after the EACK
+    assert asyncio.run(main()) < 0.7
+
+@pytest.mark.parametrize("timeout", [1, None])
+def test_result_with_replies(timeout):
+    async def main():
+        tc = make_tc()
+        async def board():
+            await asyncio.sleep(0.05)
+            await tc.attach_packet(eack(), is_ack = True)
+            await asyncio.sleep(0.05)
+            await tc.attach_packet({"data": {"tc_reply_data": {}}}, is_reply = True)
+        asyncio.ensure_future(board())
+        return await tc.result(timeout = timeout, nreplies = 1)
+    tc = asyncio.run(main())
+    assert len(tc.reply) == 1
+
+def test_result_error():
+    async def main():
+        tc = make_tc()
+        await tc.attach_packet(eack("BAD_COMMAND"), is_ack = True)
+        await tc.result(timeout = 1)
+    with pytest.raises(Exception, match = "BAD_COMMAND"):
+        asyncio.run(main())
@@ -0,0 +1,57 @@
+#coding: utf8
+"""
+Tcs of the driver database, and their spill to file.
+"""
+import pickle
+import threading
+from lantern.baseDriver import TC, Db
+
+def make_tc(packet_id):
+    return TC({"header": {"packet_id": packet_id}, "data": {"command_id": 5, "params": {}}})
+
+def eack(packet_id, error = "OK"):
+    return {"header": {"packet_type": 254}, "data": {"packet_id": packet_id, "error": error}}
+
+def reply(packet_id):
+    return {"header": {"packet_type": 253}, "data": {"packet_id": packet_id, "command_id": 5, "tc_reply_data": {"x": [1, 2]}}}
+
+def test_tc_pickle():
+    tc = make_tc(1)
+    tc.attach_packet(eack(1), is_ack = True)
+    tc.attach_packet(reply(1), is_reply = True)
+    loaded = pickle.loads(pickle.dumps(tc))
+    assert loaded.done()
+    assert loaded.result(timeout = 0, nreplies = 1).reply == tc.reply
+    assert loaded.wait_reply_points("x", 2, timeout = 0)
+    # a tc spilled before its EACK is still pending
+    pending = pickle.loads(pickle.dumps(make_tc(2)))
+    assert not(pending.done())
+    pending.attach_packet(eack(2), is_ack = True)
+    assert pending.result(timeout = 0) is pending
+
+def test_tc_result_without_timeout():
+    tc = make_tc(3)
+    # the EACK and the reply arrive later, timeout = None waits for them
+    def receive():
+        tc.attach_packet(eack(3), is_ack = True)
+        tc.attach_packet(reply(3), is_reply = True)
+    threading.Timer(0.05, receive).start()
+    assert tc.result(timeout = None, nreplies = 1).reply == [reply(3)]
+
+def test_spill_file(tmp_path):
+    spill_file = str(tmp_path / "spill.pkl")
+    db = Db(max_tcs = 2, max_tms = {None: 3}, spill_file = spill_file)
+    for packet_id in range(5):
+        db.push_tc(make_tc(packet_id))
+        db.push_tm(eack(packet_id), is_ack = True)
+    db.push_tm(reply(4), is_reply = True)
+    db.close()
+    assert db.get_tc(0) is None
+    assert db.get_tc(4).result(timeout = 0, nreplies = 1).reply[0]["data"]["packet_id"] == 4
+    assert len(db.get_tms(254)) == 3
+    spilled = list(Db.read_spill_file(spill_file))
+    assert [record.packet_id for kind, t, record in spilled if kind == "TC"] == [0, 1, 2]
+    assert [record["data"]["packet_id"] for kind, t, record in spilled if kind == "TM"] == [0, 1]
+    for kind, t, record in spilled:
+        if kind == "TC":
+            assert record.result(timeout = 0) is record
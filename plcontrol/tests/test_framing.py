@@ -0,0 +1,62 @@
+#coding: utf8
+"""
+Fuzz test of the FrameDecoder of the serial Listener against the previous hex-string framing
+(framing_reference.HexFraming): random end sequences, escape characters and frames full of
+both, received in random chunks.
+"""
+import random
+from byt import Byt
+from lantern.lanternListener import FrameDecoder
+from framing_reference import HexFraming
+
+NSTREAMS = 300
+
+def random_stream(rnd, trial):
+    if trial % 5:
+        end_sequence = bytes([rnd.choice([0x7e, 0x00, 0xff, rnd.randrange(256)])])
+    else:
+        end_sequence = bytes([0x7e, 0x7d])
+    esc_character = bytes([rnd.randrange(256)])
+    while esc_character == end_sequence[:1]:
+        esc_character = bytes([rnd.randrange(256)])
+    # frames biased to contain the end sequence and the escape character
+    frames = []
+    for i in range(rnd.randrange(1, 30)):
+        frames.append(b"".join(rnd.choice([end_sequence, esc_character, bytes([rnd.randrange(256)])]) for j in range(rnd.randrange(1, 60))))
+    return end_sequence, esc_character, frames
+
+def test_escape():
+    rnd = random.Random(1)
+    for trial in range(NSTREAMS):
+        end_sequence, esc_character, frames = random_stream(rnd, trial)
+        old = HexFraming(end_sequence, esc_character)
+        decoder = FrameDecoder(end_sequence, esc_character)
+        for frame in frames:
+            assert decoder.escape(frame) == bytes(old._escape(Byt(frame)))
+            assert decoder.unescape(decoder.escape(frame)) == frame
+
+def test_fuzz_against_hex_framing():
+    rnd = random.Random(0)
+    for trial in range(NSTREAMS):
+        end_sequence, esc_character, frames = random_stream(rnd, trial)
+        old = HexFraming(end_sequence, esc_character)
+        decoder = FrameDecoder(end_sequence, esc_character)
+        stream = b"".join(decoder.escape(frame) + end_sequence + end_sequence for frame in frames)
+        rx_buffer = Byt()
+        old_frames = []
+        new_frames = []
+        i = 0
+        while i < len(stream):
+            chunk = stream[i:i+rnd.randrange(1, 40)]
+            i += len(chunk)
+            rx_buffer += Byt(chunk)
+            packets, rx_buffer = old._get_packets(rx_buffer)
+            old_frames += [bytes(p) for p in packets]
+            new_frames += decoder.feed(chunk)
+        assert new_frames == old_frames
+        assert new_frames == frames
+
+def test_empty_frames_dropped():
+    # the old framing stalled on a buffer starting with the terminator, the decoder skips it
+    decoder = FrameDecoder(b"\x7e", b"\x7d")
+    assert decoder.feed(b"\x7e\x7e\x01\x02\x7e\x7e") == [b"\x01\x02"]
@@ -0,0 +1,128 @@
+#coding: utf8
+"""
+Tests of the LanternDriver generated by make_lanternDriver.py: every command of tc_packet_data.yml
+has a method with its parameters, and the bytes sent by each method are the ones of the former
+hand-written driver. They are compared to the golden packets of tc_golden.json, captured with the
+baseline driver and PackerUnpacker (see capture_tc_golden.py), and to generate_tc_from_data and
+PackerUnpacker.pack of the current tree on more random parameters.
+"""
+import os
+import sys
+import copy
+import random
+import struct
+import json
+import inspect
+import ruamel.yaml as yaml
+from lantern.lanternDriver import LanternDriver
+from lantern.packerUnpacker import command_parameters
+
+NTRIALS = 50
+LANTERN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lantern")
+
+def load_tc_packet_data(config):
+    return yaml.YAML(typ = "safe").load(open(os.path.join(config["descriptors"]["folder"], config["descriptors"]["tc_packet_data"])))
+
+def parameter_formats(desc):
+    """ format, length and number of values (for the fields sharing a list) of each parameter """
+    formats = {}
+    def walk(node):
+        for key, value in node.items():
+            if key in ["start", "length"]:
+                continue
+            if "format" in value:
+                names = [k.strip() for k in str(key).split(",")]
+                if len(names) > 1:
+                    for i, name in enumerate(names):
+                        formats[name] = (value["format"][i], "columns")
+                else:
+                    formats[key] = (str(value["format"]).strip(), value["length"])
+            else:
+                walk(value)
+    if isinstance(desc.get("params"), dict):
+        walk(desc["params"])
+    return formats
+
+def random_value(rnd, char):
+    if char in "fd":
+        return rnd.uniform(-1e4, 1e4)
+    if char == "?":
+        return rnd.random() < 0.5
+    size = struct.calcsize("=" + char)
+    if char.islower():
+        return rnd.randint(-(1 << (8*size-1)), (1 << (8*size-1))-1)
+    return rnd.randrange(1 << (8*size))
+
+def random_parameters(rnd, desc):
+    formats = parameter_formats(desc)
+    ncolumns = rnd.randint(1, 5)
+    values = {}
+    for name in command_parameters(desc):
+        format, length = formats[name]
+        if length == "columns":
+            values[name] = [random_value(rnd, format) for i in range(ncolumns)]
+        elif "s" in format:
+            values[name] = bytes(rnd.randrange(32, 127) for i in range(length if isinstance(length, int) else 4))
+        elif not(isinstance(length, int)):
+            values[name] = [random_value(rnd, format[0]) for i in range(rnd.randint(1, 6))]
+        else:
+            values[name] = random_value(rnd, format[0])
+    return values
+
+def capturing_driver(config):
+    """ a LanternDriver which records the packets instead of sending them """
+    ld = LanternDriver(config = config)
+    sent = []
+    def send_packet(tcPacket, command_dict):
+        sent.append((bytes(tcPacket), command_dict))
+        return command_dict
+    ld._driver.send_packet = send_packet
+    return ld, sent
+
+def test_every_command_has_a_method(config):
+    tc_packet_data = load_tc_packet_data(config)
+    for name in tc_packet_data:
+        assert hasattr(LanternDriver, name), name
+        parameters = list(inspect.signature(getattr(LanternDriver, name)).parameters)[1:]
+        assert parameters == command_parameters(tc_packet_data[name]["format"]), name
+
+def test_encoded_bytes_match_hand_written_driver(config):
+    tc_packet_data = load_tc_packet_data(config)
+    rnd = random.Random(0)
+    ld, sent = capturing_driver(config)
+    driver = ld._driver
+    for name in tc_packet_data:
+        command_id = tc_packet_data[name]["command_id"]
+        for trial in range(NTRIALS):
+            params = random_parameters(rnd, tc_packet_data[name]["format"])
+            driver.packetid = rnd.randrange(1 << 32)
+            packetid = driver.packetid
+            getattr(ld, name)(**copy.deepcopy(params))
+            new_packet, new_dict = sent.pop()
+            driver.packetid = packetid
+            old_dict = driver.generate_tc_from_data({"command_id": command_id, "params": copy.deepcopy(params)})
+            assert new_packet == bytes(driver.punp.pack(old_dict)), name
+            assert new_dict["header"] == old_dict["header"], name
+            assert driver.packetid == packetid + 1
+
+def test_encoded_bytes_match_golden(config):
+    from capture_tc_golden import GOLDEN_FILE, from_json
+    golden = json.load(open(GOLDEN_FILE))
+    tc_packet_data = load_tc_packet_data(config)
+    assert set([entry["command"] for entry in golden]) == set(tc_packet_data)
+    ld, sent = capturing_driver(config)
+    for entry in golden:
+        ld._driver.packetid = entry["packet_id"]
+        getattr(ld, entry["command"])(**{key: from_json(value) for key, value in entry["params"].items()})
+        assert sent.pop()[0].hex() == entry["packet"], entry["command"]
+
+def test_generated_source_up_to_date(config):
+    sys.path.insert(0, LANTERN_DIR)
+    try:
+        import make_lanternDriver
+    finally:
+        sys.path.remove(LANTERN_DIR)
+    driver_filename = os.path.join(LANTERN_DIR, "lanternDriver.py")
+    tc_packet_data = yaml.YAML().load(open(os.path.join(config["descriptors"]["folder"], config["descriptors"]["tc_packet_data"])).read())
+    code = make_lanternDriver.generate(tc_packet_data, make_lanternDriver.read_docstrings(driver_filename))
+    assert code == open(driver_filename).read()
@@ -0,0 +1,66 @@
+#coding: utf8
+"""
+Round-trip conformance of the compiled PackerUnpacker over every descriptor: random packets of
+every TM type, tc reply and TC command are unpacked and packed back to the same bytes.
+
+Two commands (upload_config and set_modulation_offset) have a variable length field followed by
+other fields in their descriptor. They are only unpacked, their packing is not reversible.
+"""
+import copy
+from byt import Byt
+from lantern.packerUnpacker import PackerUnpacker
+from packet_generator import PacketGenerator
+from crc_reference import TableCrc
+
+NTRIALS = 30
+
+def test_round_trip_all_descriptors(config):
+    punp = PackerUnpacker(config = config)
+    generator = PacketGenerator(punp)
+    nchecked = 0
+    for trial in range(NTRIALS):
+        for label, packet, overlapping in generator.all_packets():
+            unpacked = punp.unpack(Byt(packet))
+            nchecked += 1
+            if overlapping:
+                continue
+            assert bytes(punp.pack(copy.deepcopy(unpacked))) == packet, label
+            # unpacking the packed packet gives the same values
+            assert repr(punp.unpack(punp.pack(copy.deepcopy(unpacked)))) == repr(unpacked), label
+    assert nchecked == NTRIALS*len(generator.all_packets())
+
+def test_every_descriptor_compiled(config):
+    punp = PackerUnpacker(config = config)
+    assert set(punp.tm_packet_data_codec) == set(punp.tm_packet_data_desc)
+    assert set(punp.tc_packet_data_codec) == set(punp.tc_packet_data_desc)
+    assert set(punp.tc_reply_data_codec) == set(punp.tc_reply_data_desc)
+    assert set(punp.tc_encoders) == set(punp.tc_packet_data_desc)
+
+def test_crc(config):
+    punp = PackerUnpacker(config = config)
+    generator = PacketGenerator(punp)
+    for label, packet, overlapping in generator.all_packets():
+        assert punp.check_crc_raw(packet), label
+        if not(overlapping):
+            assert punp.check_crc(punp.unpack(Byt(packet))), label
+        corrupted = packet[:-1] + bytes([packet[-1] ^ 1])
+        assert not(punp.check_crc_raw(corrupted)), label
+
+def test_tc_data(config):
+    punp = PackerUnpacker(config = config)
+    generator = PacketGenerator(punp)
+    for command_id in punp.tc_packet_data_desc:
+        if generator.overlapping(punp.tc_packet_data_desc[command_id]):
+            continue
+        packet = generator.tc(command_id)
+        unpacked = punp.unpack(Byt(packet))
+        assert bytes(punp.pack_tc_data(unpacked["data"])) == packet[punp.tc_data_start:]
+
+def test_crc_matches_table(config):
+    punp = PackerUnpacker(config = config)
+    reference = TableCrc(punp)
+    generator = PacketGenerator(punp)
+    messages = [bytes(generator.rnd.randrange(256) for i in range(n)) for n in list(range(70)) + [2500, 5000]]
+    messages += [packet for label, packet, overlapping in generator.all_packets()]
+    for message in messages:
+        assert punp._compute_crc32(message) == reference._compute_crc32(message)
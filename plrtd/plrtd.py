@@ -6,6 +6,7 @@ import os
 import runPL_library_basic as basic
 from pyMilk.interfacing.isio_shmlib import SHM as shm
 import time
+import inspect
 import argparse
 import matplotlib.pyplot as plt
 plt.ion()
@@ -16,16 +17,41 @@ class FirstPlRtd(StoppableThread):
     """
     Real time display of the reconstructed images.
     """
-    def __init__(self, vmin = None, vmax = None, *args, **kwargs):
+    def __init__(self, vmin = None, vmax = None, policy = "latest", frame_timeout = 1.0, wait = None, *args, **kwargs):
+        """
+        policy can be:
+        "latest" to wait on the stream semaphore and only process the most recent frame (flush the backlog)
+        "all" to wait on the stream semaphore and process every frame posted while the previous one was processed
+        "poll" for the legacy loop, reading the stream every 10 ms
+        frame_timeout is the maximum time (in s) to block waiting for a frame before checking for a stop request
+        wait is how "latest" and "all" wait for a frame:
+        "semaphore" to block in get_data(check = True, timeout = frame_timeout). This needs a pyMilk
+        whose SHM.get_data honours timeout (semtimedwait), otherwise a stop request is never seen
+        while the camera is not streaming
+        "counter" to poll the stream counter every counter_period s, which works with any pyMilk
+        None (default) to use "semaphore" if get_data accepts a timeout, "counter" otherwise
+        """
         super(FirstPlRtd, self).__init__(*args, **kwargs)
+        if not(policy in ["latest", "all", "poll"]):
+            raise Exception("Unknown policy {}. Use 'latest', 'all' or 'poll'".format(policy))
+        self.policy = policy
+        self.frame_timeout = frame_timeout
+        self.counter_period = 0.001
         self.Npixel = 100
         self.vmin = vmin
         self.vmax = vmax 
         self.im_io  = shm('firstpl')
+        if wait is None:
+            wait = "semaphore" if self.get_data_has_timeout() else "counter"
+        if not(wait in ["semaphore", "counter"]):
+            raise Exception("Unknown wait {}. Use 'semaphore' or 'counter'".format(wait))
+        self.wait = wait
         self.width_im = int(self.im_io.get_keywords()['PRD-RNG2'])
         self.height_im = int(self.im_io.get_keywords()['PRD-RNG1'])
         self.image = None
         self.image_before = None
+        self.last_counter = None
+        self.frames_dropped = 0
         map_void          = np.zeros((100, 100), dtype=np.float32)
         self.shm_var         = shm('first_rtd', map_void, location=-1, shared=1)
 
@@ -61,17 +87,23 @@ class FirstPlRtd(StoppableThread):
         self.couplingMap=basic.CouplingMap(file_coupling_map)
         self.pixelMap=basic.PixelMap(file_pixel_map)
         self.detbias = self.pixelMap.header['DETBIAS']
+        # build (or read from disk) the pixel extraction plan once, before the first frame
+        self.pixelMap.get_extraction_plan(*self.im_io.get_data(False).shape)
 
         self.xpos = self.couplingMap.xpos
         self.ypos = self.couplingMap.ypos
 
         
         self.grid_x, self.grid_y = basic.make_image_grid(self.couplingMap, self.Npixel)
+        # the interpolation weights only depend on the positions and the grid, compute them once
+        self.interpolator = basic.InterpolationOperator(self.xpos, self.ypos, self.grid_x, self.grid_y)
 
 
-    def setting_milk(self):
+    def setting_milk(self, data = None):
         #data = self.plot_detector()
-        data = self.im_io.get_data(False).astype(np.float32)
+        if data is None:
+            data = self.im_io.get_data(False)
+        data = data.astype(np.float32)
         de,_=basic.preprocess_cutData(data, self.pixelMap)
         # binning data in wavelength according to the coupling map
         data=(de-self.detbias).mean(axis=2)
@@ -85,7 +117,7 @@ class FirstPlRtd(StoppableThread):
         Nwave=data_binned.shape[1]
 
         # create the image maps
-        flux_maps_sum, fluxes = basic.make_image_maps(data_binned.T, self.couplingMap, self.grid_x, self.grid_y, wavelength=False)
+        flux_maps_sum, fluxes = basic.make_image_maps(data_binned.T, self.couplingMap, self.grid_x, self.grid_y, wavelength=False, operator=self.interpolator)
         image=flux_maps_sum[0]
         fluxes = fluxes[0,:,0,0]
 
@@ -107,10 +139,71 @@ class FirstPlRtd(StoppableThread):
         self.image_before = image
         return None
     
+    def get_data_has_timeout(self):
+        """
+        True if the get_data of the installed pyMilk takes the timeout and checkSemAndFlush arguments
+        """
+        try:
+            parameters = inspect.signature(self.im_io.get_data).parameters
+        except (TypeError, ValueError):
+            return False
+        return ("timeout" in parameters) and ("checkSemAndFlush" in parameters)
+
+    def wait_counter(self):
+        """
+        Poll the stream counter until it differs from the last processed one, or frame_timeout elapses.
+        Returns True if a new frame was posted.
+        """
+        deadline = time.monotonic() + self.frame_timeout
+        while self.im_io.get_counter() == self.last_counter:
+            if time.monotonic() > deadline or self.stopped():
+                return False
+            time.sleep(self.counter_period)
+        return True
+
+    def wait_new_frame(self):
+        """
+        Wait (see wait in __init__) until a frame newer than the last processed one is posted.
+        Returns the frame, or None if no new frame arrived within frame_timeout.
+        """
+        if self.wait == "semaphore":
+            flush = (self.policy == "latest")
+            data = self.im_io.get_data(check = True, checkSemAndFlush = flush, timeout = self.frame_timeout)
+        else:
+            if not(self.wait_counter()):
+                return None
+            data = self.im_io.get_data(check = False)
+        counter = self.im_io.get_counter()
+        if counter == self.last_counter:
+            return None
+        if not(self.last_counter is None):
+            # the stream only holds the last frame, anything in between was overwritten
+            self.frames_dropped += max(counter - self.last_counter - 1, 0)
+        self.last_counter = counter
+        return data
+
+    def publish_frame_stats(self):
+        """
+        Publish the frame counter, the lag (in frames) at the end of processing and the dropped frames on first_rtd
+        """
+        lag = self.im_io.get_counter() - self.last_counter
+        self.shm_var.set_keywords({"FRM_CNT": int(self.last_counter),
+                                   "FRM_LAG": int(lag),
+                                   "FRM_DROP": int(self.frames_dropped)})
+        return None
+
     def run(self):
-        while not(self.stopped()):
-            self.setting_milk()
-            time.sleep(0.01)  # Adjust the delay as needed #0.1
+        if self.policy == "poll":
+            while not(self.stopped()):
+                self.setting_milk()
+                time.sleep(0.01)  # Adjust the delay as needed #0.1
+        else:
+            while not(self.stopped()):
+                data = self.wait_new_frame()
+                if data is None:
+                    continue
+                self.setting_milk(data)
+                self.publish_frame_stats()
         print("Exiting...")        
         return None
         
@@ -120,12 +213,14 @@ class FirstPlRtd(StoppableThread):
 parser = argparse.ArgumentParser(description="Pick min and max color scale values")
 parser.add_argument('--vmin', type=int, required=False, help='Min scale value', default=None)
 parser.add_argument('--vmax', type=int, required=False, help='Max scale value', default=None)
+parser.add_argument('--policy', type=str, required=False, choices=['latest', 'all', 'poll'], help='Frame synchronisation policy', default='latest')
+parser.add_argument('--wait', type=str, required=False, choices=['semaphore', 'counter'], help='How to wait for a frame (default: semaphore if the installed pyMilk supports a timeout)', default=None)
 
 if __name__ == "__main__":
     args = parser.parse_args()
 
     # Create an instance of the class
-    rtd = FirstPlRtd(vmin = args.vmin, vmax = args.vmax)
+    rtd = FirstPlRtd(vmin = args.vmin, vmax = args.vmax, policy = args.policy, wait = args.wait)
 
     # Load the calibration files
     rtd.load_calibration()
@@ -27,105 +27,160 @@ import shutil
 from scipy.interpolate import griddata
 from collections import defaultdict
 from scipy import linalg
-from scipy.linalg import pinv
-
-
-def PX_loop_lowering_my_treshold( sampling, peaks_number, raw_image, peaks, output_channels, start = 0.01, stop = 0.1, num = 50, instance=0):
-    threshold_array = np.linspace(start, stop, num)
-    solution_found=[]
-    for i in (range(sampling.shape[0])): #from 0 to the number of samples
-        #Sum 10 values of x (wavelenght=columns) of the pic
-        sum_image = raw_image[:,sampling[i]-5:sampling[i]+5].sum(axis=1)
-        detectedWavePeaks=np.zeros(output_channels)
-        found = False
-        #Search for the 38 modes expected
-        for t in threshold_array:
-            detectedWavePeaks_tmp = peakutils.peak.indexes(sum_image,thres=t, min_dist=6)
-            if len(detectedWavePeaks_tmp) == peaks_number:
-                detectedWavePeaks = detectedWavePeaks_tmp
-                found = True
-                break
-        solution_found+=[found]
-        #The values will be saved at the index i of the sample
-        peaks[:,i]=detectedWavePeaks
-
-    true_count = sum(solution_found)  # because True == 1, False == 0
-    percentage = true_count / len(solution_found)
-    if percentage>=0.1 : 
-        return solution_found, peaks
-    elif instance<5:
-        solution_found, peaks = PX_loop_lowering_my_treshold(sampling, peaks_number, raw_image, peaks, output_channels, start = start/2, stop = stop*2, num=num+20, instance=instance+1)
+
+
+def PX_local_maxima(sum_images, min_dist=6):
+    """
+    Peaks of each column of sum_images (Ny, Nsamples), as found by peakutils.peak.indexes with
+    min_dist and no threshold: local maxima, then the highest ones are kept and suppress the
+    lower ones closer than min_dist.
+
+    The local maxima of all the columns are found in one vectorized pass. Columns with plateaus
+    (equal consecutive values) go through peakutils, which handles them in its own way.
+    The suppression is done for all the columns at once, from the highest peak to the lowest.
+    Since a peak can only be suppressed by higher peaks, the peaks found by peakutils above any
+    threshold are the peaks returned here which are above that threshold.
+
+    Returns the positions (Nsamples, Kmax) and heights of the peaks of each column, sorted by
+    decreasing height (padded with -1 and -inf).
+    """
+
+    Ny,Nsamples=sum_images.shape
+    dy=np.diff(sum_images,axis=0)
+    is_max=np.zeros((Ny,Nsamples),dtype=bool)
+    is_max[1:-1]=(dy[1:] < 0)&(dy[:-1] > 0)
+    for i in np.where((dy == 0).any(axis=0))[0]:
+        is_max[:,i]=False
+        is_max[peakutils.peak.indexes(sum_images[:,i],thres=-np.inf,thres_abs=True,min_dist=1),i]=True
+
+    # candidates of each column, sorted by decreasing height as in peakutils
+    Ncandidates=is_max.sum(axis=0)
+    Kmax=max(Ncandidates.max(),1)
+    column,position=np.nonzero(is_max.T)
+    rank=np.arange(len(column))-np.repeat(np.cumsum(Ncandidates)-Ncandidates,Ncandidates)
+    positions=np.full((Nsamples,Kmax),-1)
+    positions[column,rank]=position
+    heights=np.full((Nsamples,Kmax),-np.inf)
+    heights[column,rank]=sum_images[position,column]
+    order=np.argsort(heights,axis=1,kind='stable')[:,::-1]
+    positions=np.take_along_axis(positions,order,axis=1)
+    heights=np.take_along_axis(heights,order,axis=1)
+
+    # suppression of the peaks closer than min_dist to a higher peak
+    removed=np.ones((Nsamples,Ny+2*min_dist),dtype=bool)
+    removed[column,position+min_dist]=False
+    columns=np.arange(Nsamples)
+    window=np.arange(-min_dist,min_dist+1)
+    for k in range(Kmax):
+        alive=(positions[:,k] >= 0)&(~removed[columns,positions[:,k]+min_dist])
+        p=positions[alive,k]+min_dist
+        removed[columns[alive,None],p[:,None]+window]=True
+        removed[columns[alive],p]=False
+    kept=(positions >= 0)&(~removed[columns[:,None],positions+min_dist])
+
+    order=np.argsort(~kept,axis=1,kind='stable')
+    positions=np.where(kept,positions,-1)
+    heights=np.where(kept,heights,-np.inf)
+    return np.take_along_axis(positions,order,axis=1),np.take_along_axis(heights,order,axis=1)
+
+def PX_find_peaks(sampling, raw_image, output_channels, start = 0.01, stop = 0.1, num = 50, min_dist = 6, Ntries = 6):
+    """
+    Positions of the output_channels peaks of the raw image, for each column in sampling
+    (summed over 10 pixels).
+
+    Same result as scanning the thresholds np.linspace(start, stop, num) (relative to the min and
+    max of each column) with peakutils.peak.indexes until it finds output_channels peaks, and
+    widening the threshold range when less than 10% of the columns have a solution. The peaks
+    are computed once per column: exactly output_channels peaks are found for the thresholds
+    between the heights of the output_channels-th and output_channels+1-th highest peaks.
+
+    Returns the list of the columns with a solution, and the peaks (output_channels, Nsamples),
+    which are zero for the columns without solution.
+    """
+
+    sum_images=raw_image[:,sampling[:,None]+np.arange(-5,5)].sum(axis=2)
+    positions,heights=PX_local_maxima(sum_images, min_dist=min_dist)
+    Nsamples,Kmax=positions.shape
+    if Kmax < output_channels:
+        print("Less than %d peaks in all the columns. Verify your pixelmap"%output_channels)
+        return None
+
+    # threshold range giving exactly output_channels peaks
+    upper=heights[:,output_channels-1]
+    lower=heights[:,output_channels] if Kmax > output_channels else np.full(Nsamples,-np.inf)
+    ymin=sum_images.min(axis=0)
+    ymax=sum_images.max(axis=0)
+    peaks=np.sort(positions[:,:output_channels],axis=1).T.astype(np.double)
+
+    for instance in range(Ntries):
+        threshold_array=np.linspace(start,stop,num)
+        thres=threshold_array[:,None]*(ymax-ymin)+ymin
+        found=((thres >= lower)&(thres < upper)).any(axis=0)
+        if found.mean() >= 0.1:
+            return list(found),np.where(found,peaks,0)
+        start,stop,num=start/2,stop*2,num+20
 
     print("Too many runs, no solution found. Verify your pixelmap")
     print(instance)
-    return
+    return None
 
-def PX_generate_pixelmap(raw_image, pixel_min, pixel_max, output_channels):
+def PX_robust_fit(x, y, order=1, Nclip=5, nsigma=3):
+    """
+    Polynomial fits of all the traces at once, with sigma clipping.
 
-    pixel_length=raw_image.shape[1]
+    x (Npoints) are the columns, y (Ntraces, Npoints) the positions of the traces. Each of the
+    Nclip iterations solves the weighted least squares of all the traces together, by their
+    normal equations, and removes the points further than nsigma times the standard deviation
+    of the residuals of the remaining points (unless this deviation is zero). The final fit is
+    done on the remaining points.
 
-    #300 values of pixels between pixelmin and pixelmax
-    sampling        = np.linspace(pixel_min+5,pixel_max-5,300,dtype=int)
-    peaks           = np.zeros([output_channels, sampling.shape[0]])
+    Returns a function giving the positions of all the traces (Ntraces, len(columns)) for an
+    array of columns.
+    """
 
-    threshold_array=np.linspace(0.01,0.1,50) #originally #np.linspace(0.01,0.1,50) 
-    peaks_number=output_channels
-    
-    solution_found, peaks = PX_loop_lowering_my_treshold( sampling, peaks_number, raw_image, peaks, output_channels)
-    traces_loc= np.ones([pixel_length,output_channels],dtype=int)
+    # centred and scaled columns, to keep the normal equations well conditioned for order > 1
+    x0=(x.max()+x.min())/2
+    scale=max((x.max()-x.min())/2,1)
+    A=np.vander((x-x0)/scale,order+1)
+    inliers=np.ones(y.shape,dtype=bool)
 
-    x_found=[]
-    y_found=[]
-    x_none = []
-    y_none = []
+    def solve(weights):
+        normal_matrix=np.einsum('tp,pi,pj->tij',weights,A,A)
+        normal_vector=np.einsum('tp,pi,tp->ti',weights,A,y)
+        return np.linalg.solve(normal_matrix,normal_vector[...,None])[...,0]
 
-    #Once we've picked each detected peak, we need to verify that they all belong to the same mode,
-    #and that there is no outlier
+    for b in range(Nclip):
+        weights=inliers.astype(np.double)
+        residuals=y-solve(weights)@A.T
+        Npoints=weights.sum(axis=1,keepdims=True)
+        mean=(weights*residuals).sum(axis=1,keepdims=True)/Npoints
+        std_residuals=np.sqrt((weights*(residuals-mean)**2).sum(axis=1,keepdims=True)/Npoints)
+        clip=std_residuals >= 1e-10
+        inliers&=~clip|(np.abs(residuals) < nsigma*std_residuals)
 
-    for i in range(output_channels):
-        # x is a list of all the pixels/wavelength at which 38 peaks were detected
-        x = sampling[solution_found]
-        # y the corresponding positions of each peak/mode
-        y = peaks[i][solution_found]
+    coeffs=solve(inliers.astype(np.double))
+    return lambda columns: coeffs@np.vander((np.asarray(columns)-x0)/scale,order+1).T
 
+def PX_generate_pixelmap(raw_image, pixel_min, pixel_max, output_channels, order=1):
 
-        # To check for outlier, we make a 1D polyfit between x and y
-        for b in range(5): # The process is repeated 5 times to refine the polyfit each time
-            poly_coeffs = np.polyfit(x, y, 1)
+    pixel_length=raw_image.shape[1]
 
-            # Calculate residuals of the function
-            y_fit = np.polyval(poly_coeffs, x)
-            residuals = y - y_fit
+    #300 values of pixels between pixelmin and pixelmax
+    sampling        = np.linspace(pixel_min+5,pixel_max-5,300,dtype=int)
 
-            # Calculate standard deviation of residuals
-            std_residuals = np.std(residuals)
-            if std_residuals < 1*(10**(-10)):
-                x_with_none = x
-                y_with_none = y
-                continue
+    solution_found, peaks = PX_find_peaks(sampling, raw_image, output_channels)
 
-            # Identify inliers (points with residuals within the threshold)
-            inliers = np.abs(residuals) < 3 * std_residuals
-            
+    #Once we've picked each detected peak, we need to verify that they all belong to the same mode,
+    #and that there is no outlier: polynomial fit of the positions of each mode (order 1 by default),
+    #repeated 5 times removing the points further than 3 sigma
+    # x is the list of the pixels/wavelength at which the 38 peaks were detected
+    x = sampling[solution_found]
+    # y the corresponding positions of each peak/mode
+    y = peaks[:,solution_found]
+    traces = PX_robust_fit(x, y, order=order)
 
-            # Remove outliers
-            x = x[inliers]
-            y = y[inliers]
-
-            # Replace outliers with None
-            x_with_none = [xi if inlier else None for xi, inlier in zip(x, inliers)]
-            y_with_none = [yi if inlier else None for yi, inlier in zip(y, inliers)]
-
-        # Fit the polynomial to the cleaned data
-        poly_coeffs = np.polyfit(x, y, 1)
-        # We stop considering solo pixels and consider the 1D polyfit to trace over all of them.
-        traces_loc[:,i] = np.polyval(poly_coeffs, np.arange(pixel_length))+0.5
-        # x is a list of all the pixels/wavelength at which 38 peaks were detected
-        # y the corresponding positions of each peak/mode
-        x_found += [x]
-        y_found += [y]
-        x_none +=[x_with_none]
-        y_none +=[y_with_none]
+    # We stop considering solo pixels and consider the polyfit to trace over all of them.
+    traces_loc = (traces(np.arange(pixel_length)).T+0.5).astype(int)
 
     return traces_loc
 
@@ -263,7 +318,57 @@ def run_PR_preprocess(filelist_pixelmap,files_by_dir, save_to):
         #shutil.copy(filelist_pixelmap[-1], preproc_dir_path)
     return preproc_dir_path
 
-def CM_get_projection_matrice(datacube,flux_goodData,Nsingular):
+def CM_truncated_svd(matrix, Nsingular, method='full', oversampling=10, power_iterations=2, seed=0):
+    """
+    Computes the Nsingular leading left singular vectors of a 2D matrix.
+
+    method='full' is the full linalg.svd (reference).
+    method='gram' diagonalises the Gram matrix of the smallest dimension, which is much cheaper
+    when one of the two dimensions is small. It squares the condition number, so the trailing
+    singular values are only accurate to about sqrt(eps) * s[0], and the columns of U of the
+    singular values below this limit are set to zero.
+    method='randomized' is the randomized range finder of Halko et al. (2011), with
+    Nsingular+oversampling random vectors and power_iterations subspace iterations.
+
+    Returns U[:, :Nsingular] and the singular values (all of them for 'full' and 'gram',
+    only the Nsingular+oversampling leading ones for 'randomized').
+    """
+
+    Nrows, Ncols = matrix.shape
+    if method == 'full':
+        U,s,Vh=linalg.svd(matrix,full_matrices=False)
+        return U[:,:Nsingular],s
+
+    if method == 'gram':
+        if Nrows <= Ncols:
+            eigenvalues,U=linalg.eigh(matrix @ matrix.T)
+            eigenvalues,U=eigenvalues[::-1],U[:,::-1]
+            s=np.sqrt(np.clip(eigenvalues,0,None))
+            return U[:,:Nsingular],s
+        eigenvalues,V=linalg.eigh(matrix.T @ matrix)
+        eigenvalues,V=eigenvalues[::-1],V[:,::-1]
+        s=np.sqrt(np.clip(eigenvalues,0,None))
+        # the components below the accuracy of the Gram matrix (rank deficient stacks) are zeroed,
+        # U=matrix@V/s would be noise, or inf/NaN for a zero singular value
+        keep=s[:Nsingular] > np.sqrt(np.finfo(s.dtype).eps)*s[0]
+        U=np.zeros((Nrows,min(Nsingular,len(s))),dtype=np.result_type(matrix.dtype,s.dtype))
+        U[:,keep]=(matrix @ V[:,:Nsingular][:,keep])/s[:Nsingular][keep]
+        return U,s
+
+    if method == 'randomized':
+        rng=np.random.default_rng(seed)
+        Nrandom=min(Nsingular+oversampling,Nrows,Ncols)
+        Q,_=linalg.qr(matrix @ rng.standard_normal((Ncols,Nrandom)),mode='economic')
+        for i in range(power_iterations):
+            # re-orthonormalise at each step, otherwise the small singular values are lost in round-off
+            Q,_=linalg.qr(matrix.T @ Q,mode='economic')
+            Q,_=linalg.qr(matrix @ Q,mode='economic')
+        Ub,s,Vh=linalg.svd(Q.T @ matrix,full_matrices=False)
+        return (Q @ Ub)[:,:Nsingular],s
+
+    raise ValueError("Unknown SVD method {}".format(method))
+
+def CM_get_projection_matrice(datacube,flux_goodData,Nsingular,svd_method='full',check_svd=False):
     """
     Computes the projection matrix and singular values using Singular Value Decomposition (SVD).
     datacube is a flux_2_data matrix
@@ -271,6 +376,9 @@ def CM_get_projection_matrice(datacube,flux_goodData,Nsingular):
         flux_2_data == projdata_2_data @ s @ flux_2_data
         data_2_projdata is the transpose of projdata_2_data
 
+    svd_method selects the decomposition (see CM_truncated_svd). With check_svd=True, the
+    Nsingular leading singular values are compared to the full SVD and the error is printed.
+
     Returns the projection matrix data_2_projdata and singular values.
     """
 
@@ -282,10 +390,16 @@ def CM_get_projection_matrice(datacube,flux_goodData,Nsingular):
 
     pos_2_data = datacube[:,flux_goodData] #(3800, 3017) datacube is (3800, 10, 625), flux_good is (10, 625)
 
-    U,s,Vh=linalg.svd(pos_2_data,full_matrices=False)
+    singular_2_data,s=CM_truncated_svd(pos_2_data,Nsingular,method=svd_method) #(3800, 57)
+
+    # fraction of the energy of the data kept by the selected singular vectors
+    energy_kept=np.sum(s[:Nsingular]**2)/np.sum(pos_2_data**2)
+    print("SVD (%s): %d singular values keep %.6f of the energy"%(svd_method,Nsingular,energy_kept))
+    if check_svd and svd_method != 'full':
+        s_full=linalg.svd(pos_2_data,compute_uv=False)
+        error=np.abs(s[:Nsingular]-s_full[:Nsingular])/s_full[:Nsingular]
+        print("SVD (%s): max relative error on the singular values %.3e (last one %.3e)"%(svd_method,error.max(),error[-1]))
 
-    #pos_2_singular = Vh[:Nsingular]*s[:Nsingular,None]
-    singular_2_data = U[:,:Nsingular] #(3800, 57)
     pos_2_singular = singular_2_data.T @ datacube.reshape((Nwave*Noutput,Ncube*Nmod)) #(57, 6250)
 
     singular_values = s #(3017,)
@@ -294,11 +408,48 @@ def CM_get_projection_matrice(datacube,flux_goodData,Nsingular):
 
     return pos_2_singular,singular_values,singular_2_data
 
-def CM_get_fluxtiptilt_matrices(singular_2_data, pos_2_singular_mean, triangles):
+def CM_stacked_pinv(matrices, method='svd'):
+    """
+    Computes the pseudo-inverse of each matrix of a stack of shape (..., M, N) in one call.
+
+    With method='svd', the stacked np.linalg.pinv is used, with the same cut-off on the singular
+    values as scipy.linalg.pinv (max(M, N) * eps).
+    With method='normal', full column rank matrices are inverted with the normal equations
+    (A^T A)^-1 A^T, which is faster for the tall (Noutput x 3) flux/tip/tilt matrices. The
+    rank deficient (or badly conditioned) ones fall back to the SVD, as do wide stacks (M < N),
+    which cannot have full column rank.
+
+    Returns the stack of pseudo-inverses, of shape (..., N, M).
+    """
+
+    M, N = matrices.shape[-2:]
+    rcond = max(M, N)*np.finfo(matrices.dtype).eps
+    if method == 'svd':
+        return np.linalg.pinv(matrices, rcond=rcond)
+    if method != 'normal':
+        raise ValueError("Unknown pinv method {}".format(method))
+    if N > M:
+        # the (N x N) Gram of a wide matrix is singular, no need to form it
+        return np.linalg.pinv(matrices, rcond=rcond)
+
+    matrices_t = np.swapaxes(matrices, -1, -2)
+    gram = matrices_t @ matrices
+    eigenvalues = np.linalg.eigvalsh(gram)
+    # the normal equations square the condition number, keep them for well conditioned matrices only
+    good = eigenvalues[...,0] > eigenvalues[...,-1]*np.sqrt(rcond)
+    if np.all(good):
+        return np.linalg.inv(gram) @ matrices_t
+    inverse = np.empty(matrices.shape[:-2]+(N, M), dtype=matrices.dtype)
+    inverse[good] = np.linalg.inv(gram[good]) @ matrices_t[good]
+    inverse[~good] = np.linalg.pinv(matrices[~good], rcond=rcond)
+    return inverse
+
+def CM_get_fluxtiptilt_matrices(singular_2_data, pos_2_singular_mean, triangles, pinv_method='svd'):
     """
     Computes the flux and tip-tilt matrix from the projected data.
 
     This function calculates matrices for converting between projected data and flux/tip-tilt values.
+    The pseudo-inverses are computed on the whole stacks at once (see CM_stacked_pinv).
 
     Returns:
         tuple: A tuple containing:
@@ -326,17 +477,12 @@ def CM_get_fluxtiptilt_matrices(singular_2_data, pos_2_singular_mean, triangles)
     flux_norm_wave = flux_2_data.sum(axis=(1,2), keepdims=True)
     flux_2_data /= flux_norm_wave
 
-    data_2_flux = np.zeros((Nwave,Npositions,Noutput))
     print("Inverting flux_2_data to data_2_flux for each wavelength:")
-    for w in tqdm(range(Nwave)):
-        data_2_flux[w]=pinv(flux_2_data[w])
+    data_2_flux = CM_stacked_pinv(flux_2_data, method=pinv_method)
 
     fluxtiptilt_2_data = flux_2_data_tmp[:,:,triangles[masque_triangles]].transpose((2,0,1,3)).copy()
-    data_2_fluxtiptilt = np.zeros((Ntriangles,Nwave,3,Noutput))
     print("Inverting fluxtiptilt_2_data to data_2_fluxtiptilt:")
-    for w in tqdm(range(Nwave)):
-        for t in range(Ntriangles):
-            data_2_fluxtiptilt[t,w]=pinv(fluxtiptilt_2_data[t,w])
+    data_2_fluxtiptilt = CM_stacked_pinv(fluxtiptilt_2_data, method=pinv_method)
 
 
     return flux_2_data,data_2_flux,fluxtiptilt_2_data,data_2_fluxtiptilt,masque_positions,masque_triangles
@@ -393,16 +539,13 @@ def filter_filelist(filelist,modID):
     return files_with_dark
 
 
-def run_PX_create_pixel_map_from_a_list_of_fits_files(filelist, folder):
+def run_PX_create_pixel_map_from_a_list_of_fits_files(filelist, folder, Nthreads=4):
     
     #TODO : ADD A FUNCTION THAT PICKS UP THE LAST N FILES
-    #TODO : ADD A FUNCTION THAT VERIFY ALL FILES ARE COMPATIBLE
 
     header = fits.getheader(filelist[-1])
-    raw_image = np.zeros((header['NAXIS2'], header['NAXIS1']), dtype=np.double)
-    header = fits.getheader(filelist[-1])
-    for filename in tqdm(filelist, desc="Co-adding files"):
-        raw_image += fits.getdata(filename).sum(axis=0)
+    # memory-mapped, chunked co-addition of all the frames, several files in parallel
+    raw_image = runlib_i.coadd_files(filelist, Nthreads=Nthreads)
 
     pixel_min = 100
     pixel_max = 1600
@@ -411,6 +554,8 @@ def run_PX_create_pixel_map_from_a_list_of_fits_files(filelist, folder):
 
     traces_loc = PX_generate_pixelmap(raw_image, pixel_min, pixel_max, output_channels)
     pixelmap_path = PX_save_fits(traces_loc, header,pixel_min, pixel_max,pixel_wide,output_channels, folder)
+    # save the extraction plan next to the pixel map, so that the RTD does not have to rebuild it
+    basic.PixelMap(pixelmap_path).save_extraction_plan(*raw_image.shape)
 
     return pixelmap_path
 
@@ -420,31 +565,27 @@ def run_CM_create_coupling_maps(files_with_dark,
                                 wavelength_bin = 15,
                                 modID = 0,
                                 Nsingular=19*3, 
-                                output_dir='.'):
+                                output_dir='.',
+                                svd_method='full',
+                                check_svd=False,
+                                pinv_method='svd'):
 
 
     #Input preproc
     #clean and sum all data
-    datalist=runlib_i.extract_datacube(files_with_dark,wavelength_smooth,Nbin=wavelength_bin)
-    #datacube (625, 38, 100)
-    #select only the data in datalist which has the same modulation pattern
-    if modID == 0:
-        modID = datalist[0].modID
-        datalist = [d for d in datalist if d.modID == modID]
-
-    modScale = datalist[0].modScale
-    datalist = [d for d in datalist if d.modScale == modScale and d.modID== modID]
+    #only the data with the same modulation pattern is kept, and streamed into a single cube
+    stacked=runlib_i.extract_stacked_datacube(files_with_dark,wavelength_smooth,Nbin=wavelength_bin,modID=modID)
+    #datacube (Ncube, 625, 38, 100)
 
-    if len(datalist) == 0:
-        print("No data with the selected modulation parameters",modID,modScale)
+    if stacked is None:
+        print("No data with the selected modulation parameters",modID)
         return
 
-    datacube=np.concatenate([d.data for d in datalist])
-    datacube=datacube.transpose((3,2,0,1))
+    datacube=stacked.data.transpose((3,2,0,1))
 
-    xmod=datalist[0].xmod
-    ymod=datalist[0].ymod
-    triangles = datalist[0].get_triangle()
+    xmod=stacked.xmod
+    ymod=stacked.ymod
+    triangles = stacked.get_triangle()
 
     # select data only above a threshold based on flux
     flux_threshold=np.percentile(datacube.mean(axis=(0,1)),80)/5
@@ -460,14 +601,14 @@ def run_CM_create_coupling_maps(files_with_dark,
     #datacube : (100, 38, 10, 625)
     #flux_gooddata : (10, 625)
     #Nsingular : 57
-    pos_2_singular,singular_values,singular_2_data=CM_get_projection_matrice(datacube,flux_goodData,Nsingular)
+    pos_2_singular,singular_values,singular_2_data=CM_get_projection_matrice(datacube,flux_goodData,Nsingular,svd_method,check_svd)
 
     # average all the datacubes, do not includes the bad frames
     pos_2_singular[:,~flux_goodData]=np.nan
     pos_2_singular_mean = np.nanmean(pos_2_singular,axis=1)
 
     # compute the matrices to go from the projected data to the flux and tip tilt (and inverse)
-    flux_2_data,data_2_flux,fluxtiptilt_2_data,data_2_fluxtiptilt,masque_positions,masque_triangles = CM_get_fluxtiptilt_matrices(singular_2_data, pos_2_singular_mean, triangles)
+    flux_2_data,data_2_flux,fluxtiptilt_2_data,data_2_fluxtiptilt,masque_positions,masque_triangles = CM_get_fluxtiptilt_matrices(singular_2_data, pos_2_singular_mean, triangles, pinv_method)
 
     #use flux tip tilt matrice to check if the observations are point like
     # To do so, fits the vector model and check if the chi2 decrease resonably
@@ -478,10 +619,10 @@ def run_CM_create_coupling_maps(files_with_dark,
     chi2_goodData = (chi2_delta < chi2_threshold)&flux_goodData
 
     #redo most of the work above but with flagged datasets
-    pos_2_singular,singular_values,singular_2_data=CM_get_projection_matrice(datacube,chi2_goodData,Nsingular)
+    pos_2_singular,singular_values,singular_2_data=CM_get_projection_matrice(datacube,chi2_goodData,Nsingular,svd_method,check_svd)
     pos_2_singular[:,~chi2_goodData]=np.nan
     pos_2_singular_mean = np.nanmean(pos_2_singular,axis=1)
-    flux_2_data,data_2_flux,fluxtiptilt_2_data,data_2_fluxtiptilt,masque_positions,masque_triangles = CM_get_fluxtiptilt_matrices(singular_2_data, pos_2_singular_mean, triangles)
+    flux_2_data,data_2_flux,fluxtiptilt_2_data,data_2_fluxtiptilt,masque_positions,masque_triangles = CM_get_fluxtiptilt_matrices(singular_2_data, pos_2_singular_mean, triangles, pinv_method)
     
     # Flux maps for inspection
     fluxmaps = np.mean(datacube, axis=(0,1))
@@ -533,11 +674,11 @@ def run_CM_create_coupling_maps(files_with_dark,
     hdu_table_mod = fits.BinTableHDU.from_columns([col_xmod, col_ymod], name='POSITIONS')
     hdu_table_triangle = fits.BinTableHDU.from_columns([col_xtriangles, col_ytriangles], name='TRIANGLES')
 
-    modulation_hdu = fits.open(datalist[-1].filename)['MODULATION']
+    modulation_hdu = fits.open(stacked.filename)['MODULATION']
 
-    header = datalist[-1].header
+    header = stacked.header
     # Définir le chemin complet du sous-dossier "output/couplingmaps"
-    folder = datalist[-1].dirname
+    folder = stacked.dirname
     #output_dir = folder #os.path.join(folder,"couplingmaps")
 
     header['X_FIRTYP'] = 'COUPLINGMAP'
@@ -551,6 +692,8 @@ def run_CM_create_coupling_maps(files_with_dark,
     header['WLSMOOTH'] = wavelength_smooth  # Add wavelength smoothing factor
     header['WL_BIN'] = wavelength_bin
     header['NSINGUL'] = Nsingular  # Add number of singular values
+    header['SVDMETH'] = svd_method  # Add the decomposition used for the projection
+    header['PINVMETH'] = pinv_method  # Add the pseudo-inverse used for the flux/tip/tilt matrices
     header['FLUXTHR'] = flux_threshold  # Add flux threshold
     header['CHI2THR'] = chi2_threshold  # Add chi2 threshold
 
@@ -665,7 +808,7 @@ def replace_directory_contents(target_dir, source_dir):
         else:
             shutil.copy2(src_path, dst_path)
 
-def new_coupling_map(filelist2):
+def new_coupling_map(filelist2, svd_method='full', check_svd=False, pinv_method='svd'):
 
     #test = "firstpl_05:31:04.859572198.fits"
     #source_path = "/mnt/datazpool/PL/20250510/firstpl/"
@@ -708,7 +851,10 @@ def new_coupling_map(filelist2):
                                 wavelength_bin = 15,
                                 modID = 0,
                                 Nsingular=19*3,
-                                output_dir=most_recent_folder)
+                                output_dir=most_recent_folder,
+                                svd_method=svd_method,
+                                check_svd=check_svd,
+                                pinv_method=pinv_method)
 
     # I replace the final directory every time so as to keep the original coupling map in memory in their own folder
     replace_directory_contents("/mnt/datazpool/PL/calibration_files", get_latest_dated_folder())
@@ -721,6 +867,9 @@ parser.add_argument('--n-latest', type=int, required=False, help='Number of late
 parser.add_argument('--modid', type=int, required=False, help='ModID to filter on', default=None)
 parser.add_argument('--modscale', type=int, required=False, help='ModScale to filter on', default=None)
 parser.add_argument('--filelist', '--nargs', action='append', nargs='+', required=False, help='List of all the files to use', default=None)
+parser.add_argument('--svd', choices=['full', 'randomized', 'gram'], required=False, help='Decomposition used for the coupling map projection', default='full')
+parser.add_argument('--svd-check', action='store_true', help='Compare the singular values to the full SVD and print the error')
+parser.add_argument('--pinv', choices=['svd', 'normal'], required=False, help='Pseudo-inverse used for the flux/tip/tilt matrices', default='svd')
 
 if __name__ == "__main__":
     '''
@@ -771,6 +920,6 @@ if __name__ == "__main__":
         filelist2 = runlib.get_n_latest_date_fits(filelist2, n_latest)
 
     print("Used : ", filelist2)
-    new_coupling_map(filelist2)
+    new_coupling_map(filelist2, svd_method=args.svd, check_svd=args.svd_check, pinv_method=args.pinv)
 
     
@@ -1,9 +1,15 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from astropy.io import fits
 import numpy as np
 from tqdm import tqdm
 from scipy.optimize import curve_fit
+from scipy import sparse
 
-from scipy.interpolate import griddata
+from scipy.interpolate import griddata, CloughTocher2DInterpolator, LinearNDInterpolator
+from scipy.spatial import Delaunay
 
 class PixelMap:
     def __init__(self, file):
@@ -14,6 +20,96 @@ class PixelMap:
         self.pixel_max = self.header.get('PIX_MAX', 1600)
         self.pixel_wide = self.header.get('PIX_WIDE', 2)
         self.output_channels = self.header.get('OUT_CHAN', 38)
+        self.plan_file = os.path.splitext(file)[0] + '_PLAN.fits'
+        self._plan = None
+
+    def get_extraction_plan(self, Nrows, Ncols):
+        """
+        Returns the ExtractionPlan of this pixel map for frames of shape (Nrows, Ncols).
+        The plan is built on first use, or read from `plan_file` if it was saved with the same
+        trace table and detector shape, and then kept for all the following calls.
+        """
+        if (self._plan is not None) and (self._plan.shape == (Nrows, Ncols)):
+            return self._plan
+        trace_hash = ExtractionPlan.hash_traces(self, Nrows, Ncols)
+        plan = None
+        if os.path.isfile(self.plan_file):
+            plan = ExtractionPlan.load(self.plan_file)
+            if plan.trace_hash != trace_hash:
+                print("WARNING: extraction plan {} does not match the pixel map, rebuilding it".format(self.plan_file))
+                plan = None
+        if plan is None:
+            plan = ExtractionPlan(self, Nrows, Ncols)
+        self._plan = plan
+        return self._plan
+
+    def save_extraction_plan(self, Nrows, Ncols):
+        """
+        Builds the ExtractionPlan for frames of shape (Nrows, Ncols) and saves it next to the pixel map file.
+        """
+        plan = self.get_extraction_plan(Nrows, Ncols)
+        plan.save(self.plan_file)
+        return self.plan_file
+
+class ExtractionPlan:
+    """
+    Precomputed pixel extraction of a pixel map, for a given detector shape.
+    Attributes:
+        shape (tuple): The (Nrows, Ncols) shape of the detector frames.
+        cut_index (numpy.ndarray): Flat detector index of each extracted pixel, of shape
+                                   (output_channels, Nwave, window_size).
+        dark_index (numpy.ndarray): Flat detector index of the dark pixels between traces, of shape
+                                    (output_channels - 1, Nwave).
+        trace_hash (str): Hash of the trace table, the extraction geometry and the detector shape.
+    The index arrays are read-only, a new plan has to be built if the pixel map changes.
+    """
+    def __init__(self, pixelMap=None, Nrows=None, Ncols=None):
+        if pixelMap is None:
+            return None
+        self.shape = (Nrows, Ncols)
+        self.trace_hash = self.hash_traces(pixelMap, Nrows, Ncols)
+        cut_index, dark_index = preprocess_indices(pixelMap, Nrows, Ncols)
+        self._set_arrays(cut_index, dark_index)
+
+    def _set_arrays(self, cut_index, dark_index):
+        self.cut_index = cut_index
+        self.dark_index = dark_index
+        for array in (self.cut_index, self.dark_index):
+            array.setflags(write=False)
+
+    @staticmethod
+    def hash_traces(pixelMap, Nrows, Ncols):
+        """
+        Returns a hash identifying the trace table, the extraction geometry and the detector shape.
+        """
+        traces_loc = np.ascontiguousarray(pixelMap.traces_loc, dtype=np.int64)
+        sha = hashlib.sha1(traces_loc.tobytes())
+        geometry = (pixelMap.pixel_min, pixelMap.pixel_max, pixelMap.pixel_wide, pixelMap.output_channels, Nrows, Ncols)
+        sha.update(np.array(geometry, dtype=np.int64).tobytes())
+        return sha.hexdigest()
+
+    def save(self, file):
+        hdu_primary = fits.PrimaryHDU()
+        hdu_primary.header['X_FIRTYP'] = 'EXTPLAN'
+        hdu_primary.header['TRACHASH'] = self.trace_hash
+        hdu_primary.header['NROWS'] = self.shape[0]
+        hdu_primary.header['NCOLS'] = self.shape[1]
+        hdu_cut = fits.ImageHDU(data=self.cut_index.astype(np.int64), name='CUTINDEX')
+        hdu_dark = fits.ImageHDU(data=self.dark_index.astype(np.int64), name='DARKINDX')
+        hdul = fits.HDUList([hdu_primary, hdu_cut, hdu_dark])
+        hdul.writeto(file, overwrite=True)
+        return None
+
+    @classmethod
+    def load(cls, file):
+        plan = cls()
+        with fits.open(file) as hdul:
+            header = hdul[0].header
+            plan.shape = (header['NROWS'], header['NCOLS'])
+            plan.trace_hash = header['TRACHASH']
+            plan._set_arrays(hdul['CUTINDEX'].data.astype(np.intp),
+                             hdul['DARKINDX'].data.astype(np.intp))
+        return plan
 
 def preprocess_cutData(data, pixelMap, dark_calculation=False):
     """
@@ -45,45 +141,75 @@ def preprocess_cutData(data, pixelMap, dark_calculation=False):
         - The function ensures that pixel indices do not go out of bounds when accessing the `data` array.
     """
 
-    pixel_min = pixelMap.pixel_min
-    pixel_max = pixelMap.pixel_max
-    pixel_wide = pixelMap.pixel_wide
-    output_channels = pixelMap.output_channels
-    traces_loc = pixelMap.traces_loc
-
-
-
-    Nwave = pixel_max - pixel_min
-    window_size = (pixel_wide * 2 + 1)
-
     add_dimension_for_cubelike_data = False
     if len(data.shape) == 2:
         add_dimension_for_cubelike_data = True
         data = data[None]
 
-    Nimages = data.shape[0] 
-
-    data_cut_pixels = np.zeros((Nimages, output_channels, Nwave, window_size), dtype='uint16')
-    data_dark_pixels = np.zeros((Nimages, output_channels - 1, Nwave), dtype='uint16')
-    for x in range(Nwave):
-        for i in range(output_channels):
-            for w in range(pixel_wide*2+1):
-                t=traces_loc[x + pixel_min, i]+w-pixel_wide
-                if t<0:
-                    t=0
-                if t>=data.shape[1]:
-                    t=data.shape[1]-1
-                data_cut_pixels[:,i,x,w] = data[:, t, x + pixel_min]
-            if (i > 0)&(dark_calculation):
-                t=(traces_loc[x + pixel_min, i-1]+traces_loc[x + pixel_min, i])//2+w-pixel_wide
-                data_dark_pixels[:,i-1,x] = data[:, t, x + pixel_min]
-    
+    Nimages = data.shape[0]
+    Nrows = data.shape[1]
+    Ncols = data.shape[2]
+
+    if isinstance(pixelMap, PixelMap):
+        plan = pixelMap.get_extraction_plan(Nrows, Ncols)
+        cut_index, dark_index = plan.cut_index, plan.dark_index
+    else:
+        cut_index, dark_index = preprocess_indices(pixelMap, Nrows, Ncols)
+
+    # one gather over the flattened detector frames for the whole cube
+    data_flat = data.reshape((Nimages, Nrows*Ncols))
+    data_cut_pixels = np.take(data_flat, cut_index, axis=1).astype('uint16')
+    if dark_calculation:
+        data_dark_pixels = np.take(data_flat, dark_index, axis=1).astype('uint16')
+    else:
+        data_dark_pixels = np.zeros((Nimages,) + dark_index.shape, dtype='uint16')
+
     if add_dimension_for_cubelike_data:
         data_cut_pixels = data_cut_pixels[0]
         data_dark_pixels = data_dark_pixels[0]
 
     return data_cut_pixels, data_dark_pixels
 
+def preprocess_indices(pixelMap, Nrows, Ncols):
+    """
+    Computes the flat detector indices used by `preprocess_cutData` to gather the trace pixels.
+    Args:
+        pixelMap (object): An object with the pixel_min, pixel_max, pixel_wide, output_channels
+                           and traces_loc attributes (see `preprocess_cutData`).
+        Nrows (int): The number of detector rows (height of the frames).
+        Ncols (int): The number of detector columns (width of the frames).
+    Returns:
+        tuple: A tuple containing:
+            - cut_index (numpy.ndarray): An array of shape (output_channels, Nwave, window_size)
+              with the flat index (row*Ncols+column) of each extracted pixel. Rows are clipped
+              to the detector.
+            - dark_index (numpy.ndarray): An array of shape (output_channels - 1, Nwave) with the
+              flat index of the dark pixel located between two adjacent traces.
+    """
+
+    pixel_min = pixelMap.pixel_min
+    pixel_max = pixelMap.pixel_max
+    pixel_wide = pixelMap.pixel_wide
+    output_channels = pixelMap.output_channels
+    traces_loc = np.asarray(pixelMap.traces_loc, dtype=np.intp)
+
+    if pixel_max > Ncols:
+        raise IndexError("pixel_max ({}) is out of the detector (width {})".format(pixel_max, Ncols))
+
+    columns = np.arange(pixel_min, pixel_max)
+    traces = traces_loc[pixel_min:pixel_max, :output_channels].T # (output_channels, Nwave)
+
+    offsets = np.arange(-pixel_wide, pixel_wide+1)
+    rows = np.clip(traces[:, :, None] + offsets, 0, Nrows-1)
+    cut_index = rows*Ncols + columns[None, :, None]
+
+    # pixel in the middle of two traces, shifted by pixel_wide as in the original extraction loop
+    rows_dark = (traces[:-1] + traces[1:])//2 + pixel_wide
+    rows_dark = np.where(rows_dark < 0, rows_dark + Nrows, rows_dark)
+    dark_index = rows_dark*Ncols + columns[None, :]
+
+    return cut_index, dark_index
+
 
 class CouplingMap:
     def __init__(self, file):
@@ -108,7 +234,7 @@ class CouplingMap:
         cmap_file.close()
 
 
-def make_image_source_removal(datacube,arg_triangle,couplingMap):
+def make_image_source_removal(datacube,arg_triangle,couplingMap,chunk_size=64):
     """
     Removes the source contribution from a datacube using a coupling map and 
     returns the residual datacube and the flux-tip-tilt (FFT) fit.
@@ -129,6 +255,10 @@ def make_image_source_removal(datacube,arg_triangle,couplingMap):
             back to the data space.
         - data_2_fluxtiptilt: A mapping matrix to transform data into the 
             flux-tip-tilt (FFT) space.
+    chunk_size : int, optional
+        Number of (cube, modulation) samples processed together. The triangle
+        matrices of a chunk are gathered at once, so this bounds the memory used.
+        Defaults to 64.
     Returns:
     --------
     residual : numpy.ndarray
@@ -159,14 +289,22 @@ def make_image_source_removal(datacube,arg_triangle,couplingMap):
     fluxtiptilt_2_data = couplingMap.fluxtiptilt_2_data
     data_2_fluxtiptilt = couplingMap.data_2_fluxtiptilt
 
-    residual = datacube.copy()
-    fft_fit = np.zeros((Nwave,3,Ncube,Nmod))
-    for c in range(Ncube):
-        for m in range(Nmod):
-            i = arg_triangle[c,m]
-            fft = np.matmul(data_2_fluxtiptilt[i],datacube[:,:,c,m,None]) #flux tip tilt
-            fft_fit[:,:,c,m] = fft[:,:,0]
-            residual[:,:,c,m] -= np.matmul(fluxtiptilt_2_data[i],fft)[:,:,0]
+    Nsamples = Ncube*Nmod
+    triangles = np.asarray(arg_triangle).reshape(Nsamples)
+    # contiguous (sample, wavelength, output) layout, so each sample is read in one block
+    samples = np.ascontiguousarray(datacube.reshape((Nwave,Noutput,Nsamples)).transpose((2,0,1)))[:,:,:,None]
+
+    residual = np.empty((Nsamples,Nwave,Noutput), dtype=datacube.dtype)
+    fft_fit = np.zeros((Nsamples,Nwave,3))
+    for s0 in range(0, Nsamples, chunk_size):
+        s1 = min(s0+chunk_size, Nsamples)
+        i = triangles[s0:s1]
+        fft = np.matmul(data_2_fluxtiptilt[i],samples[s0:s1]) #flux tip tilt
+        fft_fit[s0:s1] = fft[:,:,:,0]
+        residual[s0:s1] = samples[s0:s1,:,:,0] - np.matmul(fluxtiptilt_2_data[i],fft)[:,:,:,0]
+
+    residual = residual.transpose((1,2,0)).reshape((Nwave,Noutput,Ncube,Nmod))
+    fft_fit = fft_fit.transpose((1,2,0)).reshape((Nwave,3,Ncube,Nmod))
     
     if size_cube == 2:
         residual = residual[:,:,0,0]
@@ -210,8 +348,112 @@ def make_image_grid(couplingMap, Npixels, xmod=[0], ymod=[0]):
     return grid_x, grid_y
 
 
+class InterpolationOperator:
+    """
+    Linear operator interpolating fluxes known at the coupling map positions onto a fixed grid.
+    The Delaunay triangulation and the interpolation weights (the response of the interpolator to
+    each position) are computed once, applying the operator is then a single matrix product.
+    Attributes:
+        xpos, ypos (numpy.ndarray): The positions of the coupling map.
+        grid_x, grid_y (numpy.ndarray): The 2D grid onto which the fluxes are interpolated.
+        method (str): 'cubic' (Clough-Tocher, as griddata) or 'linear' (barycentric weights).
+        max_cached (int): Number of shifted matrices kept in memory (one per modulation offset).
+                          Each cubic matrix is Ngrid x Npositions doubles (50 MB for a 100x100 grid
+                          and 625 positions), None keeps all of them.
+    """
+    def __init__(self, xpos, ypos, grid_x, grid_y, method='cubic', max_cached=4):
+        if not(method in ['cubic', 'linear']):
+            raise ValueError("Unknown interpolation method {}".format(method))
+        self.xpos = np.asarray(xpos, dtype=np.double)
+        self.ypos = np.asarray(ypos, dtype=np.double)
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.method = method
+        self.max_cached = max_cached
+        self.Npositions = len(self.xpos)
+        self.triangulation = Delaunay(np.array([self.xpos, self.ypos]).T)
+        self._interpolator = None
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    def _get_interpolator(self):
+        # the response to each position, the gradients of the cubic interpolator do not depend on the shift
+        if self._interpolator is None:
+            basis = np.eye(self.Npositions)
+            if self.method == 'cubic':
+                self._interpolator = CloughTocher2DInterpolator(self.triangulation, basis)
+            else:
+                self._interpolator = LinearNDInterpolator(self.triangulation, basis)
+        return self._interpolator
+
+    def matrix(self, xshift=0, yshift=0):
+        """
+        Returns the (Ngrid, Npositions) interpolation matrix for positions shifted by (-xshift, -yshift),
+        and the boolean mask of the grid points outside of the convex hull of the positions.
+        """
+        key = (float(xshift), float(yshift))
+        with self._lock:
+            if key in self._matrices:
+                return self._matrices[key]
+            return self._build_matrix(key, xshift, yshift)
+
+    def _build_matrix(self, key, xshift, yshift):
+        # interpolating at (xpos-xshift, ypos-yshift) on the grid is interpolating at (xpos, ypos) on the shifted grid
+        weights = self._get_interpolator()(self.grid_x + xshift, self.grid_y + yshift)
+        weights = weights.reshape((-1, self.Npositions))
+        outside = np.isnan(weights).any(axis=1)
+        weights[outside] = 0
+        if self.method == 'linear':
+            weights = sparse.csr_matrix(weights)
+        if (self.max_cached is not None) and (len(self._matrices) >= self.max_cached):
+            self._matrices.pop(next(iter(self._matrices)))
+        self._matrices[key] = (weights, outside)
+        return self._matrices[key]
+
+    def apply(self, fluxes, xshift=0, yshift=0):
+        """
+        Interpolates fluxes onto the grid.
+        Args:
+            fluxes (numpy.ndarray): Array of shape (Npositions, ...) with the fluxes at each position.
+            xshift, yshift (float): Modulation offset subtracted from the positions.
+        Returns:
+            numpy.ndarray: The maps, of shape (grid_x.shape + fluxes.shape[1:]). Points outside of
+                           the convex hull of the positions are set to NaN.
+        """
+        weights, outside = self.matrix(xshift, yshift)
+        batch_shape = fluxes.shape[1:]
+        maps = weights @ fluxes.reshape((self.Npositions, -1))
+        maps[outside] = np.nan
+        return maps.reshape(self.grid_x.shape + batch_shape)
+
+# operators of the last positions and grids used by make_image_maps
+_interpolation_operators = {}
+_max_interpolation_operators = 4
+_interpolation_operators_lock = threading.Lock()
+
+def get_interpolation_operator(xpos, ypos, grid_x, grid_y, method='cubic'):
+    """
+    Returns the InterpolationOperator of the positions and grid, built on first use and then kept
+    in memory (for the last 4 positions and grids used), so that the triangulation and the cubic
+    gradients are computed once per calibration and not at each call of make_image_maps. Each
+    operator keeps at most max_cached (4) shifted matrices.
+    """
+    sha = hashlib.sha1(method.encode())
+    for array in (xpos, ypos, grid_x, grid_y):
+        array = np.ascontiguousarray(array, dtype=np.double)
+        sha.update(str(array.shape).encode())
+        sha.update(array.tobytes())
+    key = sha.hexdigest()
+    with _interpolation_operators_lock:
+        if not(key in _interpolation_operators):
+            if len(_interpolation_operators) >= _max_interpolation_operators:
+                _interpolation_operators.pop(next(iter(_interpolation_operators)))
+            _interpolation_operators[key] = InterpolationOperator(xpos, ypos, grid_x, grid_y, method=method)
+        return _interpolation_operators[key]
+
 # Interpolate the fluxes onto the grid
-def make_image_maps(datacube, couplingMap, grid_x, grid_y, xmod= [0], ymod= [0], wavelength = False):
+def make_image_maps(datacube, couplingMap, grid_x, grid_y, xmod= [0], ymod= [0], wavelength = False, operator = None,
+                    Nthreads = 4, Nslab = 16, output_file = None, dtype = np.double):
     """
     Generate flux maps by interpolating fluxes from a datacube onto a specified grid.
     Parameters:
@@ -240,6 +482,15 @@ def make_image_maps(datacube, couplingMap, grid_x, grid_y, xmod= [0], ymod= [0],
         Modifications to apply to the x positions. Defaults to [0].
     ymod : list or numpy.ndarray, optional
         Modifications to apply to the y positions. Defaults to [0].
+    operator : InterpolationOperator, optional
+        Precomputed interpolation operator for (xpos, ypos, grid_x, grid_y). Building it is the
+        expensive part, so callers reconstructing many frames should create it once and pass it here.
+        If None, the cubic operator of the coupling map positions and grid is built on the first
+        call and reused by the next ones (see get_interpolation_operator).
+    Nthreads, Nslab, output_file, dtype : optional
+        Used when wavelength is True, see interpolate_flux_maps. With output_file, the maps of each
+        modulation are written to a memory-mapped .npy file, and are summed slab by slab so that
+        they are never all in memory.
     Returns:
     --------
     flux_maps_sum : numpy.ndarray
@@ -250,7 +501,8 @@ def make_image_maps(datacube, couplingMap, grid_x, grid_y, xmod= [0], ymod= [0],
         (Ncube, Nmod, Nwave, len(grid_x), len(grid_y)).
     Notes:
     ------
-    - The function uses cubic interpolation to map the fluxes onto the specified grid.
+    - The function uses cubic interpolation (the same Clough-Tocher scheme as griddata) to map the 
+      fluxes onto the specified grid, through a precomputed InterpolationOperator.
     - If the input datacube has fewer than 4 dimensions, it is reshaped to ensure compatibility.
     - The function handles NaN values by summing flux maps with `np.nansum`.
     """
@@ -285,28 +537,82 @@ def make_image_maps(datacube, couplingMap, grid_x, grid_y, xmod= [0], ymod= [0],
         fluxes = fluxes.mean(axis=0, keepdims=True)
         Nwave = 1
 
-    flux_maps = []
-    if wavelength == False:
-        for c in range(Ncube):
-            for m in range(Nmod):
-                for w in range(Nwave):
-                    # Interpolate the fluxes onto the grid
-                    flux_map = griddata((xpos-xmod[m], ypos-ymod[m]), fluxes[w,:,c,m], (grid_x, grid_y), method='cubic')
-                    flux_maps += [flux_map]
+    if operator is None:
+        operator = get_interpolation_operator(xpos, ypos, grid_x, grid_y)
+
+    if wavelength == True:
+        flux_maps = interpolate_flux_maps(fluxes, operator, xmod, ymod, Nthreads=Nthreads, Nslab=Nslab,
+                                          output_file=output_file, dtype=dtype)
+    else:
+        flux_maps = np.zeros((Ncube,Nmod,Nwave,len(grid_x),len(grid_y)))
+        for m in range(Nmod):
+            # Interpolate the fluxes of all cubes onto the grid at once
+            maps = operator.apply(fluxes[:,:,:,m].transpose((1,2,0)), xmod[m], ymod[m])
+            flux_maps[:,m] = maps.transpose((2,3,0,1))
+    if (wavelength == True) and (output_file is not None):
+        flux_maps_sum = np.zeros((Ncube,Nwave,len(grid_x),len(grid_y)), dtype=dtype)
+        for w0 in range(0, Nwave, Nslab):
+            flux_maps_sum[:,w0:w0+Nslab] = np.nansum(flux_maps[:,:,w0:w0+Nslab],axis=1)
     else:
-        for c in tqdm(range(Ncube)):
-            for m in range(Nmod):
-                for w in range(Nwave):
-                    # Interpolate the fluxes onto the grid
-                    flux_map = griddata((xpos-xmod[m], ypos-ymod[m]), fluxes[w,:,c,m], (grid_x, grid_y), method='cubic')
-                    flux_maps += [flux_map]
-    flux_maps = np.array(flux_maps).reshape((Ncube,Nmod,Nwave,len(grid_x),len(grid_y)))
-    flux_maps_sum = np.nansum(flux_maps,axis=1)
+        flux_maps_sum = np.nansum(flux_maps,axis=1)
     if size_cube == 2:
         flux_maps_sum = flux_maps_sum[0]
     
     return flux_maps_sum, fluxes
 
+def interpolate_flux_maps(fluxes, operator, xmod=[0], ymod=[0], Nthreads=4, Nslab=16, output_file=None, dtype=np.double):
+    """
+    Interpolates per-wavelength fluxes onto the grid of an InterpolationOperator, for every cube and modulation.
+    The output is preallocated, and the wavelengths are processed by slabs of Nslab channels in a pool
+    of Nthreads threads (the matrix products release the GIL).
+    Parameters:
+    -----------
+    fluxes : numpy.ndarray
+        The fluxes at each position, of shape (Nwave, Npositions, Ncube, Nmod).
+    operator : InterpolationOperator
+        The interpolation operator of the positions and grid.
+    xmod, ymod : list or numpy.ndarray, optional
+        Modulation offsets applied to the positions, one per modulation. Defaults to [0].
+    Nthreads : int, optional
+        Number of threads processing the wavelength slabs. Defaults to 4.
+    Nslab : int, optional
+        Number of wavelengths per slab. Defaults to 16.
+    output_file : str, optional
+        If given, the maps are streamed to a memory-mapped .npy file at this path instead of being kept in memory.
+    dtype : numpy.dtype, optional
+        The data type of the output maps. Defaults to double.
+    Returns:
+    --------
+    flux_maps : numpy.ndarray or numpy.memmap
+        The flux maps, of shape (Ncube, Nmod, Nwave, Nx, Ny).
+    """
+
+    Nwave, Npositions, Ncube, Nmod = fluxes.shape
+    Nx, Ny = operator.grid_x.shape
+    shape = (Ncube, Nmod, Nwave, Nx, Ny)
+
+    if output_file is None:
+        flux_maps = np.empty(shape, dtype=dtype)
+    else:
+        flux_maps = np.lib.format.open_memmap(output_file, mode='w+', dtype=dtype, shape=shape)
+
+    def process_slab(m, w0, w1):
+        maps = operator.apply(fluxes[w0:w1,:,:,m].transpose((1,2,0)), xmod[m], ymod[m])
+        flux_maps[:,m,w0:w1] = maps.transpose((2,3,0,1))
+
+    with ThreadPoolExecutor(max_workers=Nthreads) as pool:
+        for m in tqdm(range(Nmod)):
+            # build the matrix of this modulation once, before the threads use it
+            operator.matrix(xmod[m], ymod[m])
+            jobs = [pool.submit(process_slab, m, w0, min(w0+Nslab, Nwave)) for w0 in range(0, Nwave, Nslab)]
+            for job in jobs:
+                job.result()
+
+    if output_file is not None:
+        flux_maps.flush()
+
+    return flux_maps
+
 # Define a 2D Gaussian function
 def gaussian_2d(xy, amplitude, xo, yo, sigma, offset):
     x, y = xy
@@ -7,6 +7,7 @@ Created on Sun May 24 22:56:25 2015
 @author: slacour
 """
 import os
+import time
 import numpy as np
 from scipy import linalg
 from astropy.io import fits
@@ -20,6 +21,7 @@ from matplotlib import animation
 from matplotlib.backends.backend_pdf import PdfPages
 from datetime import datetime
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import runPL_library_basic as basic
 
 def create_movie_cross(datacube):
@@ -276,7 +278,7 @@ class DataCube:
     A class to represent a data cube.
     Attributes:
         data (numpy.ndarray): The data cube.
-        variance (numpy.ndarray): The variance of the data cube.
+        variance (numpy.ndarray): The variance of the data cube (None if not computed).
         header (astropy.io.fits.Header): The header information.
     """
 
@@ -305,10 +307,19 @@ class DataCube:
         size_new = (self.Ncube,self.Nmod,self.Noutput,self.Nwave)
         size_old = np.prod((self.Ndit,self.Noutput,self.Nwave))
 
+        if (self.Ncube*self.Nmod)==self.Ndit:
+            # nothing to pad, reshaping is enough (and does not copy the cube)
+            self.data=self.data.reshape(size_new)
+            if self.variance is not None:
+                self.variance=self.variance.reshape(size_new)
+            return
+
         data_padded=np.zeros(np.prod(size_new))
         data_padded[:size_old]=self.data.ravel()[:size_old]
         self.data=data_padded.reshape(size_new)
 
+        if self.variance is None:
+            return
         variance_padded=np.zeros(np.prod(size_new))
         variance_padded[:size_old]=self.variance.ravel()[:size_old]
         self.variance=variance_padded.reshape(size_new)
@@ -351,6 +362,25 @@ class DataCube:
 
         return good_triangles
 
+def get_dark(dark_file,header):
+    """
+    Returns the dark level and the dark standard deviation to use for a preprocessed file.
+    If dark_file is None, default values are computed from the header of the data.
+    """
+    if dark_file is not None:
+        data_dark=fits.getdata(dark_file)
+        if len(data_dark)==1:
+            data_dark=data_dark[0]
+            data_dark_std=data_dark[0]*0+12
+        else:
+            data_dark=data_dark.mean(axis=0)
+            data_dark_std=data_dark.std(axis=0)
+    else:
+        # using default values if we do not know the dark
+        data_dark=header["DETBIAS"]*(1+2*header["PIX_WIDE"])
+        data_dark_std=20
+    return data_dark,data_dark_std
+
 def extract_datacube(files_with_dark,Nsmooth = 1,Nbin = 1):
     """
     Extracts and processes data cubes from the input files.
@@ -372,18 +402,7 @@ def extract_datacube(files_with_dark,Nsmooth = 1,Nbin = 1):
         xmod=np.double(fits.getdata(data_file,'MODULATION').field('xmod'))
         ymod=np.double(fits.getdata(data_file,'MODULATION').field('ymod'))
 
-        if dark_file is not None:
-            data_dark=fits.getdata(dark_file)
-            if len(data_dark)==1:
-                data_dark=data_dark[0]
-                data_dark_std=data_dark[0]*0+12
-            else:
-                data_dark=data_dark.mean(axis=0)
-                data_dark_std=data_dark.std(axis=0)
-        else:
-            # using default values if we do not know the dark
-            data_dark=header["DETBIAS"]*(1+2*header["PIX_WIDE"])
-            data_dark_std=20
+        data_dark,data_dark_std=get_dark(dark_file,header)
         data-=data_dark
         gain=header['GAIN']
         data_var=data_dark_std**2+gain*np.abs(data)
@@ -412,6 +431,173 @@ def extract_datacube(files_with_dark,Nsmooth = 1,Nbin = 1):
     return datalist
 
 
+def extract_stacked_datacube(files_with_dark,Nsmooth = 1,Nbin = 1,modID = 0,modScale = None,
+                             variance = False,chunk_size = 64,dtype = np.double,output_file = None):
+    """
+    Streaming version of extract_datacube, for coupling maps built from many files.
+
+    The files are read and processed by chunks of chunk_size frames (dark subtraction,
+    smoothing and binning along the wavelength), straight into a single preallocated cube of
+    shape (Ncube, Nmod, Noutput, Nwave). The peak memory is therefore the final cube plus one
+    chunk, instead of several copies of every file.
+
+    Only the files with the modulation modID and modScale are kept. If modID is 0, the modulation
+    of the first file is used (with a warning if other files have another X_FIRMID), and if
+    modScale is None, the scale of the first matching file.
+    The variance cube is only computed if variance is True. If output_file is given, the cube is
+    written to a .npy memory map instead of being kept in memory.
+
+    Returns a DataCube holding the stacked cube (with the header and file name of the last file),
+    or None if no file matches.
+    """
+
+    # first pass: headers only, to select the files and get the final shape
+    headers={data_file:fits.getheader(data_file) for data_file in files_with_dark}
+    if modID == 0 and len(headers) > 0:
+        modIDs=[int(header.get('X_FIRMID', 0)) for header in headers.values()]
+        modID=modIDs[0]
+        if len(set(modIDs)) > 1:
+            print("WARNING, the files have different modulations (X_FIRMID %s)"%sorted(set(modIDs)))
+            print("only the %d files with the modulation %d of the first file are used"%(modIDs.count(modID),modID))
+    selected=[]
+    for data_file,dark_file in files_with_dark.items():
+        header=headers[data_file]
+        file_modID=int(header.get('X_FIRMID', 0))
+        file_modScale=int(header.get('X_FIRMSC', 1))
+        if modScale is None and file_modID == modID:
+            modScale=file_modScale
+        if file_modID != modID or file_modScale != modScale:
+            continue
+        xmod=np.double(fits.getdata(data_file,'MODULATION').field('xmod'))
+        ymod=np.double(fits.getdata(data_file,'MODULATION').field('ymod'))
+        selected += [(data_file,dark_file,header,xmod,ymod)]
+
+    if len(selected) == 0:
+        return None
+
+    xmod,ymod=selected[0][3],selected[0][4]
+    Nmod=len(xmod)
+    Noutput=selected[0][2]['NAXIS2']
+    Nwave_in=selected[0][2]['NAXIS1']
+    Nwave=Nwave_in//Nbin if Nbin > 1 else Nwave_in
+    Ncubes=[-(-header['NAXIS3']//Nmod) for data_file,dark_file,header,x,y in selected]
+
+    size_new=(np.sum(Ncubes)*Nmod,Noutput,Nwave)
+    if output_file is None:
+        data_out=np.zeros(size_new,dtype=dtype)
+    else:
+        data_out=np.lib.format.open_memmap(output_file,mode='w+',dtype=dtype,shape=size_new)
+    var_out=np.zeros(size_new,dtype=dtype) if variance else None
+
+    start=0
+    for (data_file,dark_file,header,x,y),Ncube in zip(selected,Ncubes):
+        if (header['NAXIS2'],header['NAXIS1'])!=(Noutput,Nwave_in) or len(x)!=Nmod:
+            raise Exception("File %s does not have the same shape as %s"%(data_file,selected[0][0]))
+        data_dark,data_dark_std=get_dark(dark_file,header)
+        gain=header['GAIN']
+        Ndit=header['NAXIS3']
+        if Ndit != Ncube*Nmod:
+            print("WARNING, CUBE not multiple of modulation pattern")
+            print("filling with zeros")
+
+        with fits.open(data_file,do_not_scale_image_data=True) as hdul:
+            # the section reads only the frames of the chunk from the file
+            raw=hdul[0].section
+            bscale=hdul[0].header.get('BSCALE',1)
+            bzero=hdul[0].header.get('BZERO',0)
+            for i in range(0,Ndit,chunk_size):
+                # important to cast the data in double!
+                data=np.double(raw[i:i+chunk_size])
+                if bscale != 1:
+                    data*=bscale
+                if bzero != 0:
+                    data+=bzero
+                data-=data_dark
+                if variance:
+                    data_var=data_dark_std**2+gain*np.abs(data)
+                if Nsmooth > 1:
+                    data = uniform_filter1d(data, size=Nsmooth, axis=2, mode='nearest')
+                    if variance:
+                        data_var = uniform_filter1d(data_var, size=Nsmooth, axis=2, mode='nearest')
+                if Nbin > 1:
+                    Nchunk=data.shape[0]
+                    data=data[:,:,:Nwave*Nbin].reshape((Nchunk,Noutput,Nwave,Nbin)).sum(axis=-1)
+                    if variance:
+                        data_var=data_var[:,:,:Nwave*Nbin].reshape((Nchunk,Noutput,Nwave,Nbin)).sum(axis=-1)
+                data_out[start+i:start+i+len(data)]=data
+                if variance:
+                    var_out[start+i:start+i+len(data)]=data_var
+        start+=Ncube*Nmod
+
+    if output_file is not None:
+        data_out.flush()
+
+    datacube=DataCube(data_out, var_out, selected[-1][0], selected[-1][2])
+    datacube.add_modulation(xmod,ymod)
+    datacube.filenames=[f[0] for f in selected]
+    return datacube
+
+def coadd_file(filename,chunk_size=64):
+    """
+    Sum all the frames of the image of a raw FITS file, in double.
+
+    Uncompressed images are memory-mapped and compressed images (CompImageHDU) are read through
+    their section, so only chunk_size frames are in memory at a time. The sum is done on the
+    stored integers, and BSCALE/BZERO are applied once to the result.
+
+    Returns the co-added image and the number of bytes of image data in the file.
+    """
+    with fits.open(filename,memmap=True,do_not_scale_image_data=True) as hdul:
+        hdu=[h for h in hdul if h.is_image and h.header.get('NAXIS',0) >= 2][0]
+        raw=hdu.section if isinstance(hdu,fits.CompImageHDU) else hdu.data
+        shape=hdu.shape
+        bscale=hdu.header.get('BSCALE',1)
+        bzero=hdu.header.get('BZERO',0)
+        nbytes=int(np.prod(shape))*abs(hdu.header['BITPIX'])//8
+        if len(shape) == 2:
+            # a single frame
+            coadd=np.double(raw[:,:])
+            Nframes=1
+        else:
+            Nframes=shape[0]
+            coadd=np.zeros(shape[-2:],dtype=np.double)
+            for i in range(0,Nframes,chunk_size):
+                coadd+=np.sum(raw[i:i+chunk_size],axis=0,dtype=np.double)
+        del raw
+    if bscale != 1:
+        coadd*=bscale
+    if bzero != 0:
+        coadd+=Nframes*bzero
+    return coadd,nbytes
+
+def coadd_files(filelist,chunk_size=64,Nthreads=4,use_processes=False):
+    """
+    Co-add all the frames of a list of raw FITS files (see coadd_file).
+
+    The files are read and summed concurrently by Nthreads threads (reading the files and the
+    sums release the GIL), or processes if use_processes is True. The images of the files are
+    added in the order of the list, so the result does not depend on Nthreads. The throughput
+    (MB of image data read per second) is printed.
+    """
+    t0=time.time()
+    Executor=ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    coadd=None
+    nbytes=0
+    with Executor(max_workers=Nthreads) as pool:
+        jobs=[pool.submit(coadd_file,filename,chunk_size) for filename in filelist]
+        for filename,job in zip(filelist,tqdm(jobs,desc="Co-adding files")):
+            image,n=job.result()
+            if coadd is None:
+                coadd=image
+            elif coadd.shape != image.shape:
+                raise Exception("File %s does not have the same shape as %s"%(filename,filelist[0]))
+            else:
+                coadd+=image
+            nbytes+=n
+    duration=time.time()-t0
+    print("Co-added %d files (%.1f MB) in %.2f s: %.1f MB/s"%(len(filelist),nbytes/1e6,duration,nbytes/1e6/max(duration,1e-9)))
+    return coadd
+
 def resize_and_shift(flux, masque, dither_x, dither_y):
     """
     Resize and shift a 2D or 3D flux map based on dither offsets and a mask.
@@ -475,10 +661,20 @@ def resize_and_shift(flux, masque, dither_x, dither_y):
 
     return image_2d_bigger
 
-def get_chi2_maps(datacube,fluxtiptilt_2_data,data_2_fluxtiptilt):
+def get_chi2_maps(datacube,fluxtiptilt_2_data,data_2_fluxtiptilt,chunk_size=512,Nthreads=1,projector=False):
     """
     Calculates chi-squared maps to evaluate the fit of the data to the model.
     Returns the minimum chi-squared, maximum chi-squared, and the chi-squared map.
+    The residual of each triangle is never formed, the general form, with the fit f = A.b, is used:
+        ||b - C.f||^2 = ||b||^2 - 2 f.(C^T b) + f.(C^T C).f
+    If projector is True and data_2_fluxtiptilt is the pseudo-inverse of fluxtiptilt_2_data (as
+    built by CM_get_fluxtiptilt_matrices), the fit is the orthogonal projection on the columns of C and
+        ||b - C.A.b||^2 = ||b||^2 - ||Q^T.b||^2
+    with Q an orthonormal basis of C, which saves two of the three products. An exception is raised
+    if data_2_fluxtiptilt is not that pseudo-inverse (regularised or clipped reconstructor).
+    Both only need 3-row products, computed for all triangles with one matrix product per
+    wavelength. Samples are processed by chunks of chunk_size to bound the memory, and the
+    triangles can be split over Nthreads threads.
     """
 
     print("Computing chi2 of observations for each triangle :")
@@ -487,16 +683,51 @@ def get_chi2_maps(datacube,fluxtiptilt_2_data,data_2_fluxtiptilt):
     Ncube=datacube.shape[2]
     Nmod=datacube.shape[3]
     Ntriangles=data_2_fluxtiptilt.shape[0]
-    # Nmodel = postiptilt_2_data.shape[0]
-
-    chi2=np.zeros((Ntriangles,Ncube*Nmod))
-    b=datacube.reshape(Nwave,Noutput,Ncube*Nmod)
-    for t in tqdm(range(Ntriangles)):
-        a=data_2_fluxtiptilt[t]
-        c=fluxtiptilt_2_data[t]
-        ftt=np.matmul(a,b)
-        residual = (b-np.matmul(c,ftt))**2
-        chi2[t]= residual.sum(axis=(0,1))
+    Nsamples=Ncube*Nmod
+
+    b=datacube.reshape(Nwave,Noutput,Nsamples)
+    b_norm=(b**2).sum(axis=(0,1))
+
+    # low rank factors, stacked over the triangles for each wavelength
+    if projector:
+        # orthonormal basis of the columns of C, with the rank cut-off used by pinv
+        u,sv,vh=np.linalg.svd(fluxtiptilt_2_data,full_matrices=False)
+        rank_cut=sv > sv[...,:1]*max(Noutput,3)*np.finfo(sv.dtype).eps
+        # the projection is only the fit of data_2_fluxtiptilt if it is the pseudo-inverse of C
+        inv_sv=np.where(rank_cut,1/np.where(rank_cut,sv,1),0)
+        pinv_c=np.matmul(vh.transpose((0,1,3,2))*inv_sv[...,None,:],u.transpose((0,1,3,2)))
+        if not(np.allclose(data_2_fluxtiptilt,pinv_c,rtol=1e-6,atol=1e-6*np.abs(pinv_c).max())):
+            raise Exception("data_2_fluxtiptilt is not the pseudo-inverse of fluxtiptilt_2_data, use projector=False")
+        q_t=(u*rank_cut[...,None,:]).transpose((1,0,3,2)).reshape((Nwave,Ntriangles*3,Noutput))
+    else:
+        a=data_2_fluxtiptilt.transpose((1,0,2,3)).reshape((Nwave,Ntriangles*3,Noutput))
+        c_t=fluxtiptilt_2_data.transpose((1,0,3,2)).reshape((Nwave,Ntriangles*3,Noutput))
+        gram=np.matmul(fluxtiptilt_2_data.transpose((0,1,3,2)),fluxtiptilt_2_data).transpose((1,0,2,3))
+
+    chi2=np.zeros((Ntriangles,Nsamples))
+
+    def process_block(t0,t1,s0,s1):
+        for w in range(Nwave):
+            bw=b[w,:,s0:s1]
+            if projector:
+                qtb=np.matmul(q_t[w,3*t0:3*t1],bw).reshape((t1-t0,3,s1-s0))
+                chi2[t0:t1,s0:s1]-=(qtb**2).sum(axis=1)
+            else:
+                ftt=np.matmul(a[w,3*t0:3*t1],bw).reshape((t1-t0,3,s1-s0))
+                ctb=np.matmul(c_t[w,3*t0:3*t1],bw).reshape((t1-t0,3,s1-s0))
+                chi2[t0:t1,s0:s1]+=((np.matmul(gram[w,t0:t1],ftt)-2*ctb)*ftt).sum(axis=1)
+        chi2[t0:t1,s0:s1]+=b_norm[s0:s1]
+
+    triangle_blocks=np.linspace(0,Ntriangles,Nthreads+1).astype(int)
+    with ThreadPoolExecutor(max_workers=Nthreads) as pool:
+        for s0 in tqdm(range(0,Nsamples,chunk_size)):
+            s1=min(s0+chunk_size,Nsamples)
+            jobs=[pool.submit(process_block,t0,t1,s0,s1) for t0,t1 in zip(triangle_blocks[:-1],triangle_blocks[1:]) if t1>t0]
+            for job in jobs:
+                job.result()
+
+    # the differences of the expanded forms can round below zero
+    np.maximum(chi2,0,out=chi2)
 
     arg_triangle=chi2.argmin(axis=0)
     # best_ftt = np.array([ftt[best_model[n],:,:,n] for n in range(Ncube*Nmod)])
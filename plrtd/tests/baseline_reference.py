@@ -0,0 +1,86 @@
+"""
+The implementations of the runPL libraries before they were vectorised, kept as the reference of
+the benchmarks in this folder.
+"""
+import numpy as np
+from astropy.io import fits
+
+def preprocess_cutData(data, pixelMap, dark_calculation=False):
+    # triple loop over wavelength, output channel and window, as in the original runPL_library_basic
+    pixel_min = pixelMap.pixel_min
+    pixel_max = pixelMap.pixel_max
+    pixel_wide = pixelMap.pixel_wide
+    output_channels = pixelMap.output_channels
+    traces_loc = pixelMap.traces_loc
+
+    Nwave = pixel_max - pixel_min
+    window_size = (pixel_wide * 2 + 1)
+
+    add_dimension_for_cubelike_data = False
+    if len(data.shape) == 2:
+        add_dimension_for_cubelike_data = True
+        data = data[None]
+
+    Nimages = data.shape[0]
+
+    data_cut_pixels = np.zeros((Nimages, output_channels, Nwave, window_size), dtype='uint16')
+    data_dark_pixels = np.zeros((Nimages, output_channels - 1, Nwave), dtype='uint16')
+    for x in range(Nwave):
+        for i in range(output_channels):
+            for w in range(pixel_wide*2+1):
+                t=traces_loc[x + pixel_min, i]+w-pixel_wide
+                if t<0:
+                    t=0
+                if t>=data.shape[1]:
+                    t=data.shape[1]-1
+                data_cut_pixels[:,i,x,w] = data[:, t, x + pixel_min]
+            if (i > 0)&(dark_calculation):
+                t=(traces_loc[x + pixel_min, i-1]+traces_loc[x + pixel_min, i])//2+w-pixel_wide
+                data_dark_pixels[:,i-1,x] = data[:, t, x + pixel_min]
+
+    if add_dimension_for_cubelike_data:
+        data_cut_pixels = data_cut_pixels[0]
+        data_dark_pixels = data_dark_pixels[0]
+
+    return data_cut_pixels, data_dark_pixels
+
+def make_image_source_removal(datacube, arg_triangle, couplingMap):
+    # one pair of products per (cube, modulation) sample, as in the original runPL_library_basic
+    size_cube = len(datacube.shape)
+    if size_cube == 3:
+        datacube = datacube[:, :, :, np.newaxis]
+    if size_cube == 2:
+        datacube = datacube[:, :, np.newaxis, np.newaxis]
+
+    Nwave = datacube.shape[0]
+    Ncube = datacube.shape[2]
+    Nmod = datacube.shape[3]
+
+    fluxtiptilt_2_data = couplingMap.fluxtiptilt_2_data
+    data_2_fluxtiptilt = couplingMap.data_2_fluxtiptilt
+
+    residual = datacube.copy()
+    fft_fit = np.zeros((Nwave,3,Ncube,Nmod))
+    for c in range(Ncube):
+        for m in range(Nmod):
+            i = arg_triangle[c,m]
+            fft = np.matmul(data_2_fluxtiptilt[i],datacube[:,:,c,m,None]) #flux tip tilt
+            fft_fit[:,:,c,m] = fft[:,:,0]
+            residual[:,:,c,m] -= np.matmul(fluxtiptilt_2_data[i],fft)[:,:,0]
+
+    if size_cube == 2:
+        residual = residual[:,:,0,0]
+        fft_fit = fft_fit[:,:,0,0]
+    if size_cube == 3:
+        residual = residual[:,:,:,0]
+        fft_fit = fft_fit[:,:,:,0]
+
+    return residual, fft_fit
+
+def coadd_files(filelist):
+    # the co-addition of run_PX_create_pixel_map_from_a_list_of_fits_files in the original quick_cm
+    header = fits.getheader(filelist[-1])
+    raw_image = np.zeros((header['NAXIS2'], header['NAXIS1']), dtype=np.double)
+    for filename in filelist:
+        raw_image += fits.getdata(filename).sum(axis=0)
+    return raw_image
@@ -0,0 +1,60 @@
+"""
+Time, throughput and peak memory (tracemalloc) of the co-addition of the raw files of a pixel map,
+the original getdata().sum loop against coadd_files, on synthetic uint16 cubes (stored with
+BZERO=32768 as the camera files) written to a temporary folder. The files are read once before
+timing, so the page cache is warm.
+
+usage:
+    python tests/bench_coadd.py [Nfiles]
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+from astropy.io import fits
+import conftest # puts the plrtd folder in the path
+import runPL_library_imaging as runlib_i
+import baseline_reference
+
+NFRAMES = 200
+NROWS = 256
+NCOLS = 1024
+
+def write_files(folder, Nfiles):
+    rng = np.random.default_rng(0)
+    filelist = []
+    for k in range(Nfiles):
+        filename = os.path.join(folder, "raw_{:02d}.fits".format(k))
+        fits.PrimaryHDU(rng.integers(0, 1 << 16, (NFRAMES, NROWS, NCOLS), dtype=np.uint16)).writeto(filename)
+        filelist.append(filename)
+    return filelist
+
+def measure(function, *args, **kwargs):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = function(*args, **kwargs)
+    duration = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, duration, peak
+
+if __name__ == "__main__":
+    Nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    with tempfile.TemporaryDirectory() as folder:
+        filelist = write_files(folder, Nfiles)
+        nbytes = sum([os.path.getsize(filename) for filename in filelist])
+        for filename in filelist:
+            with open(filename, "rb") as f:
+                while f.read(1 << 24):
+                    pass
+        reference = sum([np.asarray(fits.getdata(filename), dtype=np.int64).sum(axis=0) for filename in filelist])
+        print("{} files of {}x{}x{} uint16, {:.0f} MB".format(Nfiles, NFRAMES, NROWS, NCOLS, nbytes/1e6))
+        runs = [("old getdata().sum loop", baseline_reference.coadd_files, {}),
+                ("coadd_files Nthreads=1", runlib_i.coadd_files, {"Nthreads": 1}),
+                ("coadd_files Nthreads=4", runlib_i.coadd_files, {"Nthreads": 4})]
+        for name, function, kwargs in runs:
+            coadd, duration, peak = measure(function, filelist, **kwargs)
+            print("{:24s}: {:5.2f} s, {:5.0f} MB/s, peak {:4.0f} MB, equal to the int64 sum: {}".format(
+                  name, duration, nbytes/1e6/duration, peak/1e6, np.array_equal(coadd, reference)))
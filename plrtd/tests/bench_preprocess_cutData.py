@@ -0,0 +1,56 @@
+"""
+Extraction time of preprocess_cutData on synthetic frames of the size of the FIRST-PL detector,
+the original triple loop against the flat-index gather, with the indices computed at each call
+(plain pixel map object) or read from the cached ExtractionPlan of a PixelMap.
+
+usage:
+    python tests/bench_preprocess_cutData.py
+"""
+import time
+import types
+import numpy as np
+import conftest # puts the plrtd folder in the path
+import runPL_library_basic as basic
+import baseline_reference
+
+NROWS = 412
+NCOLS = 1896
+NREPEAT = 5
+
+def pixel_map(output_channels = 38, pixel_min = 100, pixel_max = 1600, pixel_wide = 2):
+    # straight traces with a small slope, 10 rows apart
+    columns = np.arange(NCOLS)
+    traces_loc = np.array([15 + 10*i + columns//400 for i in range(output_channels)]).T
+    return types.SimpleNamespace(traces_loc = traces_loc, pixel_min = pixel_min, pixel_max = pixel_max,
+                                 pixel_wide = pixel_wide, output_channels = output_channels)
+
+def cached_pixel_map(pixelMap):
+    # a PixelMap without file, so that the extraction plan is built once and kept
+    cached = basic.PixelMap.__new__(basic.PixelMap)
+    cached.__dict__.update(pixelMap.__dict__)
+    cached.plan_file = None
+    cached._plan = basic.ExtractionPlan(pixelMap, NROWS, NCOLS)
+    return cached
+
+def best_time(function, *args):
+    times = []
+    for i in range(NREPEAT):
+        t0 = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    pixelMap = pixel_map()
+    cached = cached_pixel_map(pixelMap)
+    for Nimages in [1, 20]:
+        data = rng.integers(0, 1 << 16, (Nimages, NROWS, NCOLS)).astype(np.uint16)
+        if Nimages == 1:
+            data = data[0]
+        t_loop, (cut_loop, dark_loop) = best_time(baseline_reference.preprocess_cutData, data, pixelMap, True)
+        t_gather, (cut, dark) = best_time(basic.preprocess_cutData, data, pixelMap, True)
+        t_plan, (cut_plan, dark_plan) = best_time(basic.preprocess_cutData, data, cached, True)
+        identical = all([np.array_equal(a, b) for a, b in [(cut, cut_loop), (dark, dark_loop), (cut_plan, cut_loop), (dark_plan, dark_loop)]])
+        print("{:2d} frame(s) {}x{}: loop {:7.1f} ms, gather {:6.2f} ms, cached plan {:6.2f} ms, identical: {}".format(
+              Nimages, NROWS, NCOLS, 1e3*t_loop, 1e3*t_gather, 1e3*t_plan, identical))
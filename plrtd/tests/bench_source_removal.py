@@ -0,0 +1,45 @@
+"""
+Time of make_image_source_removal on a synthetic coupling map and cube, the original loop over the
+(cube, modulation) samples against the chunked version, for several chunk sizes.
+
+usage:
+    python tests/bench_source_removal.py
+"""
+import time
+import types
+import numpy as np
+import conftest # puts the plrtd folder in the path
+import runPL_library_basic as basic
+import baseline_reference
+
+NTRIANGLES = 1100
+NWAVE = 100
+NOUTPUT = 38
+NCUBE = 10
+NMOD = 625
+NREPEAT = 3
+
+def best_time(function, *args, **kwargs):
+    times = []
+    for i in range(NREPEAT):
+        t0 = time.perf_counter()
+        result = function(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    fluxtiptilt_2_data = rng.standard_normal((NTRIANGLES, NWAVE, NOUTPUT, 3))
+    couplingMap = types.SimpleNamespace(fluxtiptilt_2_data = fluxtiptilt_2_data,
+                                        data_2_fluxtiptilt = np.linalg.pinv(fluxtiptilt_2_data))
+    datacube = rng.standard_normal((NWAVE, NOUTPUT, NCUBE, NMOD))
+    arg_triangle = rng.integers(0, NTRIANGLES, (NCUBE, NMOD))
+
+    print("{} triangles, {} wavelengths, {} outputs, {} cubes x {} modulations, best of {}".format(
+          NTRIANGLES, NWAVE, NOUTPUT, NCUBE, NMOD, NREPEAT))
+    t_loop, (residual_loop, fft_loop) = best_time(baseline_reference.make_image_source_removal, datacube, arg_triangle, couplingMap)
+    print("loop               : {:6.3f} s".format(t_loop))
+    for chunk_size in [1, 16, 64, 256]:
+        t, (residual, fft_fit) = best_time(basic.make_image_source_removal, datacube, arg_triangle, couplingMap, chunk_size = chunk_size)
+        identical = np.array_equal(residual, residual_loop) and np.array_equal(fft_fit, fft_loop)
+        print("chunk_size {:3d}     : {:6.3f} s ({:4.2f}x), identical: {}".format(chunk_size, t, t_loop/t, identical))
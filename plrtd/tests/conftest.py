@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the runPL libraries and quick_cm are imported from the plrtd folder, as in the RTD scripts
+PLRTD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not(PLRTD_DIR in sys.path):
+    sys.path.insert(0, PLRTD_DIR)
@@ -0,0 +1,86 @@
+"""
+Numerical equivalence of the stacked linear algebra of quick_cm with the per-matrix loops it replaced.
+"""
+import numpy as np
+from scipy.linalg import pinv
+from scipy.spatial import Delaunay
+import quick_cm
+
+def pinv_loop(matrices):
+    # reference: scipy.linalg.pinv on each matrix, as CM_get_fluxtiptilt_matrices used to do
+    inverse = np.zeros(matrices.shape[:-2]+matrices.shape[:-3:-1])
+    for index in np.ndindex(matrices.shape[:-2]):
+        inverse[index] = pinv(matrices[index])
+    return inverse
+
+def relative_error(a, b):
+    return np.max(np.abs(a-b))/np.max(np.abs(b))
+
+def test_stacked_pinv_tall():
+    rng = np.random.default_rng(0)
+    # (Ntriangles, Nwave, Noutput, 3) flux/tip/tilt matrices
+    matrices = rng.random((40, 10, 38, 3))
+    reference = pinv_loop(matrices)
+    for method in ['svd', 'normal']:
+        assert relative_error(quick_cm.CM_stacked_pinv(matrices, method=method), reference) < 1e-10, method
+
+def test_stacked_pinv_rank_deficient():
+    rng = np.random.default_rng(1)
+    matrices = rng.random((20, 38, 3))
+    # rank 2 and rank 1 matrices, which the normal equations cannot invert
+    matrices[::3, :, 2] = matrices[::3, :, 0]
+    matrices[1::5, :, 1:] = matrices[1::5, :, :1]
+    reference = pinv_loop(matrices)
+    for method in ['svd', 'normal']:
+        assert relative_error(quick_cm.CM_stacked_pinv(matrices, method=method), reference) < 1e-8, method
+
+def test_stacked_pinv_wide(monkeypatch):
+    rng = np.random.default_rng(2)
+    # (Nwave, Noutput, Npositions) flux matrices
+    matrices = rng.random((5, 38, 200))
+    reference = pinv_loop(matrices)
+    # the wide stacks go to the SVD without forming the Gram and its eigenvalues
+    def eigvalsh(*args, **kwargs):
+        raise AssertionError("eigvalsh called on a wide stack")
+    monkeypatch.setattr(np.linalg, "eigvalsh", eigvalsh)
+    for method in ['svd', 'normal']:
+        assert relative_error(quick_cm.CM_stacked_pinv(matrices, method=method), reference) < 1e-10, method
+
+def fluxtiptilt_matrices_loop(singular_2_data, pos_2_singular_mean, triangles):
+    # the per-matrix loops of CM_get_fluxtiptilt_matrices before the stacked pseudo-inverses
+    Nsingular, Nmod = pos_2_singular_mean.shape
+    Nwave, Noutput = singular_2_data.shape[:2]
+    masque_positions = ~np.isnan(pos_2_singular_mean[0])
+    masque_triangles = (masque_positions[triangles].sum(axis=1) == 3)
+    flux_2_data_tmp = (singular_2_data.reshape((Nwave*Noutput, Nsingular)) @ pos_2_singular_mean).reshape((Nwave, Noutput, Nmod))
+    flux_2_data = flux_2_data_tmp[:, :, masque_positions]
+    flux_2_data /= flux_2_data.sum(axis=(1, 2), keepdims=True)
+    data_2_flux = np.array([pinv(flux_2_data[w]) for w in range(Nwave)])
+    fluxtiptilt_2_data = flux_2_data_tmp[:, :, triangles[masque_triangles]].transpose((2, 0, 1, 3))
+    data_2_fluxtiptilt = np.array([[pinv(fluxtiptilt_2_data[t, w]) for w in range(Nwave)] for t in range(len(fluxtiptilt_2_data))])
+    return data_2_flux, data_2_fluxtiptilt
+
+def test_fluxtiptilt_matrices():
+    rng = np.random.default_rng(3)
+    Nwave, Noutput, Nsingular, Nmod = 6, 38, 20, 100
+    singular_2_data = rng.random((Nwave, Noutput, Nsingular))
+    pos_2_singular_mean = rng.random((Nsingular, Nmod))
+    pos_2_singular_mean[:, :5] = np.nan
+    triangles = Delaunay(rng.random((Nmod, 2))).simplices
+    data_2_flux_ref, data_2_fluxtiptilt_ref = fluxtiptilt_matrices_loop(singular_2_data, pos_2_singular_mean, triangles)
+    for method in ['svd', 'normal']:
+        result = quick_cm.CM_get_fluxtiptilt_matrices(singular_2_data, pos_2_singular_mean, triangles, pinv_method=method)
+        assert relative_error(result[1], data_2_flux_ref) < 1e-8, method
+        assert relative_error(result[3], data_2_fluxtiptilt_ref) < 1e-8, method
+
+def test_truncated_svd_gram_rank_deficient():
+    rng = np.random.default_rng(4)
+    # tall rank 5 matrix: the Gram branch divides by the singular values
+    matrix = rng.random((300, 5)) @ rng.random((5, 40))
+    U_full, s_full = quick_cm.CM_truncated_svd(matrix, 10, method='full')
+    U, s = quick_cm.CM_truncated_svd(matrix, 10, method='gram')
+    assert np.all(np.isfinite(U))
+    assert np.allclose(s[:5], s_full[:5])
+    # same leading singular vectors (up to their sign), zero columns for the null space
+    assert np.allclose(np.abs(np.sum(U[:, :5]*U_full[:, :5], axis=0)), 1)
+    assert np.all(U[:, 5:] == 0)
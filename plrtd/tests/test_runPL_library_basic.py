@@ -0,0 +1,32 @@
+"""
+Interpolation operator of the flux maps and its cache of shifted matrices.
+"""
+import numpy as np
+import types
+from scipy.interpolate import griddata
+import runPL_library_basic as basic
+
+def coupling_map(Npositions = 40, Noutput = 5, seed = 0):
+    # random positions, a regular grid has no unique Delaunay triangulation
+    rng = np.random.default_rng(seed)
+    x, y = rng.uniform(-1, 1, (2, Npositions))
+    return types.SimpleNamespace(xpos = x, ypos = y, Npositions = Npositions,
+                                 data_2_flux = rng.standard_normal((Npositions, Noutput)))
+
+def test_make_image_maps_bounded_cache():
+    couplingMap = coupling_map()
+    Nmod = 10
+    xmod = np.linspace(-0.2, 0.2, Nmod)
+    ymod = np.linspace(0.1, -0.1, Nmod)
+    grid_x, grid_y = basic.make_image_grid(couplingMap, 20, xmod, ymod)
+    datacube = np.random.default_rng(1).standard_normal((3, 5, 2, Nmod))
+    operator = basic.InterpolationOperator(couplingMap.xpos, couplingMap.ypos, grid_x, grid_y)
+    flux_maps_sum, fluxes = basic.make_image_maps(datacube, couplingMap, grid_x, grid_y, xmod, ymod, operator = operator)
+    assert len(operator._matrices) <= operator.max_cached
+    # same maps as griddata on the shifted positions
+    for m in [0, Nmod-1]:
+        reference = griddata((couplingMap.xpos - xmod[m], couplingMap.ypos - ymod[m]), fluxes[0, :, 1, m],
+                             (grid_x, grid_y), method = 'cubic')
+        maps = operator.apply(fluxes[0, :, 1, m], xmod[m], ymod[m])
+        # the gradients of the Clough-Tocher interpolator are estimated iteratively, to 1e-6
+        assert np.allclose(maps, reference, atol = 1e-6, equal_nan = True)
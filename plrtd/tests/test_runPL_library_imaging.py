@@ -0,0 +1,93 @@
+"""
+Selection of the files by modulation in extract_stacked_datacube.
+"""
+import numpy as np
+import pytest
+from astropy.io import fits
+import runPL_library_imaging as runlib_i
+
+Nmod = 4
+Noutput = 3
+Nwave = 5
+
+def write_file(path, modID, modScale = 1, Ncube = 2):
+    header = fits.Header()
+    header['X_FIRMID'] = modID
+    header['X_FIRMSC'] = modScale
+    header['GAIN'] = 1.
+    header['DETBIAS'] = 0.
+    header['PIX_WIDE'] = 0
+    data = np.full((Ncube*Nmod, Noutput, Nwave), modID, dtype=np.float32)
+    xmod = np.arange(Nmod, dtype=np.double)
+    modulation = fits.BinTableHDU.from_columns([fits.Column(name='xmod', format='D', array=xmod),
+                                                fits.Column(name='ymod', format='D', array=-xmod)],
+                                               name='MODULATION')
+    fits.HDUList([fits.PrimaryHDU(data, header), modulation]).writeto(path)
+    return str(path)
+
+def test_mixed_modulations_warn(tmp_path, capsys):
+    files_with_dark = {write_file(tmp_path/"a.fits", 3): None,
+                       write_file(tmp_path/"b.fits", 7): None,
+                       write_file(tmp_path/"c.fits", 3): None}
+    # the modulation of the first file is used
+    stacked = runlib_i.extract_stacked_datacube(files_with_dark)
+    assert "X_FIRMID" in capsys.readouterr().out
+    assert stacked.modID == 3
+    assert stacked.data.shape == (4, Nmod, Noutput, Nwave)
+    assert np.all(stacked.data == 3)
+
+def test_modulation_selection(tmp_path):
+    files_with_dark = {write_file(tmp_path/"a.fits", 3): None,
+                       write_file(tmp_path/"b.fits", 7): None,
+                       write_file(tmp_path/"c.fits", 7): None}
+    stacked = runlib_i.extract_stacked_datacube(files_with_dark, modID = 7)
+    assert stacked.data.shape == (4, Nmod, Noutput, Nwave)
+    assert np.all(stacked.data == 7)
+    # a single modulation in the files does not need modID
+    stacked = runlib_i.extract_stacked_datacube({path: None for path in list(files_with_dark)[1:]})
+    assert stacked.modID == 7
+    assert stacked.data.shape == (4, Nmod, Noutput, Nwave)
+
+def chi2_loop(datacube, fluxtiptilt_2_data, data_2_fluxtiptilt):
+    # reference: the residual of every triangle and sample
+    Nwave, Noutput, Ncube, Nmod = datacube.shape
+    b = datacube.reshape((Nwave, Noutput, Ncube*Nmod))
+    chi2 = np.zeros((fluxtiptilt_2_data.shape[0], Ncube*Nmod))
+    for t in range(fluxtiptilt_2_data.shape[0]):
+        for w in range(Nwave):
+            residual = b[w] - fluxtiptilt_2_data[t, w] @ (data_2_fluxtiptilt[t, w] @ b[w])
+            chi2[t] += (residual**2).sum(axis=0)
+    return chi2.min(axis=0).reshape((Ncube, Nmod)), chi2.argmin(axis=0).reshape((Ncube, Nmod))
+
+def test_chi2_maps():
+    rng = np.random.default_rng(0)
+    Ntriangles, Nwave, Noutput, Ncube, Nmod = 7, 3, 6, 2, 5
+    fluxtiptilt_2_data = rng.standard_normal((Ntriangles, Nwave, Noutput, 3))
+    datacube = rng.standard_normal((Nwave, Noutput, Ncube, Nmod))
+    # a regularised reconstructor, which is not the pseudo-inverse
+    regularised = np.linalg.solve(np.swapaxes(fluxtiptilt_2_data, -1, -2) @ fluxtiptilt_2_data + 0.5*np.eye(3),
+                                  np.swapaxes(fluxtiptilt_2_data, -1, -2))
+    chi2_min, chi2_max, arg_triangle = runlib_i.get_chi2_maps(datacube, fluxtiptilt_2_data, regularised)
+    reference_min, reference_arg = chi2_loop(datacube, fluxtiptilt_2_data, regularised)
+    assert np.allclose(chi2_min, reference_min)
+    assert np.array_equal(arg_triangle, reference_arg)
+    with pytest.raises(Exception, match="pseudo-inverse"):
+        runlib_i.get_chi2_maps(datacube, fluxtiptilt_2_data, regularised, projector = True)
+    # with the pseudo-inverse, the projector gives the same chi2
+    pseudo_inverse = np.linalg.pinv(fluxtiptilt_2_data)
+    reference_min, reference_arg = chi2_loop(datacube, fluxtiptilt_2_data, pseudo_inverse)
+    for projector in [False, True]:
+        chi2_min, chi2_max, arg_triangle = runlib_i.get_chi2_maps(datacube, fluxtiptilt_2_data, pseudo_inverse, projector = projector)
+        assert np.allclose(chi2_min, reference_min)
+        assert np.array_equal(arg_triangle, reference_arg)
+
+def test_chi2_maps_not_negative():
+    # data in the span of every model, the chi2 is zero up to rounding
+    rng = np.random.default_rng(1)
+    fluxtiptilt_2_data = np.repeat(rng.standard_normal((1, 2, 6, 3)), 4, axis=0)*1e3
+    datacube = (fluxtiptilt_2_data[0] @ rng.standard_normal((2, 3, 10))).reshape((2, 6, 2, 5))
+    for projector in [False, True]:
+        chi2_min, chi2_max, arg_triangle = runlib_i.get_chi2_maps(datacube, fluxtiptilt_2_data,
+                                                                   np.linalg.pinv(fluxtiptilt_2_data), projector = projector)
+        assert np.all(chi2_min >= 0)
+        assert np.all(chi2_max >= 0)